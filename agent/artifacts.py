@@ -0,0 +1,64 @@
+import hashlib
+import re
+from pathlib import Path
+from .config import ARTIFACTS_CONFIG
+from .timestamp import get_current_run_timestamp
+
+ARTIFACT_DIR = Path("data") / "artifacts"
+
+SPILL_ENABLE = ARTIFACTS_CONFIG.get("enable", False)
+DEFAULT_MAX_CHARS = ARTIFACTS_CONFIG.get("default_max_chars", 20000)
+PREVIEW_LINES = ARTIFACTS_CONFIG.get("preview_lines", 20)
+TOOL_MAX_CHARS = ARTIFACTS_CONFIG.get("tools", None) or {}
+
+HANDLE_PATTERN = re.compile(r"^[A-Za-z0-9_\-]+$")
+
+def get_run_artifact_dir() -> Path:
+    return ARTIFACT_DIR / get_current_run_timestamp()
+
+def save_artifact(content: str, kind: str) -> str:
+    """Save text that was kept out of an agent's context under the run's artifact directory,
+    and return its handle."""
+    digest = hashlib.sha256(content.encode("utf-8")).hexdigest()[:12]
+    handle = f"{kind}_{digest}"
+    path = get_run_artifact_dir() / f"{handle}.txt"
+    if not path.exists():
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(content, encoding="utf-8")
+    return handle
+
+def load_artifact(handle: str) -> str | None:
+    handle = handle.strip().strip("`")
+    if not HANDLE_PATTERN.match(handle):
+        return None
+    path = get_run_artifact_dir() / f"{handle}.txt"
+    if not path.exists():
+        return None
+    return path.read_text(encoding="utf-8")
+
+def get_max_chars(tool_name: str) -> int | None:
+    """Size limit of a tool's result in the prompt, `null` in config.yaml meaning no limit."""
+    return TOOL_MAX_CHARS.get(tool_name, DEFAULT_MAX_CHARS)
+
+def spill_tool_result(tool_name: str, result) -> str:
+    """Return the result as it should appear in the prompt. Results over the tool's limit are stored
+    as an artifact and replaced by a head/tail preview and the handle to read the rest."""
+    text = str(result)
+    max_chars = get_max_chars(tool_name)
+    if not SPILL_ENABLE or max_chars is None or len(text) <= max_chars:
+        return text
+    handle = save_artifact(text, tool_name)
+    lines = text.splitlines()
+    if len(lines) > 2 * PREVIEW_LINES:
+        head, tail = "\n".join(lines[:PREVIEW_LINES]), "\n".join(lines[-PREVIEW_LINES:])
+        omitted = f"{len(lines) - 2 * PREVIEW_LINES} lines"
+    else: # few, very long lines
+        head, tail = text[:max_chars // 4], text[-max_chars // 4:]
+        omitted = f"{len(text) - 2 * (max_chars // 4)} characters"
+    return (f"{head}\n"
+            f"... [{omitted} omitted. The full result ({len(lines)} lines, {len(text)} characters) is stored as "
+            f"handle `{handle}`, use the read_tool_result tool to page through, grep or slice it] ...\n"
+            f"{tail}")
+
+
+__all__ = ["save_artifact", "load_artifact", "spill_tool_result", "ARTIFACT_DIR", "SPILL_ENABLE"]
@@ -0,0 +1,53 @@
+import asyncio
+import contextvars
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from loguru import logger
+from .config import ASYNC_RUNTIME_CONFIG
+
+TOOL_WORKERS = ASYNC_RUNTIME_CONFIG.get("tool_workers", 8)
+
+# One event loop for the whole process. The async HTTP clients of the chat models are bound to the
+# loop they were first used on, so running every coroutine on the same loop keeps their connection
+# pools alive instead of creating (and closing) a loop per call as asyncio.run did.
+_loop = None
+_loop_thread = None
+_loop_lock = threading.Lock()
+
+# Blocking work (tools, terminals, OCR, human input) runs here, never on the event loop.
+_tool_executor = ThreadPoolExecutor(max_workers=TOOL_WORKERS, thread_name_prefix="tool")
+
+def get_event_loop() -> asyncio.AbstractEventLoop:
+    global _loop, _loop_thread
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            _loop_thread = threading.Thread(target=_loop.run_forever, name="agent_event_loop", daemon=True)
+            _loop_thread.start()
+            logger.info("Started shared event loop")
+        return _loop
+
+def run_sync(coroutine):
+    """Run a coroutine on the shared event loop and wait for its result. Works from any thread,
+    including one that already runs its own event loop, but not from the shared loop itself."""
+    loop = get_event_loop()
+    if threading.current_thread() is _loop_thread:
+        coroutine.close()
+        raise RuntimeError("run_sync called from the shared event loop, await the coroutine instead")
+    return asyncio.run_coroutine_threadsafe(coroutine, loop).result()
+
+def get_tool_executor() -> ThreadPoolExecutor:
+    return _tool_executor
+
+async def arun_blocking(func, *args, **kwargs):
+    """Run a blocking function in the bounded tool thread pool, keeping the caller's context variables."""
+    context = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(
+        _tool_executor, partial(context.run, func, *args, **kwargs))
+
+async def ainvoke_tool(tool, args: dict):
+    return await arun_blocking(tool.invoke, args)
+
+
+__all__ = ["get_event_loop", "run_sync", "get_tool_executor", "arun_blocking", "ainvoke_tool"]
@@ -0,0 +1,306 @@
+import hashlib
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, AsyncIterator, Iterator, Sequence
+from langchain_core.messages import BaseMessage
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import (BaseCheckpointSaver, ChannelVersions, Checkpoint, CheckpointMetadata,
+                                       CheckpointTuple, WRITES_IDX_MAP, get_checkpoint_id, get_checkpoint_metadata)
+from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer
+from loguru import logger
+from .config import CHECKPOINT_CONFIG
+
+CHECKPOINT_ENABLE = CHECKPOINT_CONFIG.get("enable", False)
+CHECKPOINT_PATH = Path(CHECKPOINT_CONFIG.get("path", "data/checkpoints/checkpoints.sqlite"))
+KEEP_RUNS = CHECKPOINT_CONFIG.get("keep_runs", 20)
+MAX_AGE_DAYS = CHECKPOINT_CONFIG.get("max_age_days", 7)
+KEEP_CHECKPOINTS_PER_RUN = CHECKPOINT_CONFIG.get("keep_checkpoints_per_run", 10)
+
+MESSAGE_REF = "__message_ref__"
+
+SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS checkpoints (thread_id TEXT, checkpoint_ns TEXT, checkpoint_id TEXT, parent_id TEXT, "
+    "checkpoint_type TEXT, checkpoint BLOB, metadata_type TEXT, metadata BLOB, created_at REAL, "
+    "PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id))",
+    "CREATE TABLE IF NOT EXISTS blobs (thread_id TEXT, checkpoint_ns TEXT, channel TEXT, version TEXT, "
+    "value_type TEXT, value BLOB, PRIMARY KEY (thread_id, checkpoint_ns, channel, version))",
+    "CREATE TABLE IF NOT EXISTS writes (thread_id TEXT, checkpoint_ns TEXT, checkpoint_id TEXT, task_id TEXT, idx INTEGER, "
+    "channel TEXT, value_type TEXT, value BLOB, task_path TEXT, "
+    "PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id, task_id, idx))",
+    "CREATE TABLE IF NOT EXISTS messages (thread_id TEXT, hash TEXT, value_type TEXT, value BLOB, PRIMARY KEY (thread_id, hash))",
+]
+
+
+class MessageDedupSerializer:
+    """Wraps the checkpoint serializer so that each message of a run is stored once, by content hash.
+    Histories grow by a message or two per step, so a snapshot only stores references for the
+    unchanged prefix instead of a copy of every message."""
+    def __init__(self, saver: "SQLiteCheckpointSaver", serde=None):
+        self.saver = saver
+        self.serde = serde or JsonPlusSerializer()
+
+    def _replace(self, thread_id: str, value):
+        if isinstance(value, BaseMessage):
+            value_type, data = self.serde.dumps_typed(value)
+            digest = hashlib.sha256(value_type.encode("utf-8") + data).hexdigest()[:32]
+            self.saver._save_message(thread_id, digest, value_type, data)
+            return {MESSAGE_REF: digest}
+        if isinstance(value, list):
+            return [self._replace(thread_id, item) for item in value]
+        if isinstance(value, dict):
+            return {key: self._replace(thread_id, item) for key, item in value.items()}
+        return value
+
+    def _restore(self, thread_id: str, value):
+        if isinstance(value, dict):
+            if len(value) == 1 and MESSAGE_REF in value:
+                return self.serde.loads_typed(self.saver._load_message(thread_id, value[MESSAGE_REF]))
+            return {key: self._restore(thread_id, item) for key, item in value.items()}
+        if isinstance(value, list):
+            return [self._restore(thread_id, item) for item in value]
+        return value
+
+    def dumps(self, thread_id: str, value) -> tuple[str, bytes]:
+        return self.serde.dumps_typed(self._replace(thread_id, value))
+
+    def loads(self, thread_id: str, value_type: str, data: bytes):
+        return self._restore(thread_id, self.serde.loads_typed((value_type, data)))
+
+
+class SQLiteCheckpointSaver(BaseCheckpointSaver):
+    """Local SQLite checkpointer: one thread per run, keyed by the run timestamp, so a run that
+    crashed or was interrupted can be continued with `main.py --resume <run id>`."""
+    _instance = None
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super().__new__(cls)
+            BaseCheckpointSaver.__init__(cls._instance)
+            cls._instance.path = CHECKPOINT_PATH
+            cls._instance.dedup = MessageDedupSerializer(cls._instance, cls._instance.serde)
+            cls._instance._saved_messages = set()
+            cls._instance._conn = None
+            cls._instance._lock = threading.RLock()
+        return cls._instance
+
+    def __init__(self):
+        pass
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30) # batch workers share the file
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            for statement in SCHEMA:
+                self._conn.execute(statement)
+            self._conn.commit()
+            logger.info(f"Checkpoints stored at {self.path.absolute().as_posix()}")
+        return self._conn
+
+    def _save_message(self, thread_id: str, digest: str, value_type: str, data: bytes):
+        if (thread_id, digest) in self._saved_messages:
+            return
+        self._connection().execute("INSERT OR IGNORE INTO messages (thread_id, hash, value_type, value) VALUES (?, ?, ?, ?)",
+                                   (thread_id, digest, value_type, data))
+        self._saved_messages.add((thread_id, digest))
+
+    def _load_message(self, thread_id: str, digest: str) -> tuple[str, bytes]:
+        row = self._connection().execute("SELECT value_type, value FROM messages WHERE thread_id = ? AND hash = ?",
+                                         (thread_id, digest)).fetchone()
+        if row is None:
+            raise KeyError(f"Message {digest} of run {thread_id} is missing from the checkpoints")
+        return row
+
+    def _make_tuple(self, thread_id: str, checkpoint_ns: str, row) -> CheckpointTuple:
+        checkpoint_id, parent_id, checkpoint_type, checkpoint_data, metadata_type, metadata_data = row
+        conn = self._connection()
+        checkpoint = self.serde.loads_typed((checkpoint_type, checkpoint_data))
+        channel_values = {}
+        for channel, version in checkpoint["channel_versions"].items():
+            blob = conn.execute("SELECT value_type, value FROM blobs WHERE thread_id = ? AND checkpoint_ns = ? AND channel = ? AND version = ?",
+                                (thread_id, checkpoint_ns, channel, str(version))).fetchone()
+            if blob is not None and blob[0] != "empty":
+                channel_values[channel] = self.dedup.loads(thread_id, blob[0], blob[1])
+        writes = conn.execute("SELECT task_id, channel, value_type, value FROM writes WHERE thread_id = ? AND checkpoint_ns = ? "
+                              "AND checkpoint_id = ? ORDER BY task_id, idx", (thread_id, checkpoint_ns, checkpoint_id)).fetchall()
+        def config_for(target_id):
+            return {"configurable": {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns, "checkpoint_id": target_id}}
+        return CheckpointTuple(
+            config=config_for(checkpoint_id),
+            checkpoint={**checkpoint, "channel_values": channel_values},
+            metadata=self.serde.loads_typed((metadata_type, metadata_data)),
+            parent_config=config_for(parent_id) if parent_id else None,
+            pending_writes=[(task_id, channel, self.dedup.loads(thread_id, value_type, value))
+                            for task_id, channel, value_type, value in writes],
+        )
+
+    def get_tuple(self, config: RunnableConfig) -> CheckpointTuple | None:
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        columns = "checkpoint_id, parent_id, checkpoint_type, checkpoint, metadata_type, metadata"
+        with self._lock:
+            conn = self._connection()
+            if checkpoint_id := get_checkpoint_id(config):
+                row = conn.execute(f"SELECT {columns} FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?",
+                                   (thread_id, checkpoint_ns, checkpoint_id)).fetchone()
+            else:
+                row = conn.execute(f"SELECT {columns} FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? "
+                                   "ORDER BY checkpoint_id DESC LIMIT 1", (thread_id, checkpoint_ns)).fetchone()
+            return self._make_tuple(thread_id, checkpoint_ns, row) if row is not None else None
+
+    def list(self, config: RunnableConfig | None, *, filter: dict[str, Any] | None = None,
+             before: RunnableConfig | None = None, limit: int | None = None) -> Iterator[CheckpointTuple]:
+        query = "SELECT thread_id, checkpoint_ns, checkpoint_id, parent_id, checkpoint_type, checkpoint, metadata_type, metadata FROM checkpoints"
+        conditions, params = [], []
+        if config:
+            conditions.append("thread_id = ?")
+            params.append(config["configurable"]["thread_id"])
+            if config["configurable"].get("checkpoint_ns") is not None:
+                conditions.append("checkpoint_ns = ?")
+                params.append(config["configurable"]["checkpoint_ns"])
+            if checkpoint_id := get_checkpoint_id(config):
+                conditions.append("checkpoint_id = ?")
+                params.append(checkpoint_id)
+        if before and (before_id := get_checkpoint_id(before)):
+            conditions.append("checkpoint_id < ?")
+            params.append(before_id)
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += " ORDER BY checkpoint_id DESC"
+        with self._lock:
+            rows = self._connection().execute(query, params).fetchall()
+        for row in rows:
+            with self._lock:
+                checkpoint_tuple = self._make_tuple(row[0], row[1], row[2:])
+            if filter and not all(checkpoint_tuple.metadata.get(key) == value for key, value in filter.items()):
+                continue
+            if limit is not None:
+                if limit <= 0:
+                    break
+                limit -= 1
+            yield checkpoint_tuple
+
+    def put(self, config: RunnableConfig, checkpoint: Checkpoint, metadata: CheckpointMetadata,
+            new_versions: ChannelVersions) -> RunnableConfig:
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        checkpoint = checkpoint.copy()
+        values = checkpoint.pop("channel_values")
+        with self._lock:
+            conn = self._connection()
+            for channel, version in new_versions.items():
+                value_type, value = self.dedup.dumps(thread_id, values[channel]) if channel in values else ("empty", b"")
+                conn.execute("INSERT OR REPLACE INTO blobs (thread_id, checkpoint_ns, channel, version, value_type, value) "
+                             "VALUES (?, ?, ?, ?, ?, ?)", (thread_id, checkpoint_ns, channel, str(version), value_type, value))
+            checkpoint_type, checkpoint_data = self.serde.dumps_typed(checkpoint)
+            metadata_type, metadata_data = self.serde.dumps_typed(get_checkpoint_metadata(config, metadata))
+            conn.execute("INSERT OR REPLACE INTO checkpoints (thread_id, checkpoint_ns, checkpoint_id, parent_id, checkpoint_type, "
+                         "checkpoint, metadata_type, metadata, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                         (thread_id, checkpoint_ns, checkpoint["id"], config["configurable"].get("checkpoint_id"),
+                          checkpoint_type, checkpoint_data, metadata_type, metadata_data, time.time()))
+            conn.commit()
+        return {"configurable": {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns, "checkpoint_id": checkpoint["id"]}}
+
+    def put_writes(self, config: RunnableConfig, writes: Sequence[tuple[str, Any]], task_id: str, task_path: str = "") -> None:
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        checkpoint_id = config["configurable"]["checkpoint_id"]
+        with self._lock:
+            conn = self._connection()
+            for idx, (channel, value) in enumerate(writes):
+                idx = WRITES_IDX_MAP.get(channel, idx)
+                value_type, data = self.dedup.dumps(thread_id, value)
+                # special writes (errors, interrupts) are replaced, regular ones are kept from the first attempt
+                conn.execute(f"INSERT OR {'REPLACE' if idx < 0 else 'IGNORE'} INTO writes (thread_id, checkpoint_ns, checkpoint_id, "
+                             "task_id, idx, channel, value_type, value, task_path) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                             (thread_id, checkpoint_ns, checkpoint_id, task_id, idx, channel, value_type, data, task_path))
+            conn.commit()
+
+    def delete_thread(self, thread_id: str) -> None:
+        with self._lock:
+            conn = self._connection()
+            for table in ("checkpoints", "blobs", "writes", "messages"):
+                conn.execute(f"DELETE FROM {table} WHERE thread_id = ?", (thread_id,))
+            conn.commit()
+            self._saved_messages = {key for key in self._saved_messages if key[0] != thread_id}
+
+    async def aget_tuple(self, config: RunnableConfig) -> CheckpointTuple | None:
+        return self.get_tuple(config)
+
+    async def alist(self, config: RunnableConfig | None, *, filter: dict[str, Any] | None = None,
+                    before: RunnableConfig | None = None, limit: int | None = None) -> AsyncIterator[CheckpointTuple]:
+        for checkpoint_tuple in self.list(config, filter=filter, before=before, limit=limit):
+            yield checkpoint_tuple
+
+    async def aput(self, config: RunnableConfig, checkpoint: Checkpoint, metadata: CheckpointMetadata,
+                   new_versions: ChannelVersions) -> RunnableConfig:
+        return self.put(config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(self, config: RunnableConfig, writes: Sequence[tuple[str, Any]], task_id: str, task_path: str = "") -> None:
+        return self.put_writes(config, writes, task_id, task_path)
+
+    async def adelete_thread(self, thread_id: str) -> None:
+        return self.delete_thread(thread_id)
+
+    def get_next_version(self, current: str | None, channel: None) -> str:
+        current_version = 0 if current is None else int(str(current).split(".")[0])
+        return f"{current_version + 1:032}"
+
+    def list_runs(self) -> "list[tuple[str, float]]": # `list` is the checkpoint listing in this class
+        """(run id, time of its last checkpoint), latest first."""
+        with self._lock:
+            return self._connection().execute(
+                "SELECT thread_id, MAX(created_at) AS last FROM checkpoints GROUP BY thread_id ORDER BY last DESC").fetchall()
+
+    def has_run(self, run_id: str) -> bool:
+        return any(thread_id == run_id for thread_id, _ in self.list_runs())
+
+    def prune(self, keep_current: str | None = None):
+        """Delete runs beyond the KEEP_RUNS latest or older than MAX_AGE_DAYS, and all but the latest
+        KEEP_CHECKPOINTS_PER_RUN checkpoints of each remaining run (resuming only needs the latest)."""
+        cutoff = time.time() - MAX_AGE_DAYS * 24 * 3600
+        runs = self.list_runs()
+        stale = [thread_id for i, (thread_id, last) in enumerate(runs)
+                 if thread_id != keep_current and (i >= KEEP_RUNS or last < cutoff)]
+        for thread_id in stale:
+            self.delete_thread(thread_id)
+        with self._lock:
+            conn = self._connection()
+            trimmed = 0
+            for thread_id, checkpoint_ns in conn.execute("SELECT DISTINCT thread_id, checkpoint_ns FROM checkpoints").fetchall():
+                old_ids = [row[0] for row in conn.execute(
+                    "SELECT checkpoint_id FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? ORDER BY checkpoint_id DESC LIMIT -1 OFFSET ?",
+                    (thread_id, checkpoint_ns, KEEP_CHECKPOINTS_PER_RUN)).fetchall()]
+                for checkpoint_id in old_ids:
+                    conn.execute("DELETE FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?",
+                                 (thread_id, checkpoint_ns, checkpoint_id))
+                    conn.execute("DELETE FROM writes WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?",
+                                 (thread_id, checkpoint_ns, checkpoint_id))
+                trimmed += len(old_ids)
+                if old_ids:
+                    self._delete_unused_blobs(conn, thread_id, checkpoint_ns)
+            conn.commit()
+        if stale or trimmed:
+            logger.info(f"Pruned {len(stale)} old runs and {trimmed} old checkpoints")
+
+    def _delete_unused_blobs(self, conn: sqlite3.Connection, thread_id: str, checkpoint_ns: str):
+        used = set()
+        for checkpoint_type, checkpoint_data in conn.execute(
+                "SELECT checkpoint_type, checkpoint FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ?",
+                (thread_id, checkpoint_ns)).fetchall():
+            checkpoint = self.serde.loads_typed((checkpoint_type, checkpoint_data))
+            used.update((channel, str(version)) for channel, version in checkpoint["channel_versions"].items())
+        for channel, version in conn.execute("SELECT channel, version FROM blobs WHERE thread_id = ? AND checkpoint_ns = ?",
+                                             (thread_id, checkpoint_ns)).fetchall():
+            if (channel, version) not in used:
+                conn.execute("DELETE FROM blobs WHERE thread_id = ? AND checkpoint_ns = ? AND channel = ? AND version = ?",
+                             (thread_id, checkpoint_ns, channel, version))
+
+
+def get_checkpointer() -> SQLiteCheckpointSaver | None:
+    return SQLiteCheckpointSaver() if CHECKPOINT_ENABLE else None
+
+
+__all__ = ["SQLiteCheckpointSaver", "MessageDedupSerializer", "get_checkpointer", "CHECKPOINT_ENABLE"]
@@ -0,0 +1,167 @@
+import threading
+from langchain_core.messages import AIMessage, AnyMessage, HumanMessage, SystemMessage
+from loguru import logger
+from .artifacts import save_artifact
+from .config import COMPACTION_CONFIG
+from .llm_calling import invoke_llm_with_retry, ainvoke_llm_with_retry
+from .llms import get_model, get_role_model
+from .usage import register_metrics_source, usage_context
+
+COMPACTION_ENABLE = COMPACTION_CONFIG.get("enable", False)
+TOKEN_BUDGET = COMPACTION_CONFIG.get("token_budget", 32000)
+KEEP_RECENT_EXCHANGES = COMPACTION_CONFIG.get("keep_recent", 4)
+STUB_MIN_TOKENS = COMPACTION_CONFIG.get("stub_min_tokens", 200)
+SUMMARY_MODEL = COMPACTION_CONFIG.get("summary_model", None)
+
+TOOL_RESULT_PREFIX = 'Tool "'
+SUMMARY_PREFIX = "System: Summary of the earlier conversation:\n"
+
+SUMMARY_PROMPT = """
+You are compacting the conversation history of an AI agent that calls tools to complete a task.
+Summarize the conversation below so the agent can continue its work from the summary alone.
+Keep: the supervisor's instructions, file paths and other identifiers, decisions made and why,
+results that are still needed, errors met and how they were solved, and what is left to do.
+Drop: full file contents, page descriptions and other tool output that was already acted upon.
+Respond with the summary only.
+
+Conversation:
+"""
+
+def estimate_tokens(message: AnyMessage) -> int:
+    return len(str(message.content)) // 4
+
+def estimate_total_tokens(messages: list[AnyMessage]) -> int:
+    return sum(estimate_tokens(message) for message in messages)
+
+
+class CompactionStats:
+    """Tokens saved by compaction, per agent."""
+    _instance = None
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super().__new__(cls)
+            cls._instance.agents = {}
+            cls._instance._lock = threading.Lock()
+        return cls._instance
+
+    def __init__(self):
+        pass
+
+    def record(self, agent_name: str, tokens_before: int, tokens_after: int, stubs: int, summarized: int):
+        with self._lock:
+            stats = self.agents.setdefault(agent_name, {"compactions": 0, "tokens_saved": 0, "stubs": 0, "summarized_messages": 0})
+            stats["compactions"] += 1
+            stats["tokens_saved"] += tokens_before - tokens_after
+            stats["stubs"] += stubs
+            stats["summarized_messages"] += summarized
+        logger.info(f"{agent_name} compacted its context from ~{tokens_before} to ~{tokens_after} tokens "
+                    f"({stubs} tool results stubbed, {summarized} messages summarized)")
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {agent: dict(stats) for agent, stats in self.agents.items()}
+
+register_metrics_source("compaction", lambda: CompactionStats().get_stats())
+
+
+def _recent_start(messages: list[AnyMessage]) -> int:
+    """Index of the first message of the latest KEEP_RECENT_EXCHANGES exchanges (an AI message and
+    the messages answering it), which always stay verbatim."""
+    ai_indices = [i for i, message in enumerate(messages) if isinstance(message, AIMessage)]
+    if len(ai_indices) < KEEP_RECENT_EXCHANGES:
+        return 1
+    return ai_indices[-KEEP_RECENT_EXCHANGES] if KEEP_RECENT_EXCHANGES > 0 else len(messages)
+
+def _is_compacted(message: AnyMessage) -> bool:
+    return bool(message.additional_kwargs.get("compacted"))
+
+def _stub_tool_results(messages: list[AnyMessage], end: int) -> int:
+    """Replace large tool results before `end` with a stub pointing to the saved full text."""
+    stubs = 0
+    for i in range(1, end):
+        message = messages[i]
+        if not isinstance(message, HumanMessage) or _is_compacted(message) or not isinstance(message.content, str):
+            continue
+        if not message.content.startswith(TOOL_RESULT_PREFIX) or estimate_tokens(message) < STUB_MIN_TOKENS:
+            continue
+        handle = save_artifact(message.content, "compacted")
+        first_line = message.content.splitlines()[0][:200]
+        stub = (f"{first_line} ...\n[Compacted: {len(message.content)} characters of tool results were removed "
+                f"from the context. They are stored as handle `{handle}`, use the read_tool_result tool if they are needed again.]")
+        messages[i] = HumanMessage(content=stub, additional_kwargs={"compacted": "stub", "handle": handle})
+        stubs += 1
+    return stubs
+
+def _summary_input(messages: list[AnyMessage]) -> str:
+    lines = []
+    for message in messages:
+        if isinstance(message, HumanMessage) and message.additional_kwargs.get("compacted") == "summary":
+            lines.append(f"Earlier summary: {message.content.removeprefix(SUMMARY_PREFIX)}")
+        else:
+            lines.append(f"{'Agent' if isinstance(message, AIMessage) else 'System'}: {message.content}")
+    return SUMMARY_PROMPT + "\n\n".join(lines)
+
+def _summary_message(summary: str) -> HumanMessage:
+    return HumanMessage(content=SUMMARY_PREFIX + summary, additional_kwargs={"compacted": "summary"})
+
+def _get_summary_model():
+    return get_model(SUMMARY_MODEL) if SUMMARY_MODEL else get_role_model("memory_relevance_model")
+
+def _plan(messages: list[AnyMessage]) -> tuple[int, int, int] | None:
+    """Stub old tool results in place. Returns (tokens before, stubs, end of the region to summarize),
+    or None when the messages are within budget."""
+    tokens_before = estimate_total_tokens(messages)
+    if not COMPACTION_ENABLE or tokens_before <= TOKEN_BUDGET or not messages or not isinstance(messages[0], SystemMessage):
+        return None
+    recent_start = _recent_start(messages)
+    stubs = _stub_tool_results(messages, recent_start)
+    if estimate_total_tokens(messages) <= TOKEN_BUDGET or recent_start <= 2:
+        return tokens_before, stubs, 0
+    return tokens_before, stubs, recent_start
+
+def _summary_failed(agent_name: str, exception: Exception) -> int:
+    """The turn goes on with the tool results stubbed only, the summary is tried again next turn."""
+    logger.warning(f"{agent_name} could not summarize its history, keeping it verbatim for now: {exception!r}")
+    return 0
+
+def compact_messages(agent_name: str, messages: list[AnyMessage]):
+    """Keep an agent's history within the token budget, in place: old tool results become stubs first,
+    then everything but the system prompt and the latest exchanges is folded into a rolling summary."""
+    plan = _plan(messages)
+    if plan is None:
+        return
+    tokens_before, stubs, summary_end = plan
+    if not stubs and not summary_end: # only the latest exchanges are left, they are never compacted
+        return
+    if summary_end:
+        try:
+            with usage_context(agent_name, "compaction"):
+                response, _ = invoke_llm_with_retry(_get_summary_model(), [HumanMessage(content=_summary_input(messages[1:summary_end]))])
+            messages[1:summary_end] = [_summary_message(response.content)]
+        except Exception as e:
+            summary_end = _summary_failed(agent_name, e)
+            if not stubs:
+                return
+    CompactionStats().record(agent_name, tokens_before, estimate_total_tokens(messages), stubs, max(0, summary_end - 1))
+
+async def acompact_messages(agent_name: str, messages: list[AnyMessage]):
+    plan = _plan(messages)
+    if plan is None:
+        return
+    tokens_before, stubs, summary_end = plan
+    if not stubs and not summary_end: # only the latest exchanges are left, they are never compacted
+        return
+    if summary_end:
+        try:
+            with usage_context(agent_name, "compaction"):
+                response, _ = await ainvoke_llm_with_retry(_get_summary_model(), [HumanMessage(content=_summary_input(messages[1:summary_end]))])
+            messages[1:summary_end] = [_summary_message(response.content)]
+        except Exception as e:
+            summary_end = _summary_failed(agent_name, e)
+            if not stubs:
+                return
+    CompactionStats().record(agent_name, tokens_before, estimate_total_tokens(messages), stubs, max(0, summary_end - 1))
+
+
+__all__ = ["compact_messages", "acompact_messages", "CompactionStats", "estimate_total_tokens", "COMPACTION_ENABLE"]
@@ -23,7 +23,30 @@ CONFIG = load_config()
 MEMORY_ENABLE_UPDATER = CONFIG["features"]["memory"]["enable_updater"]
 MEMORY_ENABLE_RETRIEVAL = CONFIG["features"]["memory"]["enable_retrieval"]
 MEMORY_ENABLE_PINECONE_UPDATE = CONFIG["features"]["memory"]["enable_pinecone_update"]
+MEMORY_BACKEND = CONFIG["features"]["memory"].get("backend", "pinecone")
+MEMORY_LOCAL_CONFIG = CONFIG["features"]["memory"].get("local", None) or {}
+MEMORY_RELEVANCE_MODE = CONFIG["features"]["memory"].get("relevance_mode", "per_memory")
+MEMORY_RELEVANCE_THRESHOLD = CONFIG["features"]["memory"].get("relevance_threshold", None)
+MEMORY_RETRIEVAL_CACHE_CONFIG = CONFIG["features"]["memory"].get("retrieval_cache", None) or {}
+MEMORY_PREFETCH_CONFIG = CONFIG["features"]["memory"].get("prefetch", None) or {}
+MEMORY_EMBEDDINGS_CONFIG = CONFIG["features"]["memory"].get("embeddings", None) or {}
 EMAIL_DRAFT_MODE = CONFIG["features"]["email"]["draft_mode"]
 USER_EMAIL = CONFIG["features"]["email"]["user_email"]
+LLM_CACHE_CONFIG = CONFIG["features"].get("llm_cache", {})
+LLM_TRANSPORT_CONFIG = CONFIG["features"].get("llm_transport", {})
+RATE_LIMITS_CONFIG = CONFIG["features"].get("rate_limits", None) or {}
+STREAMING_CONFIG = CONFIG["features"].get("streaming", {})
+HEDGING_CONFIG = CONFIG["features"].get("hedging", {})
+USAGE_CONFIG = CONFIG["features"].get("usage", None) or {}
+ASYNC_RUNTIME_CONFIG = CONFIG["features"].get("async_runtime", None) or {}
+HTTP_POOL_CONFIG = CONFIG["features"].get("http_pool", None) or {}
+COMPACTION_CONFIG = CONFIG["features"].get("compaction", None) or {}
+ARTIFACTS_CONFIG = CONFIG["features"].get("artifacts", None) or {}
+PARALLEL_TOOLS_CONFIG = CONFIG["features"].get("parallel_tools", None) or {}
+TOOL_CACHE_CONFIG = CONFIG["features"].get("tool_cache", None) or {}
+FAN_OUT_CONFIG = CONFIG["features"].get("fan_out", None) or {}
+CHECKPOINT_CONFIG = CONFIG["features"].get("checkpoints", None) or {}
+HUMAN_CHANNEL_CONFIG = CONFIG["features"].get("human_channel", None) or {}
+BATCH_CONFIG = CONFIG["features"].get("batch", None) or {}
 
 logger.info(f"Loaded configuration: {CONFIG}") 
\ No newline at end of file
@@ -0,0 +1,234 @@
+import asyncio
+import contextvars
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from loguru import logger
+from .config import HEDGING_CONFIG
+
+HEDGE_PERCENTILE = HEDGING_CONFIG.get("percentile", 95)
+HEDGE_MIN_SAMPLES = HEDGING_CONFIG.get("min_samples", 10)
+HEDGE_DEFAULT_DELAY = HEDGING_CONFIG.get("default_delay", 20)
+# attempts per model of a fallback chain before the next model is tried (10 for a single model)
+HEDGE_MODEL_ATTEMPTS = HEDGING_CONFIG.get("model_attempts", 3)
+# request timeouts: a multiple of the model's p99 latency, within [TIMEOUT_MIN_SECONDS, max_timeout]
+DEFAULT_TIMEOUT = HEDGING_CONFIG.get("default_timeout", 60)
+TIMEOUT_MULTIPLIER = HEDGING_CONFIG.get("timeout_multiplier", 3)
+MAX_TIMEOUT = HEDGING_CONFIG.get("max_timeout", 600)
+TIMEOUT_PERCENTILE = 99
+TIMEOUT_MIN_SECONDS = 10
+LATENCY_WINDOW = 200
+HISTOGRAM_BUCKETS = (0.5, 1, 2, 5, 10, 20, 30, 60, 120)
+
+
+class LatencyTracker:
+    """Recent wall times of LLM calls per role (of fallback chains) and per model, used to derive
+    hedging delays and request timeouts. A request that was dropped or timed out is a censored
+    sample: its latency is only known to be longer, so percentiles are Kaplan-Meier estimates."""
+    _instance = None
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super().__new__(cls)
+            cls._instance.samples = {}
+            cls._instance._lock = threading.Lock()
+        return cls._instance
+
+    def __init__(self):
+        pass
+
+    def record(self, role: str, seconds: float, censored: bool = False):
+        with self._lock:
+            self.samples.setdefault(role, deque(maxlen=LATENCY_WINDOW)).append((seconds, censored))
+
+    def percentile(self, role: str, percentile: float) -> float | None:
+        with self._lock:
+            # (seconds, censored): at equal times answers come first, the censored requests were still at risk
+            samples = sorted(self.samples.get(role, ()))
+        if len(samples) < HEDGE_MIN_SAMPLES:
+            return None
+        survival, at_risk = 1.0, len(samples)
+        for seconds, censored in samples:
+            if not censored:
+                survival *= 1 - 1 / at_risk
+                if 1 - survival >= percentile / 100 - 1e-9:
+                    return seconds
+            at_risk -= 1
+        return samples[-1][0] # the percentile lies beyond every answer, this is a lower bound of it
+
+    def timeout(self, key: str) -> float:
+        """Request timeout for a model (or role), from its latency percentile."""
+        observed = self.percentile(key, TIMEOUT_PERCENTILE)
+        if observed is None:
+            return DEFAULT_TIMEOUT
+        return min(MAX_TIMEOUT, max(TIMEOUT_MIN_SECONDS, observed * TIMEOUT_MULTIPLIER))
+
+    def get_histograms(self) -> dict:
+        with self._lock:
+            samples = {role: list(values) for role, values in self.samples.items()}
+        histograms = {}
+        for role, values in samples.items():
+            counts = {f"<={bound}s": 0 for bound in HISTOGRAM_BUCKETS}
+            counts[f">{HISTOGRAM_BUCKETS[-1]}s"] = 0
+            counts["censored"] = sum(censored for _, censored in values)
+            for value, censored in values:
+                if censored:
+                    continue
+                bucket = next((f"<={bound}s" for bound in HISTOGRAM_BUCKETS if value <= bound), f">{HISTOGRAM_BUCKETS[-1]}s")
+                counts[bucket] += 1
+            histograms[role] = counts
+        return histograms
+
+
+class ModelChain:
+    """Ordered fallback chain of models for one role in config.yaml `llms:`.
+
+    Without a hedge delay the next model is only tried once the previous one failed. With one, a
+    duplicate request goes to the next model whenever the current ones have not answered within
+    the delay, and the first valid response wins. `hedge_delay: auto` uses the role's p95 latency.
+    """
+    def __init__(self, role: str, model_names: list[str], resolve_model, hedge_delay: float | str | None = None):
+        self.role = role
+        self.model_names = model_names
+        self.hedge_delay = hedge_delay
+        self._resolve_model = resolve_model
+
+    @property
+    def models(self) -> list:
+        return [self._resolve_model(name) for name in self.model_names]
+
+    @property
+    def is_hedged(self) -> bool:
+        return self.hedge_delay is not None and len(self.model_names) > 1
+
+    def get_hedge_delay(self) -> float | None:
+        if not self.is_hedged:
+            return None
+        if self.hedge_delay == "auto":
+            observed = LatencyTracker().percentile(self.role, HEDGE_PERCENTILE)
+            return observed if observed is not None else HEDGE_DEFAULT_DELAY
+        return float(self.hedge_delay)
+
+    def __repr__(self):
+        return f"ModelChain(role={self.role!r}, models={self.model_names!r}, hedge_delay={self.hedge_delay!r})"
+
+
+def _record_latencies(role: str, winner_started: float, losers):
+    """The winner's latency, and for every request still running, a censored sample of how long it ran."""
+    now = time.monotonic()
+    LatencyTracker().record(role, now - winner_started)
+    for _, started in losers:
+        LatencyTracker().record(role, now - started, censored=True)
+
+
+_executor = ThreadPoolExecutor(max_workers=HEDGING_CONFIG.get("max_workers", 8), thread_name_prefix="hedged_llm")
+
+def _on_executor() -> bool:
+    return threading.current_thread().name.startswith("hedged_llm")
+
+def _call_in_order(chain: ModelChain, models: list, call):
+    last_exception = None
+    for model_name, model in zip(chain.model_names, models):
+        if last_exception is not None:
+            logger.info(f"{chain.role}: sending request to fallback model {model_name}")
+        started = time.monotonic()
+        try:
+            result = call(model)
+        except Exception as e:
+            last_exception = e
+            logger.warning(f"{chain.role}: model {model_name} failed: {last_exception!r}")
+            continue
+        _record_latencies(chain.role, started, ())
+        return result
+    raise last_exception
+
+def call_with_chain(chain: ModelChain, call):
+    """Run `call(model)` over the chain, hedging or falling back as configured, and return the first result.
+    A running thread cannot be cancelled: losing requests keep running (and keep their rate limit slot and
+    their cost) until they finish, their results are dropped. `acall_with_chain` cancels them instead.
+    Without hedging, and for calls made from inside a hedged request (e.g. the JSON formatter of its
+    response), the models are tried in order in the calling thread, so nested calls never wait for a
+    worker of the pool they hold."""
+    models = chain.models
+    delay = chain.get_hedge_delay()
+    if delay is None or _on_executor():
+        return _call_in_order(chain, models, call)
+    running = {}
+    next_index = 0
+    last_exception = None
+
+    def launch():
+        nonlocal next_index
+        model = models[next_index]
+        if next_index > 0:
+            logger.info(f"{chain.role}: sending request to fallback model {chain.model_names[next_index]}")
+        # copy the caller's context, so usage accounting still knows which agent is calling
+        future = _executor.submit(contextvars.copy_context().run, call, model)
+        running[future] = (chain.model_names[next_index], time.monotonic())
+        next_index += 1
+
+    launch()
+    while running:
+        can_hedge = delay is not None and next_index < len(models)
+        done, _ = wait(running, timeout=delay if can_hedge else None, return_when=FIRST_COMPLETED)
+        if not done:
+            logger.info(f"{chain.role}: no response after {delay:.1f}s, hedging")
+            launch()
+            continue
+        for future in done:
+            model_name, started = running.pop(future)
+            if future.exception() is None:
+                _record_latencies(chain.role, started, running.values())
+                for loser in running:
+                    loser.cancel() # only stops requests still queued for a worker
+                if running:
+                    logger.info(f"{chain.role}: {model_name} answered first, dropping {len(running)} other request(s)")
+                return future.result()
+            last_exception = future.exception()
+            logger.warning(f"{chain.role}: model {model_name} failed: {last_exception!r}")
+        if not running and next_index < len(models):
+            launch()
+    raise last_exception
+
+async def acall_with_chain(chain: ModelChain, acall):
+    """Async variant of `call_with_chain`. Losing requests are cancelled."""
+    models = chain.models
+    delay = chain.get_hedge_delay()
+    running = {}
+    next_index = 0
+    last_exception = None
+
+    def launch():
+        nonlocal next_index
+        if next_index > 0:
+            logger.info(f"{chain.role}: sending request to fallback model {chain.model_names[next_index]}")
+        task = asyncio.ensure_future(acall(models[next_index]))
+        running[task] = (chain.model_names[next_index], time.monotonic())
+        next_index += 1
+
+    launch()
+    try:
+        while running:
+            can_hedge = delay is not None and next_index < len(models)
+            done, _ = await asyncio.wait(running, timeout=delay if can_hedge else None, return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                logger.info(f"{chain.role}: no response after {delay:.1f}s, hedging")
+                launch()
+                continue
+            for task in done:
+                model_name, started = running.pop(task)
+                if task.exception() is None:
+                    _record_latencies(chain.role, started, running.values())
+                    return task.result()
+                last_exception = task.exception()
+                logger.warning(f"{chain.role}: model {model_name} failed: {last_exception!r}")
+            if not running and next_index < len(models):
+                launch()
+        raise last_exception
+    finally:
+        for task in running:
+            task.cancel()
+
+
+__all__ = ["ModelChain", "LatencyTracker", "call_with_chain", "acall_with_chain", "HEDGE_MODEL_ATTEMPTS"]
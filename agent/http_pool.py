@@ -0,0 +1,159 @@
+import threading
+import httpx
+from loguru import logger
+from .config import HTTP_POOL_CONFIG
+from .usage import register_metrics_source
+
+try:
+    import h2 # noqa: F401, HTTP/2 support of httpx is optional (pip install httpx[http2])
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+DEFAULT_POOL_SETTINGS = {
+    "max_connections": 20,
+    "max_keepalive_connections": 10,
+    "keepalive_expiry": 60,
+    "http2": True,
+}
+# same as the OpenAI SDK default, the SDK passes its own per-request timeout anyway
+DEFAULT_TIMEOUT = httpx.Timeout(600, connect=5)
+
+
+class PoolStats:
+    """Request and connection counters of the pooled clients of one base URL."""
+    def __init__(self, base_url: str):
+        self.base_url = base_url
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.connections_opened = 0
+        self.tls_handshakes = 0
+
+    def on_request_start(self):
+        with self._lock:
+            self.requests += 1
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+
+    def on_request_end(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    def on_trace(self, event_name: str):
+        # httpcore reports connection setup through the "trace" request extension
+        if event_name == "connection.connect_tcp.complete":
+            with self._lock:
+                self.connections_opened += 1
+        elif event_name == "connection.start_tls.complete":
+            with self._lock:
+                self.tls_handshakes += 1
+
+    def as_dict(self) -> dict:
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "in_flight": self.in_flight,
+                "peak_in_flight": self.peak_in_flight,
+                "connections_opened": self.connections_opened,
+                "tls_handshakes": self.tls_handshakes,
+                "requests_per_connection": self.requests / self.connections_opened if self.connections_opened else None,
+            }
+
+
+class _CountingTransport(httpx.BaseTransport):
+    def __init__(self, transport: httpx.BaseTransport, stats: PoolStats):
+        self._transport = transport
+        self._stats = stats
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        request.extensions["trace"] = lambda event_name, info: self._stats.on_trace(event_name)
+        self._stats.on_request_start()
+        try:
+            return self._transport.handle_request(request)
+        finally:
+            self._stats.on_request_end()
+
+    def close(self):
+        self._transport.close()
+
+
+class _AsyncCountingTransport(httpx.AsyncBaseTransport):
+    def __init__(self, transport: httpx.AsyncBaseTransport, stats: PoolStats):
+        self._transport = transport
+        self._stats = stats
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        async def trace(event_name, info):
+            self._stats.on_trace(event_name)
+        request.extensions["trace"] = trace
+        self._stats.on_request_start()
+        try:
+            return await self._transport.handle_async_request(request)
+        finally:
+            self._stats.on_request_end()
+
+    async def aclose(self):
+        await self._transport.aclose()
+
+
+_clients = {}
+_async_clients = {}
+_stats = {}
+_lock = threading.Lock()
+
+def _normalize(base_url: str) -> str:
+    return base_url.rstrip("/")
+
+def get_pool_settings(base_url: str) -> dict:
+    """Defaults, overridden by `http_pool:` in config.yaml, overridden by `http_pool: pools: <base url>:`."""
+    overrides = HTTP_POOL_CONFIG.get("pools", {}) or {}
+    settings = {**DEFAULT_POOL_SETTINGS,
+                **{key: value for key, value in HTTP_POOL_CONFIG.items() if key in DEFAULT_POOL_SETTINGS},
+                **(overrides.get(base_url) or overrides.get(_normalize(base_url)) or {})}
+    if settings["http2"] and not HTTP2_AVAILABLE:
+        settings["http2"] = False
+    return settings
+
+def _get_stats(base_url: str) -> PoolStats:
+    if base_url not in _stats:
+        _stats[base_url] = PoolStats(base_url)
+    return _stats[base_url]
+
+def _limits(settings: dict) -> httpx.Limits:
+    return httpx.Limits(max_connections=settings["max_connections"],
+                        max_keepalive_connections=settings["max_keepalive_connections"],
+                        keepalive_expiry=settings["keepalive_expiry"])
+
+def get_http_client(base_url: str) -> httpx.Client:
+    """The process-wide keep-alive client for `base_url`, shared by every model using that endpoint."""
+    base_url = _normalize(base_url)
+    with _lock:
+        if base_url not in _clients:
+            settings = get_pool_settings(base_url)
+            transport = httpx.HTTPTransport(limits=_limits(settings), http2=settings["http2"])
+            _clients[base_url] = httpx.Client(transport=_CountingTransport(transport, _get_stats(base_url)),
+                                              timeout=DEFAULT_TIMEOUT, follow_redirects=True)
+            logger.info(f"Created pooled HTTP client for {base_url}: {settings}")
+        return _clients[base_url]
+
+def get_async_http_client(base_url: str) -> httpx.AsyncClient:
+    """Async counterpart of `get_http_client`. Used from the shared event loop in `async_runtime`."""
+    base_url = _normalize(base_url)
+    with _lock:
+        if base_url not in _async_clients:
+            settings = get_pool_settings(base_url)
+            transport = httpx.AsyncHTTPTransport(limits=_limits(settings), http2=settings["http2"])
+            _async_clients[base_url] = httpx.AsyncClient(transport=_AsyncCountingTransport(transport, _get_stats(base_url)),
+                                                         timeout=DEFAULT_TIMEOUT, follow_redirects=True)
+        return _async_clients[base_url]
+
+def get_pool_stats() -> dict:
+    with _lock:
+        return {base_url: stats.as_dict() for base_url, stats in _stats.items()}
+
+register_metrics_source("http_pools", get_pool_stats)
+
+
+__all__ = ["get_http_client", "get_async_http_client", "get_pool_stats", "get_pool_settings"]
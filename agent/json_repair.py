@@ -0,0 +1,233 @@
+import json
+import re
+import threading
+from loguru import logger
+
+# LaTeX commands that start with a valid JSON escape (\b, \f, \n, \r, \t). Models writing math in JSON
+# strings often forget to double the backslash, and "\frac" would otherwise silently become a form feed.
+LATEX_COMMANDS_WITH_JSON_ESCAPES = {
+    "b": ("beta", "bar", "bf", "big", "bigg", "binom", "boldsymbol", "bmatrix", "begin", "bullet", "backslash", "bot", "bmod", "bigcup", "bigcap", "bigl", "bigr"),
+    "f": ("frac", "forall", "flat", "frown", "footnote"),
+    "n": ("nabla", "neq", "ne", "nu", "not", "newline", "ni", "nmid", "nexists", "neg", "notin", "nleq", "ngeq", "nolimits"),
+    "r": ("rho", "right", "rangle", "rbrace", "rceil", "rfloor", "rightarrow", "Rightarrow", "rm"),
+    "t": ("theta", "tau", "times", "to", "text", "textbf", "textit", "tilde", "top", "triangle", "tan", "tanh", "tfrac", "tag"),
+}
+
+CODE_FENCE_PATTERN = re.compile(r"```(?:json|JSON)?\s*\n?(.*?)```", re.DOTALL)
+
+
+class JSONRepairStats:
+    """Counts how replies were turned into JSON, and which local repairs were needed."""
+    _instance = None
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super().__new__(cls)
+            cls._instance.outcomes = {"direct": 0, "repaired": 0, "llm_fallback": 0, "failed": 0}
+            cls._instance.repairs = {}
+            cls._instance._lock = threading.Lock()
+        return cls._instance
+
+    def __init__(self):
+        pass
+
+    def record(self, outcome: str, repairs: list[str] = ()):
+        with self._lock:
+            self.outcomes[outcome] += 1
+            for repair in repairs:
+                self.repairs[repair] = self.repairs.get(repair, 0) + 1
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            total = sum(self.outcomes.values())
+            return {**self.outcomes,
+                    "llm_fallback_rate": self.outcomes["llm_fallback"] / total if total else 0.0,
+                    "repairs": dict(self.repairs)}
+
+
+def _is_latex_command(text: str, backslash_index: int) -> bool:
+    escape = text[backslash_index + 1]
+    commands = LATEX_COMMANDS_WITH_JSON_ESCAPES.get(escape, ())
+    word = re.match(r"[A-Za-z]+", text[backslash_index + 1:])
+    return bool(word) and word.group(0) in commands
+
+def has_latex_escapes(text: str) -> bool:
+    """Whether the text has a JSON escape that starts a LaTeX command, such as the \\f of \\frac.
+    Such text may well be valid JSON, but json.loads would turn the command into a control character."""
+    i = text.find("\\")
+    while i != -1 and i + 1 < len(text):
+        if text[i + 1] in "bfnrt" and _is_latex_command(text, i):
+            return True
+        i = text.find("\\", i + 2) # an escaped backslash is skipped as a whole
+    return False
+
+def _next_significant_char(text: str, index: int) -> str:
+    while index < len(text) and text[index] in " \t\r\n":
+        index += 1
+    return text[index] if index < len(text) else ""
+
+def _repair_characters(text: str, repairs: set) -> str | None:
+    """One string-aware pass over the text, fixing what json.loads trips over most often. None when the
+    text was cut off in the middle of a value, which cannot be completed without making it up."""
+    out = []
+    stack = []
+    quote = None # quote character of the string we are in, if any
+    i = 0
+    while i < len(text):
+        char = text[i]
+        if quote is not None:
+            if char == "\\":
+                following = text[i + 1] if i + 1 < len(text) else ""
+                if following == "u" and re.match(r"[0-9a-fA-F]{4}", text[i + 2:i + 6]):
+                    out.append(text[i:i + 6])
+                    i += 6
+                    continue
+                if following in 'bfnrt' and _is_latex_command(text, i):
+                    out.append("\\\\")
+                    repairs.add("latex_backslash")
+                elif following == "'":
+                    out.append("'")
+                    i += 2
+                    continue
+                elif following in '"\\/bfnrt':
+                    out.append(char + following)
+                    i += 2
+                    continue
+                else:
+                    out.append("\\\\")
+                    repairs.add("invalid_escape")
+            elif char == quote:
+                if quote == '"' and _next_significant_char(text, i + 1) not in ",:}]":
+                    out.append('\\"')
+                    repairs.add("inner_quote")
+                else:
+                    out.append('"')
+                    quote = None
+            elif char == '"':
+                out.append('\\"')
+            elif char == "\n":
+                out.append("\\n")
+                repairs.add("control_character")
+            elif char == "\r":
+                out.append("\\r")
+                repairs.add("control_character")
+            elif char == "\t":
+                out.append("\\t")
+                repairs.add("control_character")
+            elif ord(char) < 0x20:
+                out.append(f"\\u{ord(char):04x}")
+                repairs.add("control_character")
+            else:
+                out.append(char)
+            i += 1
+            continue
+
+        if char in "\"'":
+            if char == "'":
+                repairs.add("single_quotes")
+            quote = char
+            out.append('"')
+        elif char in "{[":
+            stack.append(char)
+            out.append(char)
+        elif char in "}]":
+            # drop a trailing comma before the closing bracket
+            while out and out[-1] in " \t\r\n":
+                out.pop()
+            if out and out[-1] == ",":
+                out.pop()
+                repairs.add("trailing_comma")
+            if stack:
+                stack.pop()
+            out.append(char)
+        else:
+            literal = re.match(r"(True|False|None)\b", text[i:])
+            if literal:
+                out.append({"True": "true", "False": "false", "None": "null"}[literal.group(1)])
+                repairs.add("python_literal")
+                i += len(literal.group(1))
+                continue
+            out.append(char)
+        i += 1
+
+    # close the brackets a response cut off between two values left open
+    if quote is not None or stack:
+        repairs.add("truncated")
+    if quote is not None: # e.g. the content of a file to write, closing the string would keep half of it
+        return None
+    if stack:
+        while out and out[-1] in " \t\r\n,":
+            out.pop()
+        if out and out[-1] == ":": # a key without its value
+            return None
+        for opener in reversed(stack):
+            out.append("}" if opener == "{" else "]")
+    return "".join(out)
+
+def _decode_object_reaching_end(text: str, repairs: set) -> dict | None:
+    """Find an object that is valid as is and runs to the end of the text, skipping text before it."""
+    decoder = json.JSONDecoder()
+    tail = text.rstrip().removesuffix("```").rstrip()
+    for match in re.finditer(r"\{\s*\"", tail):
+        try:
+            parsed, end = decoder.raw_decode(tail, match.start())
+        except json.JSONDecodeError:
+            continue
+        if end == len(tail) and isinstance(parsed, dict):
+            if has_latex_escapes(tail[match.start():]):
+                parsed = json.loads(_repair_characters(tail[match.start():], repairs)) # complete, never None
+            return parsed
+    return None
+
+def repair_json(text: str) -> tuple[dict | None, list[str]]:
+    """Locally repair an LLM reply that should have been a JSON object.
+    Returns the parsed object, or None if the reply could not be repaired, and the repairs applied."""
+    repairs = set()
+    text = text.strip()
+
+    if text.startswith("<think>"):
+        think_end = text.find("</think>")
+        if think_end == -1:
+            repairs.add("unclosed_think")
+            text = text[len("<think>"):]
+            # the reasoning itself may contain braces, so only accept an object that ends the reply
+            return _decode_object_reaching_end(text, repairs), sorted(repairs)
+        else:
+            text = text[think_end + len("</think>"):].strip()
+
+    fenced = [block for block in CODE_FENCE_PATTERN.findall(text) if "{" in block]
+    if fenced:
+        repairs.add("code_fence")
+        text = fenced[0].strip()
+    elif "```" in text:
+        repairs.add("code_fence")
+        text = re.sub(r"```(?:json|JSON)?", "", text).strip()
+
+    start = text.find("{")
+    if start == -1:
+        return None, sorted(repairs)
+    end = text.rfind("}")
+    if start > 0 or (end != -1 and text[end + 1:].strip()):
+        repairs.add("surrounding_text")
+    text = text[start:end + 1] if end > start else text[start:]
+
+    if not has_latex_escapes(text):
+        try:
+            return json.loads(text), sorted(repairs)
+        except json.JSONDecodeError:
+            pass
+    candidate = _repair_characters(text, repairs)
+    if candidate is None:
+        logger.debug("Local JSON repair failed: the response was cut off in the middle of a value")
+        return None, sorted(repairs)
+    try:
+        parsed = json.loads(candidate)
+    except json.JSONDecodeError as e:
+        logger.debug(f"Local JSON repair failed: {e}")
+        return None, sorted(repairs)
+    if not isinstance(parsed, dict):
+        return None, sorted(repairs)
+    return parsed, sorted(repairs)
+
+
+__all__ = ["repair_json", "has_latex_escapes", "JSONRepairStats"]
@@ -0,0 +1,132 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from langchain_core.messages import AnyMessage, BaseMessage, message_to_dict, messages_from_dict
+from loguru import logger
+from .config import LLM_CACHE_CONFIG
+from .llms import get_model_name
+
+def serialize_messages(messages: list[AnyMessage]) -> list[dict]:
+    """Serialize the parts of the messages that reach the provider. Message ids are left out on purpose,
+    as they differ between runs for otherwise identical conversations."""
+    return [{"type": msg.type, "name": msg.name, "content": msg.content} for msg in messages]
+
+def get_model_params(llm) -> dict:
+    return dict(getattr(llm, "_identifying_params", {}) or {})
+
+def request_fingerprint(model_name: str, messages: list[AnyMessage], model_params: dict = None) -> str:
+    payload = json.dumps(
+        {"model": model_name, "messages": serialize_messages(messages), "params": model_params or {}},
+        sort_keys=True, ensure_ascii=False, default=str,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class LLMResponseCache:
+    """On-disk, content-addressed cache of LLM responses, keyed by (model id, messages, model kwargs).
+
+    Entries expire after `ttl_hours`, and the least recently used entries are evicted once the
+    cache grows beyond `max_size_mb`. Caching is opt-in, globally with `enable` and per model
+    with `models: {<model name>: true/false}` in the `features.llm_cache` section of config.yaml.
+    """
+    _instance = None
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super().__new__(cls)
+            cls._instance.enabled = LLM_CACHE_CONFIG.get("enable", False)
+            cls._instance.model_flags = LLM_CACHE_CONFIG.get("models", None) or {}
+            cls._instance.path = Path(LLM_CACHE_CONFIG.get("path", "data/cache/llm_responses.sqlite"))
+            cls._instance.max_size_bytes = int(LLM_CACHE_CONFIG.get("max_size_mb", 256) * 1024 * 1024)
+            cls._instance.ttl_seconds = LLM_CACHE_CONFIG.get("ttl_hours", 24 * 7) * 3600
+            cls._instance.stats = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0, "expired": 0}
+            cls._instance._conn = None
+            cls._instance._lock = threading.Lock()
+        return cls._instance
+
+    def __init__(self):
+        pass
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, model TEXT, response TEXT, size INTEGER, created_at REAL, accessed_at REAL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at)")
+            self._conn.commit()
+            logger.info(f"LLM response cache opened at {self.path.absolute().as_posix()}")
+        return self._conn
+
+    def is_enabled_for(self, model_name: str) -> bool:
+        return bool(self.model_flags.get(model_name, self.enabled))
+
+    def get(self, llm, messages: list[AnyMessage]) -> BaseMessage | None:
+        model_name = get_model_name(llm)
+        if not self.is_enabled_for(model_name):
+            return None
+        key = request_fingerprint(model_name, messages, get_model_params(llm))
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            row = conn.execute("SELECT response, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is not None and now - row[1] > self.ttl_seconds:
+                conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                conn.commit()
+                self.stats["expired"] += 1
+                row = None
+            if row is None:
+                self.stats["misses"] += 1
+                return None
+            conn.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+            conn.commit()
+            self.stats["hits"] += 1
+        logger.info(f"LLM response cache hit for model {model_name}, key {key[:12]}")
+        return messages_from_dict([json.loads(row[0])])[0]
+
+    def put(self, llm, messages: list[AnyMessage], response: BaseMessage):
+        model_name = get_model_name(llm)
+        if not self.is_enabled_for(model_name):
+            return
+        key = request_fingerprint(model_name, messages, get_model_params(llm))
+        data = json.dumps(message_to_dict(response), ensure_ascii=False, default=str)
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            conn.execute(
+                "INSERT OR REPLACE INTO responses (key, model, response, size, created_at, accessed_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (key, model_name, data, len(data.encode("utf-8")), now, now),
+            )
+            self.stats["stores"] += 1
+            self._evict(conn, now)
+            conn.commit()
+
+    def _evict(self, conn: sqlite3.Connection, now: float):
+        expired = conn.execute("DELETE FROM responses WHERE created_at < ?", (now - self.ttl_seconds,)).rowcount
+        self.stats["expired"] += max(expired, 0)
+        total_size = conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total_size <= self.max_size_bytes:
+            return
+        for key, size in conn.execute("SELECT key, size FROM responses ORDER BY accessed_at ASC").fetchall():
+            if total_size <= self.max_size_bytes:
+                break
+            conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            total_size -= size
+            self.stats["evictions"] += 1
+
+    def get_stats(self) -> dict:
+        return dict(self.stats)
+
+    def clear(self):
+        with self._lock:
+            conn = self._connection()
+            conn.execute("DELETE FROM responses")
+            conn.commit()
+
+
+__all__ = ["LLMResponseCache", "request_fingerprint", "serialize_messages"]
@@ -1,7 +1,9 @@
 import json
+import time
 import traceback
+from contextlib import contextmanager
 from loguru import logger
-from langchain_core.messages import HumanMessage
+from langchain_core.messages import HumanMessage, message_chunk_to_message
 from requests import HTTPError
 from openai import RateLimitError
 from tenacity import (
@@ -11,11 +13,26 @@ from tenacity import (
     RetryCallState
 )
 from requests.exceptions import HTTPError
-from openai import RateLimitError, InternalServerError, APIConnectionError
-from .llms import JSON_ENSURE_MODEL
+from openai import RateLimitError, InternalServerError, APIConnectionError, APITimeoutError
+from .llms import get_role_model, get_model_name, get_model_provider
+from .llm_cache import LLMResponseCache
+from .llm_transport import TRANSPORT_MODE, CassetteRecorder
+from .rate_limiter import RateLimiter, compute_backoff, get_exception_headers, parse_retry_after
+from .streaming_json import ToolCallStreamParser
+from .json_repair import repair_json, has_latex_escapes, JSONRepairStats
+from .hedging import ModelChain, LatencyTracker, call_with_chain, acall_with_chain, HEDGE_MODEL_ATTEMPTS
+from .message_layout import layout_for_request
+from .async_runtime import arun_blocking
+from .usage import UsageTracker, CallTimer, register_metrics_source
 import json
 
 
+register_metrics_source("llm_cache", lambda: LLMResponseCache().get_stats())
+register_metrics_source("rate_limits", lambda: RateLimiter().get_stats())
+register_metrics_source("json_repair", lambda: JSONRepairStats().get_stats())
+register_metrics_source("latency_histograms", lambda: LatencyTracker().get_histograms())
+
+
 class InvalidResponseFormatError(Exception):
     pass
 
@@ -29,17 +46,29 @@ def retry_handler(exception: Exception) -> bool:
                                   InternalServerError, 
                                   APIConnectionError))
 
+def _get_bucket(llm):
+    model_name = get_model_name(llm)
+    return RateLimiter().get_bucket(get_model_provider(model_name), model_name)
+
 def wait_handler(retry_state: RetryCallState) -> float:
     exception = retry_state.outcome.exception()
-    if isinstance(exception, HTTPError) and exception.response.status_code == 429:
-        return 5
-    if isinstance(exception, RateLimitError):
-        return 15
-    if isinstance(exception, InternalServerError):
-        return 60
-    if isinstance(exception, APIConnectionError):
-        return 10
-    return 0.1
+    is_rate_limited = isinstance(exception, RateLimitError) or (
+        isinstance(exception, HTTPError) and exception.response.status_code == 429)
+    if is_rate_limited:
+        base_seconds = 4
+    elif isinstance(exception, InternalServerError):
+        base_seconds = 15
+    elif isinstance(exception, APIConnectionError):
+        base_seconds = 4
+    else:
+        return 0.1
+    headers = get_exception_headers(exception)
+    wait = compute_backoff(retry_state.attempt_number, base_seconds, parse_retry_after(headers))
+    if is_rate_limited and retry_state.args: # the first argument of the retried call is the llm
+        bucket = _get_bucket(retry_state.args[0])
+        bucket.on_rate_limit_error(headers, backoff_seconds=wait)
+        bucket.block_for(wait) # every other caller of this model queues behind the retry
+    return wait
 
 def before_retry_log(retry_state: RetryCallState):
     exception = retry_state.outcome.exception()
@@ -52,16 +81,182 @@ retry = tenacity_retry(
     before_sleep=before_retry_log,
 )
 
+def _in_chain(func):
+    """`func` with the short retry budget of one model of a fallback chain: after it the next model is tried."""
+    return func.retry_with(stop=stop_after_attempt(HEDGE_MODEL_ATTEMPTS))
+
+def request_timeout(llm) -> float:
+    """Timeout of one request, derived from the latencies observed for the model."""
+    return LatencyTracker().timeout(get_model_name(llm))
+
+def _get_cached_response(llm, messages):
+    if TRANSPORT_MODE == "replay": # the cassette already serves every response, in order
+        return None
+    return LLMResponseCache().get(llm, messages)
+
+def _estimate_tokens(messages) -> int:
+    return sum(len(str(message.content)) for message in messages) // 4
+
+def _learn_rate_limits(bucket, response, estimated_tokens: int):
+    headers = response.response_metadata.get("headers")
+    if headers:
+        bucket.update_from_headers(headers)
+    bucket.on_success()
+    usage = getattr(response, "usage_metadata", None)
+    if usage and usage.get("total_tokens"):
+        bucket.adjust_tokens(usage["total_tokens"] - estimated_tokens)
+
+@contextmanager
+def _latency_sample(llm):
+    """Record the wall time of a live request for the model; a timed out one is a censored sample."""
+    start = time.monotonic()
+    try:
+        yield
+    except APITimeoutError:
+        LatencyTracker().record(get_model_name(llm), time.monotonic() - start, censored=True)
+        raise
+    LatencyTracker().record(get_model_name(llm), time.monotonic() - start)
+
+def invoke_llm(llm, messages, **kwargs):
+    """Invoke the LLM through the response cache, the rate limiter and the record/replay transport.
+    Returns the response and whether it came from the cache."""
+    if isinstance(llm, ModelChain):
+        return call_with_chain(llm, lambda model: invoke_llm(model, messages, **kwargs))
+    timer = CallTimer()
+    cached_response = _get_cached_response(llm, messages)
+    if cached_response is not None:
+        response = cached_response
+    elif TRANSPORT_MODE == "replay":
+        response = llm.invoke(layout_for_request(llm, messages), **kwargs)
+    else:
+        bucket, estimated_tokens = _get_bucket(llm), _estimate_tokens(messages)
+        with RateLimiter().provider_slot(bucket):
+            RateLimiter().acquire(bucket, estimated_tokens)
+            with _latency_sample(llm):
+                response = llm.invoke(layout_for_request(llm, messages), **kwargs)
+        _learn_rate_limits(bucket, response, estimated_tokens)
+    CassetteRecorder().record(get_model_name(llm), messages, response)
+    UsageTracker().record(get_model_name(llm), response, timer.elapsed, timer.first_token, cached_response is not None)
+    return response, cached_response is not None
+
+async def ainvoke_llm(llm, messages, **kwargs):
+    if isinstance(llm, ModelChain):
+        return await acall_with_chain(llm, lambda model: ainvoke_llm(model, messages, **kwargs))
+    timer = CallTimer()
+    cached_response = _get_cached_response(llm, messages)
+    if cached_response is not None:
+        response = cached_response
+    elif TRANSPORT_MODE == "replay":
+        response = await llm.ainvoke(layout_for_request(llm, messages), **kwargs)
+    else:
+        bucket, estimated_tokens = _get_bucket(llm), _estimate_tokens(messages)
+        async with RateLimiter().aprovider_slot(bucket):
+            await RateLimiter().aacquire(bucket, estimated_tokens)
+            with _latency_sample(llm):
+                response = await llm.ainvoke(layout_for_request(llm, messages), **kwargs)
+        _learn_rate_limits(bucket, response, estimated_tokens)
+    CassetteRecorder().record(get_model_name(llm), messages, response)
+    UsageTracker().record(get_model_name(llm), response, timer.elapsed, timer.first_token, cached_response is not None)
+    return response, cached_response is not None
+
+def invoke_llm_with_retry(llm, messages, **kwargs):
+    """`invoke_llm` retried on rate limits and server errors, for responses that are not parsed as JSON."""
+    if isinstance(llm, ModelChain):
+        return call_with_chain(llm, lambda model: _in_chain(_invoke_llm_with_retry)(model, messages, **kwargs))
+    return _invoke_llm_with_retry(llm, messages, **kwargs)
+
 @retry
+def _invoke_llm_with_retry(llm, messages, **kwargs):
+    return invoke_llm(llm, messages, **kwargs)
+
+async def ainvoke_llm_with_retry(llm, messages, **kwargs):
+    if isinstance(llm, ModelChain):
+        return await acall_with_chain(llm, lambda model: _in_chain(_ainvoke_llm_with_retry)(model, messages, **kwargs))
+    return await _ainvoke_llm_with_retry(llm, messages, **kwargs)
+
+@retry
+async def _ainvoke_llm_with_retry(llm, messages, **kwargs):
+    return await ainvoke_llm(llm, messages, **kwargs)
+
+def _chunk_text(chunk) -> str:
+    if isinstance(chunk.content, str):
+        return chunk.content
+    return "".join(block.get("text", "") for block in chunk.content if isinstance(block, dict) and block.get("type") == "text")
+
+def _stream(llm, messages, timer, on_text, **kwargs):
+    full = None
+    for chunk in llm.stream(layout_for_request(llm, messages), **kwargs):
+        full = chunk if full is None else full + chunk
+        timer.mark_first_token()
+        if on_text:
+            on_text(_chunk_text(chunk))
+    return message_chunk_to_message(full)
+
+async def _astream(llm, messages, timer, on_text, **kwargs):
+    full = None
+    async for chunk in llm.astream(layout_for_request(llm, messages), **kwargs):
+        full = chunk if full is None else full + chunk
+        timer.mark_first_token()
+        if on_text:
+            on_text(_chunk_text(chunk))
+    return message_chunk_to_message(full)
+
+def stream_llm(llm, messages, on_text=None, **kwargs):
+    """Like `invoke_llm`, but streams the response and calls `on_text` with every piece of text as it arrives."""
+    timer = CallTimer()
+    cached_response = _get_cached_response(llm, messages)
+    if cached_response is not None:
+        response = cached_response
+        if on_text:
+            on_text(_chunk_text(response))
+    elif TRANSPORT_MODE == "replay":
+        response = _stream(llm, messages, timer, on_text, **kwargs)
+    else:
+        bucket, estimated_tokens = _get_bucket(llm), _estimate_tokens(messages)
+        with RateLimiter().provider_slot(bucket):
+            RateLimiter().acquire(bucket, estimated_tokens)
+            response = _stream(llm, messages, timer, on_text, **kwargs)
+        _learn_rate_limits(bucket, response, estimated_tokens)
+    CassetteRecorder().record(get_model_name(llm), messages, response)
+    UsageTracker().record(get_model_name(llm), response, timer.elapsed, timer.first_token, cached_response is not None)
+    return response, cached_response is not None
+
+async def astream_llm(llm, messages, on_text=None, **kwargs):
+    timer = CallTimer()
+    cached_response = _get_cached_response(llm, messages)
+    if cached_response is not None:
+        response = cached_response
+        if on_text:
+            on_text(_chunk_text(response))
+    elif TRANSPORT_MODE == "replay":
+        response = await _astream(llm, messages, timer, on_text, **kwargs)
+    else:
+        bucket, estimated_tokens = _get_bucket(llm), _estimate_tokens(messages)
+        async with RateLimiter().aprovider_slot(bucket):
+            await RateLimiter().aacquire(bucket, estimated_tokens)
+            response = await _astream(llm, messages, timer, on_text, **kwargs)
+        _learn_rate_limits(bucket, response, estimated_tokens)
+    CassetteRecorder().record(get_model_name(llm), messages, response)
+    UsageTracker().record(get_model_name(llm), response, timer.elapsed, timer.first_token, cached_response is not None)
+    return response, cached_response is not None
+
 def get_and_parse_json_response(llm, messages) -> tuple[str, dict]:
+    if isinstance(llm, ModelChain):
+        return call_with_chain(llm, lambda model: _in_chain(_get_and_parse_json_response)(model, messages))
+    return _get_and_parse_json_response(llm, messages)
+
+@retry
+def _get_and_parse_json_response(llm, messages) -> tuple[str, dict]:
     logger.info(f"Invoking LLM with last message: \n{messages[-1].content}")
-    response = llm.invoke(messages)
+    response, from_cache = invoke_llm(llm, messages)
     logger.info(f"LLM response: \n{response.content}")
     if response.additional_kwargs.get("reasoning_content"):
         logger.info(f"Reasoning content: {response.additional_kwargs['reasoning_content']}")
-    response, parsed = parse_json_response(response.content)
+    response_content, parsed = parse_json_response(response.content)
     logger.info(f"Parsed response: \n{json.dumps(parsed, indent=4)}")
-    return response, parsed
+    if not from_cache: # only cache responses that parsed, so a retry does not replay a broken one
+        LLMResponseCache().put(llm, messages, response)
+    return response_content, parsed
 
 
 def split_reasoning_and_response(response: str) -> tuple[str, str]:
@@ -78,23 +273,103 @@ def split_reasoning_and_response(response: str) -> tuple[str, str]:
 
 def parse_json_response(response: str) -> tuple[str, dict]:
     response = response.strip()
-    reasoning_content, response = split_reasoning_and_response(response)
+    stats = JSONRepairStats()
+    try:
+        reasoning_content, response = split_reasoning_and_response(response)
+    except InvalidResponseFormatError:
+        parsed, repairs = repair_json(response)
+        if parsed is None:
+            stats.record("failed", repairs)
+            raise
+        logger.warning(f"Thinking section not closed, recovered the JSON object after it. Repairs: {repairs}")
+        stats.record("repaired", repairs)
+        return json.dumps(parsed, ensure_ascii=False), parsed # without the reasoning
     response = response.strip().removeprefix("```json").removesuffix("```")
     try:
+        if has_latex_escapes(response): # valid JSON maybe, but \frac would parse into a form feed
+            raise json.JSONDecodeError("LaTeX command read as a JSON escape", response, 0)
         parsed = json.loads(response)
+        stats.record("direct")
     except json.JSONDecodeError:
-        logger.warning(f"Response is not a valid JSON object, trying to format it using LLM")
-        parsed = ensure_JSON_LLM_call(response)
+        parsed, repairs = repair_json(response)
+        if parsed is not None:
+            logger.warning(f"Response is not a valid JSON object, repaired it locally. Repairs: {repairs}")
+            stats.record("repaired", repairs)
+        elif "truncated" in repairs: # the formatter would have to make up the rest, ask the model again
+            stats.record("failed", repairs)
+            raise InvalidResponseFormatError("Response was cut off in the middle of a value")
+        else:
+            logger.warning(f"Response is not a valid JSON object, trying to format it using LLM")
+            try:
+                parsed = ensure_JSON_LLM_call(response)
+            except Exception:
+                stats.record("failed", repairs)
+                raise
+            stats.record("llm_fallback", repairs)
     return response, parsed
 
+async def aget_and_parse_json_response(llm, messages) -> tuple[str, dict]:
+    if isinstance(llm, ModelChain):
+        return await acall_with_chain(llm, lambda model: _in_chain(_aget_and_parse_json_response)(model, messages))
+    return await _aget_and_parse_json_response(llm, messages)
+
 @retry
-async def aget_and_parse_json_response(llm, messages):
+async def _aget_and_parse_json_response(llm, messages) -> tuple[str, dict]:
     logger.info(f"Invoking LLM with last message: \n{messages[-1].content}")
-    response = await llm.ainvoke(messages, timeout=30)
+    response, from_cache = await ainvoke_llm(llm, messages, timeout=request_timeout(llm))
     logger.info(f"LLM response: \n{response.content}")
-    response, parsed = parse_json_response(response.content)
+    # off the event loop, parsing may fall back to a blocking LLM call
+    response_content, parsed = await arun_blocking(parse_json_response, response.content)
     logger.info(f"Parsed response: \n{json.dumps(parsed, indent=4)}")
-    return response, parsed
+    if not from_cache:
+        LLMResponseCache().put(llm, messages, response)
+    return response_content, parsed
+
+def _make_tool_call_feeder(on_tool_call):
+    if hasattr(on_tool_call, "reset"): # a new attempt, tool calls of a failed one must not be reused
+        on_tool_call.reset()
+    parser = ToolCallStreamParser()
+    def on_text(text: str):
+        for tool_call in parser.feed(text):
+            logger.info(f"Streamed tool call completed early: {tool_call}")
+            on_tool_call(tool_call)
+    return on_text
+
+def stream_and_parse_json_response(llm, messages, on_tool_call) -> tuple[str, dict]:
+    """Streaming variant of `get_and_parse_json_response`. `on_tool_call` is called with each entry of
+    the response's "tool_calls" list as soon as its JSON object is complete."""
+    if isinstance(llm, ModelChain):
+        return call_with_chain(llm, lambda model: _in_chain(_stream_and_parse_json_response)(model, messages, on_tool_call))
+    return _stream_and_parse_json_response(llm, messages, on_tool_call)
+
+@retry
+def _stream_and_parse_json_response(llm, messages, on_tool_call) -> tuple[str, dict]:
+    logger.info(f"Streaming LLM with last message: \n{messages[-1].content}")
+    response, from_cache = stream_llm(llm, messages, _make_tool_call_feeder(on_tool_call))
+    logger.info(f"LLM response: \n{response.content}")
+    if response.additional_kwargs.get("reasoning_content"):
+        logger.info(f"Reasoning content: {response.additional_kwargs['reasoning_content']}")
+    response_content, parsed = parse_json_response(response.content)
+    logger.info(f"Parsed response: \n{json.dumps(parsed, indent=4)}")
+    if not from_cache:
+        LLMResponseCache().put(llm, messages, response)
+    return response_content, parsed
+
+async def astream_and_parse_json_response(llm, messages, on_tool_call) -> tuple[str, dict]:
+    if isinstance(llm, ModelChain):
+        return await acall_with_chain(llm, lambda model: _in_chain(_astream_and_parse_json_response)(model, messages, on_tool_call))
+    return await _astream_and_parse_json_response(llm, messages, on_tool_call)
+
+@retry
+async def _astream_and_parse_json_response(llm, messages, on_tool_call) -> tuple[str, dict]:
+    logger.info(f"Streaming LLM with last message: \n{messages[-1].content}")
+    response, from_cache = await astream_llm(llm, messages, _make_tool_call_feeder(on_tool_call))
+    logger.info(f"LLM response: \n{response.content}")
+    response_content, parsed = await arun_blocking(parse_json_response, response.content)
+    logger.info(f"Parsed response: \n{json.dumps(parsed, indent=4)}")
+    if not from_cache:
+        LLMResponseCache().put(llm, messages, response)
+    return response_content, parsed
 
 
 ENSURE_JSON_PROMPT = """
@@ -106,8 +381,7 @@ Here is the response:
 
 def ensure_JSON_LLM_call(response: str) -> dict:
     logger.info(f"Ensuring JSON: {response}")
-    result = json.loads(JSON_ENSURE_MODEL.invoke(
-        [HumanMessage(content=ENSURE_JSON_PROMPT + response)]
-    ).content)
+    ensured, _ = invoke_llm(get_role_model("json_ensure_model"), [HumanMessage(content=ENSURE_JSON_PROMPT + response)])
+    result = json.loads(ensured.content)
     logger.info(f"Ensured JSON: {result}")
     return result
@@ -0,0 +1,131 @@
+import json
+import threading
+from pathlib import Path
+from typing import Any
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AnyMessage, BaseMessage, message_to_dict, messages_from_dict
+from langchain_core.outputs import ChatGeneration, ChatResult
+from loguru import logger
+from .config import LLM_TRANSPORT_CONFIG
+from .llm_cache import request_fingerprint, serialize_messages
+from .timestamp import get_current_run_timestamp
+
+TRANSPORT_MODES = ("live", "record", "replay")
+TRANSPORT_MODE = LLM_TRANSPORT_CONFIG.get("mode", "live")
+if TRANSPORT_MODE not in TRANSPORT_MODES:
+    raise ValueError(f"Invalid llm_transport mode '{TRANSPORT_MODE}', expected one of {TRANSPORT_MODES}")
+
+logger.info(f"LLM transport mode is {TRANSPORT_MODE}")
+
+
+class CassetteMissError(Exception):
+    pass
+
+def get_cassette_path() -> Path:
+    if LLM_TRANSPORT_CONFIG.get("cassette"):
+        return Path(LLM_TRANSPORT_CONFIG["cassette"])
+    if TRANSPORT_MODE == "replay":
+        raise ValueError("llm_transport.cassette must be set in config.yaml to replay a run")
+    return Path("data") / "cassettes" / f"{get_current_run_timestamp()}.jsonl"
+
+
+class CassetteRecorder:
+    """Appends every LLM request/response made through llm_calling.py to a JSONL cassette, in record mode."""
+    _instance = None
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super().__new__(cls)
+            cls._instance._file = None
+            cls._instance._lock = threading.Lock()
+        return cls._instance
+
+    def __init__(self):
+        pass
+
+    def record(self, model_name: str, messages: list[AnyMessage], response: BaseMessage):
+        if TRANSPORT_MODE != "record":
+            return
+        entry = {
+            "model": model_name,
+            "key": request_fingerprint(model_name, messages),
+            "messages": serialize_messages(messages),
+            "response": message_to_dict(response),
+        }
+        line = json.dumps(entry, ensure_ascii=False, default=str)
+        with self._lock:
+            if self._file is None:
+                path = get_cassette_path()
+                path.parent.mkdir(parents=True, exist_ok=True)
+                self._file = open(path, "a", encoding="utf-8")
+                logger.info(f"Recording LLM calls to {path.absolute().as_posix()}")
+            self._file.write(line + "\n")
+            self._file.flush()
+
+
+class Cassette:
+    """Recorded responses of a run, served per model.
+
+    A request is answered by the first unused entry of the same model with an identical request
+    fingerprint. When prompts differ from the recording (they contain timestamps, for instance),
+    the next unused entry of that model in recorded order is served instead.
+    """
+    _instances = {}
+    _instances_lock = threading.Lock()
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._entries = {}
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    self._entries.setdefault(entry["model"], []).append(entry)
+        logger.info(f"Loaded cassette {path.as_posix()} with {sum(len(v) for v in self._entries.values())} responses")
+
+    @classmethod
+    def load(cls, path: Path) -> "Cassette":
+        key = Path(path).absolute().as_posix()
+        with cls._instances_lock:
+            if key not in cls._instances:
+                cls._instances[key] = cls(Path(path))
+            return cls._instances[key]
+
+    def next_response(self, model_name: str, messages: list[AnyMessage]) -> BaseMessage:
+        key = request_fingerprint(model_name, messages)
+        with self._lock:
+            entries = self._entries.get(model_name, [])
+            if not entries:
+                raise CassetteMissError(f"No recorded responses left for model '{model_name}' in {self.path.as_posix()}")
+            index = next((i for i, entry in enumerate(entries) if entry["key"] == key), None)
+            if index is None:
+                logger.warning(f"No exact cassette match for model '{model_name}', serving the next recorded response")
+                index = 0
+            entry = entries.pop(index)
+        return messages_from_dict([entry["response"]])[0]
+
+
+class CassetteChatModel(BaseChatModel):
+    """Fake chat model that answers from a cassette, so the graph runs without provider keys or network."""
+    model_name: str
+    cassette_path: str
+
+    @property
+    def _llm_type(self) -> str:
+        return "cassette-replay"
+
+    @property
+    def _identifying_params(self) -> dict[str, Any]:
+        return {"model_name": self.model_name}
+
+    def _generate(self, messages: list[BaseMessage], stop: list[str] | None = None, run_manager=None, **kwargs: Any) -> ChatResult:
+        message = Cassette.load(Path(self.cassette_path)).next_response(self.model_name, messages)
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+
+def make_replay_model(model_name: str) -> CassetteChatModel:
+    return CassetteChatModel(model_name=model_name, cassette_path=get_cassette_path().as_posix())
+
+
+__all__ = ["TRANSPORT_MODE", "CassetteRecorder", "Cassette", "CassetteChatModel", "CassetteMissError", "make_replay_model"]
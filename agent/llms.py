@@ -1,124 +1,184 @@
 import os
+import threading
 import warnings
-from langchain_anthropic import ChatAnthropic
-from langchain_openai import ChatOpenAI
-from langchain_deepseek import ChatDeepSeek
-from langchain_xai import ChatXAI
-from langchain_google_genai import ChatGoogleGenerativeAI
+from functools import partial
+from urllib.parse import urlparse
 from loguru import logger
 from .config import CONFIG
+from .hedging import ModelChain
 
-with warnings.catch_warnings():
-    warnings.filterwarnings("ignore", category=UserWarning, message=r"WARNING! response_format is not default parameter")
-
-    AVAILABLE_MODELS = {
-        "gpt-4o": ChatOpenAI(
-            api_key=os.getenv("OPENAI_API_KEY"),
-            model="gpt-4o"
-        ),
-        "gpt-4o-mini": ChatOpenAI(
-            api_key=os.getenv("OPENAI_API_KEY"),
-            model="gpt-4o-mini"
-        ),
-        "gpt-4o-json": ChatOpenAI(
-            api_key=os.getenv("OPENAI_API_KEY"),
-            model="gpt-4o",
-            response_format={ "type": "json_object" }
-        ),
-        "gpt-4o-mini-json": ChatOpenAI(
-            api_key=os.getenv("OPENAI_API_KEY"),
-            model="gpt-4o-mini",
-            response_format={ "type": "json_object" }
-        ),
-        "claude-3-5-sonnet": ChatAnthropic(
-            model="claude-3-5-sonnet-latest",
-        ),
-        "o1": ChatOpenAI(
-            model="o1",
-            api_key=os.getenv("OPENAI_API_KEY"),
-        ),
-        "o3-mini": ChatOpenAI(
-            model="o3-mini",
-            reasoning_effort="high",
-            api_key=os.getenv("OPENAI_API_KEY"),
-        ),
-        "deepseek-chat": ChatDeepSeek(
-            api_key=os.getenv("DEEPSEEK_API_KEY"),
-            model="deepseek-chat"
-        ),
-        "deepseek-reasoner": ChatDeepSeek(
-            api_key=os.getenv("DEEPSEEK_API_KEY"),
-            model="deepseek-reasoner",
-            max_tokens=8192
-        ),
-        "deepseek-chat-sf": ChatOpenAI(
-            model="deepseek-ai/DeepSeek-V3",
-            api_key=os.getenv("SILICON_FLOW_API_KEY"),
-            base_url="https://api.siliconflow.cn/v1"
-        ),
-        "deepseek-reasoner-sf": ChatOpenAI(
-            model="deepseek-ai/DeepSeek-R1",
-            api_key=os.getenv("SILICON_FLOW_API_KEY"),
-            base_url="https://api.siliconflow.cn/v1",
-            max_tokens=8192
-        ),
-        "deepseek-reasoner-bce": ChatOpenAI(
-            api_key=os.getenv("BCE_API_KEY"),
-            model="deepseek-r1",
-            base_url="https://qianfan.baidubce.com/v2"
-        ),
-        "grok-2": ChatXAI(
-            model="grok-2-latest",
-            api_key=os.getenv("XAI_API_KEY"),
-        ),
-        "gemini-2.0-flash-thinking-exp": ChatGoogleGenerativeAI(
-            model="gemini-2.0-flash-thinking-exp-01-21",
-            api_key=os.getenv("GEMINI_API_KEY"),
-        ),
-        "gemini-2.0-flash": ChatGoogleGenerativeAI(
-            model="gemini-2.0-flash",
-            api_key=os.getenv("GEMINI_API_KEY"),
-        ),
-        "deepseek-reasoner-openrouter": ChatOpenAI(
-            model="deepseek/deepseek-r1:free",
-            api_key=os.getenv("OPENROUTER_API_KEY"),
-            base_url="https://openrouter.ai/api/v1"
-        ),
-    }
+# Provider SDKs are imported inside the factories below: importing langchain_anthropic,
+# langchain_google_genai, etc. is the expensive part of building a model, and a run only
+# needs the two or three models named in config.yaml.
 
-try:
-    llms_config = CONFIG["llms"]
-    
-    required_configs = [
-        "memory_relevance_model",
-        "supervisor_model",
-        "member_default_model",
-        "memory_processor_model",
-        "math_agent_model",
-        "image_description_model",
-        "json_ensure_model"
-    ]
-    
-    for key in required_configs:
+def _pooled_http_clients(base_url: str) -> dict:
+    """Models pointing at the same endpoint share one keep-alive connection pool."""
+    from .http_pool import get_http_client, get_async_http_client
+    return {"http_client": get_http_client(base_url), "http_async_client": get_async_http_client(base_url)}
+
+def _chat_openai(api_key_env: str = "OPENAI_API_KEY", **kwargs):
+    from langchain_openai import ChatOpenAI
+    http_clients = _pooled_http_clients(kwargs.get("base_url") or DEFAULT_BASE_URLS[_chat_openai])
+    return ChatOpenAI(api_key=os.getenv(api_key_env), include_response_headers=True, **http_clients, **kwargs)
+
+def _chat_anthropic(**kwargs):
+    from langchain_anthropic import ChatAnthropic
+    return ChatAnthropic(**kwargs)
+
+def _chat_deepseek(**kwargs):
+    from langchain_deepseek import ChatDeepSeek
+    return ChatDeepSeek(api_key=os.getenv("DEEPSEEK_API_KEY"), **_pooled_http_clients(DEFAULT_BASE_URLS[_chat_deepseek]), **kwargs)
+
+def _chat_xai(**kwargs):
+    from langchain_xai import ChatXAI
+    return ChatXAI(api_key=os.getenv("XAI_API_KEY"), **_pooled_http_clients(DEFAULT_BASE_URLS[_chat_xai]), **kwargs)
+
+def _chat_google(**kwargs):
+    from langchain_google_genai import ChatGoogleGenerativeAI
+    return ChatGoogleGenerativeAI(api_key=os.getenv("GEMINI_API_KEY"), **kwargs)
+
+DEFAULT_BASE_URLS = {
+    _chat_openai: "https://api.openai.com/v1",
+    _chat_anthropic: "https://api.anthropic.com",
+    _chat_deepseek: "https://api.deepseek.com",
+    _chat_xai: "https://api.x.ai/v1",
+    _chat_google: "https://generativelanguage.googleapis.com",
+}
+
+MODEL_FACTORIES = {
+    "gpt-4o": partial(_chat_openai, model="gpt-4o"),
+    "gpt-4o-mini": partial(_chat_openai, model="gpt-4o-mini"),
+    "gpt-4o-json": partial(_chat_openai, model="gpt-4o", response_format={ "type": "json_object" }),
+    "gpt-4o-mini-json": partial(_chat_openai, model="gpt-4o-mini", response_format={ "type": "json_object" }),
+    "claude-3-5-sonnet": partial(_chat_anthropic, model="claude-3-5-sonnet-latest"),
+    "o1": partial(_chat_openai, model="o1"),
+    "o3-mini": partial(_chat_openai, model="o3-mini", reasoning_effort="high"),
+    "deepseek-chat": partial(_chat_deepseek, model="deepseek-chat"),
+    "deepseek-reasoner": partial(_chat_deepseek, model="deepseek-reasoner", max_tokens=8192),
+    "deepseek-chat-sf": partial(_chat_openai,
+                                api_key_env="SILICON_FLOW_API_KEY",
+                                model="deepseek-ai/DeepSeek-V3",
+                                base_url="https://api.siliconflow.cn/v1"),
+    "deepseek-reasoner-sf": partial(_chat_openai,
+                                    api_key_env="SILICON_FLOW_API_KEY",
+                                    model="deepseek-ai/DeepSeek-R1",
+                                    base_url="https://api.siliconflow.cn/v1",
+                                    max_tokens=8192),
+    "deepseek-reasoner-bce": partial(_chat_openai,
+                                     api_key_env="BCE_API_KEY",
+                                     model="deepseek-r1",
+                                     base_url="https://qianfan.baidubce.com/v2"),
+    "grok-2": partial(_chat_xai, model="grok-2-latest"),
+    "gemini-2.0-flash-thinking-exp": partial(_chat_google, model="gemini-2.0-flash-thinking-exp-01-21"),
+    "gemini-2.0-flash": partial(_chat_google, model="gemini-2.0-flash"),
+    "deepseek-reasoner-openrouter": partial(_chat_openai,
+                                            api_key_env="OPENROUTER_API_KEY",
+                                            model="deepseek/deepseek-r1:free",
+                                            base_url="https://openrouter.ai/api/v1"),
+}
+
+# Module level names kept for `from agent.llms import SUPERVISOR_MODEL`, resolved lazily by __getattr__
+ROLE_CONFIG_KEYS = {
+    "MEMORY_RELEVANCE_MODEL": "memory_relevance_model",
+    "SUPERVISOR_MODEL": "supervisor_model",
+    "MEMBER_DEFAULT_MODEL": "member_default_model",
+    "MEMORY_PROCESSOR_MODEL": "memory_processor_model",
+    "MATH_AGENT_MODEL": "math_agent_model",
+    "IMAGE_DESCRIPTION_MODEL": "image_description_model",
+    "JSON_ENSURE_MODEL": "json_ensure_model",
+}
+
+_model_registry = {}
+_model_names = {}
+_role_chains = {}
+_registry_lock = threading.Lock()
+
+
+def get_role_model_names(config_key: str) -> list[str]:
+    """A role is configured as a model name, an ordered list of fallback models,
+    or a mapping with `models` and an optional `hedge_delay` (seconds or "auto")."""
+    value = llms_config[config_key]
+    if isinstance(value, str):
+        return [value]
+    if isinstance(value, dict):
+        value = value.get("models", [])
+    return list(value)
+
+def _validate_llms_config(llms_config: dict):
+    for key in ROLE_CONFIG_KEYS.values():
         if key not in llms_config:
             raise KeyError(f"Missing required configuration: {key}")
-        if llms_config[key] not in AVAILABLE_MODELS:
-            raise ValueError(f"Model '{llms_config[key]}' specified for {key} is not available")
-    
-    MEMORY_RELEVANCE_MODEL = AVAILABLE_MODELS[llms_config["memory_relevance_model"]]
-    SUPERVISOR_MODEL = AVAILABLE_MODELS[llms_config["supervisor_model"]]
-    MEMBER_DEFAULT_MODEL = AVAILABLE_MODELS[llms_config["member_default_model"]]
-    MEMORY_PROCESSOR_MODEL = AVAILABLE_MODELS[llms_config["memory_processor_model"]]
-    MATH_AGENT_MODEL = AVAILABLE_MODELS[llms_config["math_agent_model"]]
-    IMAGE_DESCRIPTION_MODEL = AVAILABLE_MODELS[llms_config["image_description_model"]]
-    JSON_ENSURE_MODEL = AVAILABLE_MODELS[llms_config["json_ensure_model"]]
-    
-    logger.info("Successfully loaded model configuration")
+        if not get_role_model_names(key):
+            raise ValueError(f"No model specified for {key}")
+        for name in get_role_model_names(key):
+            if name not in MODEL_FACTORIES:
+                raise ValueError(f"Model '{name}' specified for {key} is not available")
 
+try:
+    llms_config = CONFIG["llms"]
+    _validate_llms_config(llms_config)
+    logger.info("Successfully loaded model configuration")
 except Exception as e:
     logger.error(f"Error loading model configuration: {str(e)}")
     raise
 
+
+def get_model(name: str):
+    """Build the model registered as `name` on first use, and return the cached instance afterwards."""
+    if name in _model_registry:
+        return _model_registry[name]
+    if name not in MODEL_FACTORIES:
+        raise ValueError(f"Model '{name}' is not available")
+    with _registry_lock:
+        if name not in _model_registry:
+            from .llm_transport import TRANSPORT_MODE, make_replay_model # imported here, llm_transport depends on this module
+            if TRANSPORT_MODE == "replay":
+                logger.info(f"Replaying model '{name}' from cassette")
+                model = make_replay_model(name)
+            else:
+                logger.info(f"Building model '{name}'")
+                with warnings.catch_warnings():
+                    warnings.filterwarnings("ignore", category=UserWarning, message=r"WARNING! response_format is not default parameter")
+                    model = MODEL_FACTORIES[name]()
+            _model_registry[name] = model
+            _model_names[id(model)] = name
+    return _model_registry[name]
+
+def get_role_model(config_key: str):
+    """Get the model configured for a role in config.yaml `llms:`, e.g. "supervisor_model".
+    Roles with several models return a `ModelChain`, which llm_calling.py calls with fallback and hedging."""
+    model_names = get_role_model_names(config_key)
+    value = llms_config[config_key]
+    hedge_delay = value.get("hedge_delay") if isinstance(value, dict) else None
+    if len(model_names) == 1:
+        return get_model(model_names[0])
+    with _registry_lock:
+        if config_key not in _role_chains:
+            _role_chains[config_key] = ModelChain(config_key, model_names, get_model, hedge_delay)
+        return _role_chains[config_key]
+
+def get_model_name(llm) -> str:
+    """Registry name of a model built by `get_model`, or a best-effort identifier for other models."""
+    if id(llm) in _model_names:
+        return _model_names[id(llm)]
+    return getattr(llm, "model_name", None) or getattr(llm, "model", None) or type(llm).__name__
+
+def get_model_base_url(name: str) -> str | None:
+    factory = MODEL_FACTORIES.get(name)
+    if factory is None:
+        return None
+    return factory.keywords.get("base_url") or DEFAULT_BASE_URLS[factory.func]
+
+def get_model_provider(name: str) -> str:
+    """Provider of a registered model, identified by the host of its API endpoint."""
+    base_url = get_model_base_url(name)
+    return urlparse(base_url).hostname if base_url else "unknown"
+
+def __getattr__(name: str):
+    if name in ROLE_CONFIG_KEYS:
+        return get_role_model(ROLE_CONFIG_KEYS[name])
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 __all__ = [
     "MEMORY_RELEVANCE_MODEL",
     "SUPERVISOR_MODEL",
@@ -127,4 +187,10 @@ __all__ = [
     "MEMORY_PROCESSOR_MODEL",
     "MATH_AGENT_MODEL",
     "JSON_ENSURE_MODEL",
-]
\ No newline at end of file
+    "get_model",
+    "get_role_model",
+    "get_role_model_names",
+    "get_model_name",
+    "get_model_base_url",
+    "get_model_provider",
+]
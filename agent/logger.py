@@ -2,22 +2,24 @@ from .timestamp import get_current_run_timestamp
 from loguru import logger
 from pathlib import Path
 
-def configure_default_logger(log_dir=None, file_name=None, use_date_subdir=True, suffix:str=None):
+def configure_default_logger(log_dir=None, file_name=None, use_date_subdir=True, suffix:str=None, use_latest_log=True):
     """Configure a default logger. Log file name is the timestamp for the current run.
     
     Args:
         log_dir (Path, optional): The directory to save the log file. Defaults to the current working directory.
         file_name (str, optional): The name of the log file. Defaults to the current timestamp.
         use_date_subdir (bool, optional): Whether to use the current date as a subdirectory. Defaults to False.
+        use_latest_log (bool, optional): Whether to also log to "latest.log", which is cleared first. Defaults to True.
     """
     if log_dir is None:
         log_dir = Path('data') / 'logs'
     
     # use a default "latest.log" file, clear the file if it exists
     latest_log_file = log_dir / 'latest.log'
-    if latest_log_file.exists():
-        latest_log_file.unlink()
-    logger.add(latest_log_file, encoding='utf-8')
+    if use_latest_log:
+        if latest_log_file.exists():
+            latest_log_file.unlink()
+        logger.add(latest_log_file, encoding='utf-8')
 
 
     if use_date_subdir:
@@ -38,5 +40,8 @@ def configure_default_logger(log_dir=None, file_name=None, use_date_subdir=True,
     log_file_path = log_dir / file_name
     
     logger.add(log_file_path, encoding='utf-8')
-    logger.info(f"Logging to {log_file_path.absolute().as_posix()} and {latest_log_file.absolute().as_posix()}")
+    if use_latest_log:
+        logger.info(f"Logging to {log_file_path.absolute().as_posix()} and {latest_log_file.absolute().as_posix()}")
+    else:
+        logger.info(f"Logging to {log_file_path.absolute().as_posix()}")
     return logger
\ No newline at end of file
@@ -0,0 +1,65 @@
+import threading
+from langchain_core.messages import AnyMessage, HumanMessage, SystemMessage
+from loguru import logger
+
+# Providers cache the longest previously seen prompt prefix. Anything that changes early in the
+# prompt (a rebuilt system prompt, memories spliced into an old message) invalidates everything
+# after it, so the layout here is: stable system prompt, append-only history, volatile text last.
+
+ANTHROPIC_LLM_TYPE = "anthropic-chat"
+CACHE_CONTROL = {"type": "ephemeral"}
+
+_stable_prompts = {}
+_stable_prompts_lock = threading.Lock()
+
+def get_stable_prompt(key: str, build) -> str:
+    """Build the prompt for `key` once and return the identical string on every later call, so the
+    system prompt of an agent is byte-stable for the whole process."""
+    with _stable_prompts_lock:
+        if key not in _stable_prompts:
+            _stable_prompts[key] = build()
+        return _stable_prompts[key]
+
+def get_system_message(key: str, build) -> SystemMessage:
+    return SystemMessage(content=get_stable_prompt(key, build))
+
+def append_to_tail(messages: list[AnyMessage], text: str):
+    """Add volatile text (memories, human instructions) at the end of the history.
+    Only the trailing human message, which has not been sent yet, is extended; a message that was
+    already part of an earlier prompt is never modified, so the cached prefix stays valid."""
+    if not text:
+        return
+    last = messages[-1] if messages else None
+    if isinstance(last, HumanMessage) and isinstance(last.content, str):
+        messages[-1] = last.model_copy(update={"content": last.content + text})
+    else:
+        messages.append(HumanMessage(content=text.lstrip("\n")))
+
+def _with_cache_control(message: AnyMessage) -> AnyMessage:
+    content = message.content
+    if isinstance(content, str):
+        blocks = [{"type": "text", "text": content}]
+    else:
+        blocks = [dict(block) if isinstance(block, dict) else {"type": "text", "text": block} for block in content]
+    if not blocks:
+        return message
+    blocks[-1] = {**blocks[-1], "cache_control": CACHE_CONTROL}
+    return message.model_copy(update={"content": blocks})
+
+def layout_for_request(llm, messages: list[AnyMessage]) -> list[AnyMessage]:
+    """Messages as they are sent to `llm`. Providers with automatic prefix caching (OpenAI, DeepSeek,
+    Gemini) get them as is. Anthropic only caches up to explicit breakpoints, so one is placed after
+    the system prompt and one on the last message; the next call then reads the whole previous prompt
+    from the cache. The caller's messages are not modified."""
+    if getattr(llm, "_llm_type", None) != ANTHROPIC_LLM_TYPE or not messages:
+        return messages
+    laid_out = list(messages)
+    if isinstance(laid_out[0], SystemMessage):
+        laid_out[0] = _with_cache_control(laid_out[0])
+    if len(laid_out) > 1:
+        laid_out[-1] = _with_cache_control(laid_out[-1])
+    logger.debug(f"Added prompt cache breakpoints for {len(laid_out)} messages")
+    return laid_out
+
+
+__all__ = ["get_stable_prompt", "get_system_message", "append_to_tail", "layout_for_request"]
@@ -0,0 +1,136 @@
+import json
+import multiprocessing
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from pathlib import Path
+from loguru import logger
+from ..config import BATCH_CONFIG
+from ..timestamp import get_current_run_timestamp, set_current_run_timestamp
+
+BATCH_WORKERS = BATCH_CONFIG.get("workers", 4)
+BATCH_RETRIES = BATCH_CONFIG.get("retries", 1)
+RESULTS_DIR = Path(BATCH_CONFIG.get("results_dir", "data/batches"))
+# concurrent LLM requests per provider host over all workers, e.g. {"api.anthropic.com": 4}
+PROVIDER_CONCURRENCY = BATCH_CONFIG.get("provider_concurrency", None) or {}
+
+def load_batch_tasks(tasks_file: Path) -> list[dict]:
+    """Tasks of a JSONL file, one object per line with the prompt in "task" or "prompt" (or "title" and
+    "body", as in a backlog of requests), and an optional "id" (or "task_id", "request_id")."""
+    tasks, ids = [], set()
+    with open(tasks_file, encoding="utf-8") as f:
+        for line_number, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            prompt = item.get("task") or item.get("prompt") or "\n\n".join(
+                str(item[key]) for key in ("title", "body") if item.get(key))
+            if not prompt:
+                raise ValueError(f"{tasks_file}:{line_number} has no task prompt")
+            task_id = str(item.get("id") or item.get("task_id") or item.get("request_id") or line_number)
+            task_id = re.sub(r"[^\w.-]", "-", task_id) # it is part of file names
+            if task_id in ids:
+                task_id = f"{task_id}-{line_number}"
+            ids.add(task_id)
+            tasks.append({"id": task_id, "prompt": prompt})
+    return tasks
+
+
+def _init_worker(provider_slots: dict):
+    from ..rate_limiter import RateLimiter
+    RateLimiter().set_provider_slots(provider_slots)
+
+def _run_batch_task(run_id: str, prompt: str, resume: bool) -> dict:
+    """One attempt of a task, in a worker process of its own, so its terminals, browser tabs, caches
+    and usage records are not shared with other tasks. Everything is keyed by the task's run id:
+    the log file, artifacts, checkpoints and the human inbox file."""
+    set_current_run_timestamp(run_id)
+    logger.remove() # the workers would interleave on the batch's terminal
+    from ..logger import configure_default_logger
+    configure_default_logger(use_latest_log=False)
+    from ..checkpoints import get_checkpointer
+    from ..usage import UsageTracker
+    from .human_channel import HumanChannel, INBOX_FILE
+    from .run import run_task
+    channel = HumanChannel()
+    channel.set_mode("autonomous")
+    channel.set_inbox_file(INBOX_FILE.with_name(f"{run_id}.txt"))
+    checkpointer = get_checkpointer()
+    if resume and (checkpointer is None or not checkpointer.has_run(run_id)):
+        logger.info(f"No checkpoints of {run_id} left, retrying it from the start")
+        resume = False
+    start, error = time.monotonic(), None
+    try:
+        # not pruned here: the other tasks of the batch, and their retries, share the checkpoint database
+        run_task(prompt, resume=run_id if resume else None, prune=False)
+    except Exception as e:
+        logger.exception(f"Task {run_id} failed")
+        error = f"{type(e).__name__}: {e}"
+    totals = UsageTracker().get_totals()
+    return {"error": error, "wall_time": time.monotonic() - start, "calls": totals["calls"],
+            "prompt_tokens": totals["prompt_tokens"], "completion_tokens": totals["completion_tokens"], "cost": totals["cost"]}
+
+
+def run_batch(tasks_file: str, results_file: str | None = None, workers: int | None = None, retries: int | None = None) -> list[dict]:
+    """Run the tasks of a JSONL file on a pool of worker processes, unattended. Each finished task
+    is appended to the results JSONL with its wall time and spend, summed over its attempts; a failed
+    task is retried from its last checkpoint (from the start without checkpoints) up to `retries` times."""
+    workers = workers or BATCH_WORKERS
+    retries = BATCH_RETRIES if retries is None else retries
+    tasks = load_batch_tasks(Path(tasks_file))
+    batch_id = get_current_run_timestamp()
+    results_file = Path(results_file) if results_file else RESULTS_DIR / f"{batch_id}_results.jsonl"
+    results_file.parent.mkdir(parents=True, exist_ok=True)
+    from ..checkpoints import get_checkpointer
+    checkpointer = get_checkpointer()
+    if checkpointer is not None: # once, before any task of the batch has checkpoints
+        checkpointer.prune()
+    logger.info(f"Batch {batch_id}: {len(tasks)} tasks from {tasks_file} on {workers} workers, results in {results_file.absolute().as_posix()}")
+
+    # spawned, one process per attempt: the graph's singletons and event loop never leak between tasks
+    context = multiprocessing.get_context("spawn")
+    provider_slots = {provider: context.BoundedSemaphore(limit) for provider, limit in PROVIDER_CONCURRENCY.items()}
+    records = []
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context, max_tasks_per_child=1,
+                             initializer=_init_worker, initargs=(provider_slots,)) as pool, \
+         open(results_file, "a", encoding="utf-8") as results:
+        def submit(record: dict, resume: bool):
+            record["attempts"] += 1
+            futures[pool.submit(_run_batch_task, record["run_id"], record["prompt"], resume)] = record
+
+        futures = {}
+        for task in tasks:
+            run_id = f"{batch_id}_{task['id']}"
+            submit({"id": task["id"], "run_id": run_id, "prompt": task["prompt"], "status": None, "attempts": 0,
+                    "wall_time": 0.0, "calls": 0, "prompt_tokens": 0, "completion_tokens": 0, "cost": 0.0, "error": None,
+                    "log_file": (Path("data") / "logs" / run_id.split("_")[0] / f"{run_id}.log").as_posix()}, resume=False)
+        while futures:
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                record = futures.pop(future)
+                try:
+                    attempt = future.result()
+                except Exception as e: # the worker process itself died
+                    attempt = {"error": f"{type(e).__name__}: {e}", "wall_time": 0.0, "calls": 0,
+                               "prompt_tokens": 0, "completion_tokens": 0, "cost": 0.0}
+                for key in ("wall_time", "calls", "prompt_tokens", "completion_tokens", "cost"):
+                    record[key] += attempt[key]
+                record["error"] = attempt["error"]
+                if attempt["error"] and record["attempts"] <= retries:
+                    logger.warning(f"Task {record['id']} failed (attempt {record['attempts']}), retrying: {attempt['error']}")
+                    submit(record, resume=True)
+                    continue
+                record["status"] = "failed" if attempt["error"] else "succeeded"
+                logger.info(f"Task {record['id']} {record['status']} after {record['attempts']} attempt(s), "
+                            f"{record['wall_time']:.1f}s, ${record['cost']:.4f}")
+                results.write(json.dumps({key: value for key, value in record.items() if key != "prompt"}) + "\n")
+                results.flush()
+                records.append(record)
+
+    failed = sum(record["status"] == "failed" for record in records)
+    logger.info(f"Batch {batch_id} done: {len(records) - failed} succeeded, {failed} failed, "
+                f"${sum(record['cost'] for record in records):.4f} spent")
+    return records
+
+
+__all__ = ["run_batch", "load_batch_tasks"]
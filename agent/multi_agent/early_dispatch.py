@@ -0,0 +1,75 @@
+import json
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from langchain_core.tools import BaseTool
+from loguru import logger
+from ..config import STREAMING_CONFIG
+from .tool_properties import is_early_dispatch_tool
+
+STREAMING_ENABLE = STREAMING_CONFIG.get("enable", False)
+
+logger.info(f"Streaming with early tool dispatch is {'enabled' if STREAMING_ENABLE else 'disabled'}")
+
+def tool_call_key(tool_call: dict) -> str:
+    return json.dumps({"name": tool_call.get("name"), "args": tool_call.get("args", {})}, sort_keys=True, default=str)
+
+class EarlyToolDispatcher:
+    """Runs tool calls that were streamed before the LLM response finished, and hands the
+    results to the tools node if it ends up executing the very same calls."""
+    _instance = None
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super().__new__(cls)
+            cls._instance.executor = ThreadPoolExecutor(max_workers=STREAMING_CONFIG.get("max_early_workers", 4),
+                                                        thread_name_prefix="early_tool")
+            cls._instance.pending = {}
+            cls._instance._lock = threading.Lock()
+        return cls._instance
+
+    def __init__(self):
+        pass
+
+    def dispatch(self, agent_name: str, tool: BaseTool, tool_call: dict):
+        key = tool_call_key(tool_call)
+        with self._lock:
+            agent_pending = self.pending.setdefault(agent_name, {})
+            if key in agent_pending:
+                return
+            logger.info(f"{agent_name} starting tool call early: {tool_call}")
+            agent_pending[key] = self.executor.submit(tool.invoke, tool_call.get("args", {}))
+
+    def take(self, agent_name: str, tool_call: dict) -> Future | None:
+        with self._lock:
+            return self.pending.get(agent_name, {}).pop(tool_call_key(tool_call), None)
+
+    def discard(self, agent_name: str):
+        with self._lock:
+            leftovers = self.pending.pop(agent_name, {})
+        for future in leftovers.values():
+            future.cancel()
+
+class EarlyDispatchCallback:
+    """Callback for `stream_and_parse_json_response`. Only the leading run of early dispatch tools
+    is started, so a read never overtakes a write that comes before it in the same response."""
+    def __init__(self, agent_name: str, tools: dict[str, BaseTool]):
+        self.agent_name = agent_name
+        self.tools = tools
+        self.prefix_is_safe = True
+
+    def reset(self):
+        """Called when a new attempt starts streaming; results of the previous attempt are dropped."""
+        EarlyToolDispatcher().discard(self.agent_name)
+        self.prefix_is_safe = True
+
+    def __call__(self, tool_call: dict):
+        name = tool_call.get("name")
+        if not self.prefix_is_safe or name not in self.tools or not is_early_dispatch_tool(name) or not isinstance(tool_call.get("args", {}), dict):
+            self.prefix_is_safe = False
+            return
+        EarlyToolDispatcher().dispatch(self.agent_name, self.tools[name], tool_call)
+
+def make_early_dispatch_callback(agent_name: str, tools: dict[str, BaseTool]) -> EarlyDispatchCallback:
+    return EarlyDispatchCallback(agent_name, tools)
+
+__all__ = ['EarlyToolDispatcher', 'make_early_dispatch_callback', 'STREAMING_ENABLE']
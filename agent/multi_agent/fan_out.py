@@ -0,0 +1,222 @@
+import asyncio
+import threading
+import uuid
+from contextlib import contextmanager, asynccontextmanager
+from langchain_core.runnables import RunnableLambda
+from langgraph.errors import GraphBubbleUp
+from langgraph.types import Command, Send
+from loguru import logger
+from ..config import FAN_OUT_CONFIG
+from ..usage import register_metrics_source
+from .state import State
+from .supervisor_agent_name import SUPERVISOR_AGENT_NAME
+
+FAN_OUT_ENABLE = FAN_OUT_CONFIG.get("enable", False)
+MAX_PARALLEL = FAN_OUT_CONFIG.get("max_parallel", 3)
+# agents that never run alongside other branches, e.g. the browser agent drives the one shared screen and mouse
+EXCLUSIVE_AGENTS = FAN_OUT_CONFIG.get("exclusive_agents", None) or []
+# per agent, how many branches may run while it runs, itself included (an exclusive agent has a limit of 1)
+AGENT_LIMITS = {**{agent: 1 for agent in EXCLUSIVE_AGENTS}, **(FAN_OUT_CONFIG.get("agent_limits", None) or {})}
+
+def parse_assignments(parsed_response: dict, agent_names: list[str]) -> list[dict]:
+    """The {"agent", "prompt"} assignments of a supervisor response. Each member agent keeps a single
+    history, so several assignments for the same agent are given to it as one prompt."""
+    if not FAN_OUT_ENABLE or not isinstance(parsed_response.get("assignments"), list):
+        return []
+    prompts = {}
+    for assignment in parsed_response["assignments"]:
+        if not isinstance(assignment, dict) or assignment.get("agent") not in agent_names:
+            logger.warning(f"Ignoring invalid assignment: {assignment}")
+            continue
+        prompts.setdefault(assignment["agent"], []).append(str(assignment.get("prompt", "")))
+    return [{"agent": agent, "prompt": "\n\n".join(agent_prompts)} for agent, agent_prompts in prompts.items()]
+
+
+def _agent_limit(agent_name: str) -> int:
+    return min(MAX_PARALLEL, AGENT_LIMITS.get(agent_name, MAX_PARALLEL))
+
+
+class FanOut:
+    """The branches of one supervisor step: limits how many run at once, overall and alongside each
+    agent, and stops the others as soon as one of them fails."""
+    def __init__(self, agents: list[str]):
+        self.agents = agents
+        self.failed = None
+        self.running = []
+        self._condition = threading.Condition()
+        self._async_condition = None
+
+    def _can_start(self, agent_name: str) -> bool:
+        if self.failed: # let the waiting branches in, only to stop right away
+            return True
+        return len(self.running) < min(_agent_limit(name) for name in self.running + [agent_name])
+
+    def _start(self, agent_name: str):
+        self.running.append(agent_name)
+
+    def _finish(self, agent_name: str):
+        self.running.remove(agent_name)
+
+    @contextmanager
+    def slot(self, agent_name: str):
+        with self._condition:
+            self._condition.wait_for(lambda: self._can_start(agent_name))
+            self._start(agent_name)
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._finish(agent_name)
+                self._condition.notify_all()
+
+    @asynccontextmanager
+    async def aslot(self, agent_name: str):
+        if self._async_condition is None: # created on the loop the branches run on
+            self._async_condition = asyncio.Condition()
+        async with self._async_condition:
+            await self._async_condition.wait_for(lambda: self._can_start(agent_name))
+            self._start(agent_name)
+        try:
+            yield
+        finally:
+            async with self._async_condition:
+                self._finish(agent_name)
+                self._async_condition.notify_all()
+
+    def fail(self, agent_name: str, error: Exception, messages: list | None = None) -> Command:
+        logger.warning(f"{agent_name} failed in a parallel branch, stopping the other branches: {error}")
+        self.failed = agent_name
+        FanOutStats().record("failed")
+        return _branch_end(agent_name, f"Failed with error: {error}", messages)
+
+    def cancel(self, agent_name: str, state: State, messages: list | None = None) -> Command:
+        """`messages` is the branch's history so far, None when it was stopped before its first step."""
+        logger.info(f"{agent_name} stopped because {self.failed} failed")
+        FanOutStats().record("cancelled")
+        if messages is None:
+            return _branch_end(agent_name, f"Stopped before starting, because {self.failed} failed. "
+                                           f"Its assignment was: {state.get('next_agent_prompt')}")
+        return _branch_end(agent_name, f"Stopped before finishing, because {self.failed} failed.", messages)
+
+
+def _branch_end(agent_name: str, finish_message: str, messages: list | None = None) -> Command:
+    """Back to the supervisor, keeping what the branch did so far in the agent's history."""
+    update = {"member_finish_message": {agent_name: finish_message}}
+    if messages is not None:
+        update["member_messages"] = {agent_name: messages}
+    return Command(goto=SUPERVISOR_AGENT_NAME, update=update)
+
+
+class FanOutStats:
+    _instance = None
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super().__new__(cls)
+            cls._instance.stats = {"fan_outs": 0, "branches": 0, "failed": 0, "cancelled": 0}
+            cls._instance.fan_outs = {}
+            cls._instance._lock = threading.Lock()
+        return cls._instance
+
+    def __init__(self):
+        pass
+
+    def record(self, key: str, count: int = 1):
+        with self._lock:
+            self.stats[key] += count
+
+    def start(self, agents: list[str]) -> str:
+        fan_out_id = uuid.uuid4().hex
+        with self._lock:
+            self.fan_outs[fan_out_id] = FanOut(agents)
+            self.stats["fan_outs"] += 1
+            self.stats["branches"] += len(agents)
+        return fan_out_id
+
+    def get(self, fan_out_id: str | None) -> FanOut | None:
+        if fan_out_id is None:
+            return None
+        with self._lock: # unknown when a run resumes from a checkpoint in the middle of a fan-out
+            return self.fan_outs.setdefault(fan_out_id, FanOut([]))
+
+    def finish(self, fan_out_id: str | None):
+        with self._lock:
+            self.fan_outs.pop(fan_out_id, None)
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return dict(self.stats)
+
+register_metrics_source("fan_out", lambda: FanOutStats().get_stats())
+
+
+def make_branch_sends(state: State) -> list[Send]:
+    """One Send per assignment. Each branch sees only its own agent's member state, so the merge
+    reducers of the member dicts join the branches back without them overwriting each other."""
+    fan_out_id = FanOutStats().start([assignment["agent"] for assignment in state["assignments"]])
+    sends = []
+    for assignment in state["assignments"]:
+        agent_name = assignment["agent"]
+        branch_state = dict(state)
+        for key in ("member_messages", "member_tool_calls", "member_finish_message",
+                    "member_retrieved_memory_ids", "member_trigger_long_term_memory"):
+            branch_state[key] = {agent_name: state[key][agent_name]} if agent_name in state.get(key, {}) else {}
+        branch_state["next_agent"] = agent_name
+        branch_state["next_agent_prompt"] = assignment["prompt"]
+        branch_state["fan_out_id"] = fan_out_id
+        sends.append(Send(agent_name, branch_state))
+    logger.info(f"Dispatching {len(sends)} agents in parallel: {[send.node for send in sends]}")
+    return sends
+
+def _branch_messages(agent_name: str, values: dict) -> list | None:
+    """The agent's history so far, once its branch took the assignment's prompt (None in the branch's input)."""
+    if values.get("next_agent_prompt") is not None:
+        return None
+    return list(values.get("member_messages", {}).get(agent_name, []))
+
+def make_branch_node(agent_name: str, subgraph):
+    """Wrap a member subgraph for the supervisor graph. A single call runs it as before; in a fan-out it
+    waits for a free slot, and stops between steps once another branch failed."""
+    def branch_node(state: State, config):
+        fan_out = FanOutStats().get(state.get("fan_out_id"))
+        if fan_out is None:
+            return subgraph.invoke(state, config)
+        with fan_out.slot(agent_name):
+            if fan_out.failed:
+                return fan_out.cancel(agent_name, state)
+            messages = None
+            try:
+                # the member hands back with a Command.PARENT
+                for values in subgraph.stream(state, config, stream_mode="values"):
+                    messages = _branch_messages(agent_name, values)
+                    if fan_out.failed:
+                        return fan_out.cancel(agent_name, state, messages)
+            except GraphBubbleUp:
+                raise
+            except Exception as e:
+                return fan_out.fail(agent_name, e, messages)
+        return {}
+
+    async def abranch_node(state: State, config):
+        fan_out = FanOutStats().get(state.get("fan_out_id"))
+        if fan_out is None:
+            return await subgraph.ainvoke(state, config)
+        async with fan_out.aslot(agent_name):
+            if fan_out.failed:
+                return fan_out.cancel(agent_name, state)
+            messages = None
+            try:
+                async for values in subgraph.astream(state, config, stream_mode="values"):
+                    messages = _branch_messages(agent_name, values)
+                    if fan_out.failed:
+                        return fan_out.cancel(agent_name, state, messages)
+            except GraphBubbleUp:
+                raise
+            except Exception as e:
+                return fan_out.fail(agent_name, e, messages)
+        return {}
+
+    return RunnableLambda(branch_node, afunc=abranch_node, name=agent_name)
+
+
+__all__ = ["parse_assignments", "make_branch_sends", "make_branch_node", "FanOutStats", "FAN_OUT_ENABLE"]
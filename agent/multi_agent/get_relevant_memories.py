@@ -2,11 +2,13 @@ from loguru import logger
 import asyncio
 from langchain_core.messages import HumanMessage, AnyMessage
 from ..tools.memory import search_memory
-from ..llms import MEMORY_RELEVANCE_MODEL
+from ..llms import get_role_model
 from ..llm_calling import aget_and_parse_json_response
-from agent.config import MEMORY_ENABLE_RETRIEVAL
+from ..async_runtime import arun_blocking, run_sync
+from .retrieval_cache import RetrievalCache
+from agent.config import MEMORY_ENABLE_RETRIEVAL, MEMORY_RELEVANCE_MODE, MEMORY_RELEVANCE_THRESHOLD
 
-logger.info(f"Memory retrieval is {'enabled' if MEMORY_ENABLE_RETRIEVAL else 'disabled'}")
+logger.info(f"Memory retrieval is {'enabled' if MEMORY_ENABLE_RETRIEVAL else 'disabled'}, relevance mode: {MEMORY_RELEVANCE_MODE}")
 
 MEMORY_ROLE_PROMPT = """
 You will act as a memory agent.
@@ -53,50 +55,127 @@ Memory Content:
     decision = parsed["decision"]
     return thoughts, decision
 
-def get_relevant_memories(messages: list[AnyMessage], 
-                          top_k: int = 5, 
-                          exclude_ids: list[str] = None) -> tuple[list[dict], list[str], str]:
-    if not MEMORY_ENABLE_RETRIEVAL:
-        logger.info("Memory retrieval is disabled, returning empty results.")
-        return [], [], ""
-    context = "\n".join([f"{'System' if msg.type == 'human' else 'Agent'}: {msg.content}"
-                     for msg in messages[-2:] if msg.type != 'system'])
-    logger.info(f'Retrieving relevant memories with query={context}, top_k={top_k}, exclude_ids={exclude_ids}')
-    search_results = search_memory.invoke({"query": context, "top_k": top_k, "exclude_ids": exclude_ids})
-    if not search_results:
-        logger.info("No relevant memories found by Pinecone.")
-        return [], [], ""
-    
-    llm = MEMORY_RELEVANCE_MODEL
-    
-    async def _process_memories():
-        return await asyncio.gather(*[
-            _aget_memory_relevant_decision(
-                context=context,
-                memory_content=memory.get('content'),
-                llm=llm
-            )
-            for memory in search_results
-        ])
-    
-    logger.info(f"Waiting for LLM memory helpfulness decisions... total {len(search_results)} memories")
-    decisions = asyncio.run(_process_memories())
-
+async def _afilter_per_memory(context: str, memories: list[dict], llm) -> list[dict]:
+    """One relevance call per memory, concurrently."""
+    logger.info(f"Waiting for LLM memory helpfulness decisions... total {len(memories)} memories")
+    decisions = await asyncio.gather(*[
+        _aget_memory_relevant_decision(
+            context=context,
+            memory_content=memory.get('content'),
+            llm=llm
+        )
+        for memory in memories
+    ])
     relevant_memories = []
-    for memory, (thoughts, decision) in zip(search_results, decisions):
+    for memory, (thoughts, decision) in zip(memories, decisions):
         if decision == "YES":
             relevant_memories.append(memory)
         elif decision == "NO":
             pass
         else:
             raise ValueError(f"Invalid decision: {decision}") # TODO: handle this
-    logger.info(f"Found {len(relevant_memories)} / {len(search_results)} relevant memories")
-    memory_ids = [memory.get("id") for memory in relevant_memories]
+    return relevant_memories
+
+async def _afilter_listwise(context: str, memories: list[dict], llm) -> list[dict]:
+    """One relevance call that decides on all memories together."""
+    numbered_memories = "\n\n".join(f"[{i}] {memory.get('content')}" for i, memory in enumerate(memories, start=1))
+    relevance_prompt = f"""
+You are an AI agent responsible for evaluating the helpfulness of memories in a system.
+Your task is to determine which of the numbered memories are relevant to the current context. Only exclude completely irrelevant memories.
+The context will be given in the form of messages between the agent and the system.
+
+Respond in JSON.
+You should respond a JSON object with the following fields:
+- "thoughts": your analysis of the memories and context, why each of them is potentially helpful or not
+- "decisions": an object with the number of every memory as key and "YES" or "NO" as value
+
+Example response:
+{{
+    "thoughts": "The context is about the user's request that... Memory 1 is about... so it is potentially helpful. Memory 2 is about... which is unrelated.",
+    "decisions": {{"1": "YES", "2": "NO"}}
+}}
+
+The context will follow the "Current Context" section, and the memories will follow the "Memories" section.
+
+Current Context:
+{context}
+
+Memories:
+{numbered_memories}
+    """
+    logger.info(f"Waiting for the LLM memory helpfulness decisions on {len(memories)} memories in one call...")
+    response, parsed = await aget_and_parse_json_response(llm, [HumanMessage(content=relevance_prompt)])
+    decisions = parsed.get("decisions") or {}
+    relevant_memories = []
+    for i, memory in enumerate(memories, start=1):
+        decision = str(decisions.get(str(i), "")).strip().upper()
+        if decision == "NO":
+            continue
+        if decision != "YES": # kept, as only completely irrelevant memories are excluded
+            logger.warning(f"No valid decision for memory {i} ({memory.get('id')}): {decision!r}, keeping it")
+        relevant_memories.append(memory)
+    return relevant_memories
+
+def _filter_by_similarity(memories: list[dict], threshold: float | None) -> list[dict]:
+    """No LLM call: memories whose similarity score from the search reaches `threshold`. Without a
+    threshold, everything above the backend's own score threshold is kept."""
+    if threshold is None:
+        return memories
+    return [memory for memory in memories if memory.get("score", threshold) >= threshold]
+
+def memory_query_context(messages: list[AnyMessage]) -> str:
+    """The search query of a retrieval: the last two messages that are not system messages."""
+    return "\n".join([f"{'System' if msg.type == 'human' else 'Agent'}: {msg.content}"
+                      for msg in messages[-2:] if msg.type != 'system'])
+
+def format_memories(memories: list[dict]) -> str:
     formatted_memories = []
-    for memory in relevant_memories:
+    for memory in memories:
         formatted_memories.append(f"Memory ID: {memory.get('id')}\nMemory Content: {memory.get('content')}")
     if formatted_memories:
-        formatted_memories = "\n\nRelevant long-term memories:\n"+"\n\n".join(formatted_memories)
+        return "\n\nRelevant long-term memories:\n"+"\n\n".join(formatted_memories)
+    return ""
+
+def get_relevant_memories(messages: list[AnyMessage], 
+                          top_k: int = 5, 
+                          exclude_ids: list[str] = None,
+                          agent: str = None) -> tuple[list[dict], list[str], str]:
+    if not MEMORY_ENABLE_RETRIEVAL:
+        logger.info("Memory retrieval is disabled, returning empty results.")
+        return [], [], ""
+    return run_sync(aget_relevant_memories(messages, top_k, exclude_ids, agent))
+
+async def aget_relevant_memories(messages: list[AnyMessage], 
+                                 top_k: int = 5, 
+                                 exclude_ids: list[str] = None,
+                                 agent: str = None) -> tuple[list[dict], list[str], str]:
+    """With `agent`, the retrieval goes through that agent's entries in the per-run RetrievalCache."""
+    if not MEMORY_ENABLE_RETRIEVAL:
+        logger.info("Memory retrieval is disabled, returning empty results.")
+        return [], [], ""
+    context = memory_query_context(messages)
+    logger.info(f'Retrieving relevant memories with query={context}, top_k={top_k}, exclude_ids={exclude_ids}')
+    cache = RetrievalCache() if agent is not None and RetrievalCache().enabled else None
+    search_results = await arun_blocking(cache.lookup, agent, context, exclude_ids) if cache else None
+    if search_results is None:
+        search_results = await arun_blocking(search_memory.invoke, {"query": context, "top_k": top_k, "exclude_ids": exclude_ids})
+        if cache:
+            cache.store(agent, search_results)
+    if cache:
+        search_results = cache.unseen(agent, search_results, exclude_ids)
+    if not search_results:
+        logger.info("No relevant memories found by Pinecone.")
+        return [], [], ""
+    
+    if MEMORY_RELEVANCE_MODE == "embedding":
+        relevant_memories = _filter_by_similarity(search_results, MEMORY_RELEVANCE_THRESHOLD)
+    elif MEMORY_RELEVANCE_MODE == "listwise":
+        relevant_memories = await _afilter_listwise(context, search_results, get_role_model("memory_relevance_model"))
+    elif MEMORY_RELEVANCE_MODE == "per_memory":
+        relevant_memories = await _afilter_per_memory(context, search_results, get_role_model("memory_relevance_model"))
     else:
-        formatted_memories = ""
-    return relevant_memories, memory_ids, formatted_memories
\ No newline at end of file
+        raise ValueError(f"Unknown memory relevance mode {MEMORY_RELEVANCE_MODE}, expected per_memory, listwise or embedding")
+    if cache:
+        cache.mark_judged(agent, search_results, relevant_memories)
+    logger.info(f"Found {len(relevant_memories)} / {len(search_results)} relevant memories")
+    return relevant_memories, [memory.get("id") for memory in relevant_memories], format_memories(relevant_memories)
\ No newline at end of file
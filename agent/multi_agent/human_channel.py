@@ -0,0 +1,159 @@
+import os
+import queue
+import sys
+import threading
+from pathlib import Path
+from loguru import logger
+from ..config import HUMAN_CHANNEL_CONFIG
+from ..usage import register_metrics_source
+
+# blocking: ask with input() after every decision, as before
+# channel: never wait, pick up instructions typed into the terminal or written to the inbox file when they arrive
+# autonomous: no terminal input at all, for unattended runs (the inbox file is still read)
+HUMAN_MODES = ("blocking", "channel", "autonomous")
+INBOX_FILE = Path(HUMAN_CHANNEL_CONFIG.get("inbox_file", "data/human/inbox.txt"))
+REVIEW_CONFIG = HUMAN_CHANNEL_CONFIG.get("review", None) or {}
+REVIEW_TOOLS = REVIEW_CONFIG.get("tools", None) or []
+REVIEW_OVERWRITE = REVIEW_CONFIG.get("overwrite", False)
+REVIEW_BEFORE_END = REVIEW_CONFIG.get("before_end", False)
+
+REVIEW_PROMPT = "Press Enter to continue, or type an instruction instead: "
+
+# agents running in parallel ask one after another
+_human_input_lock = threading.Lock()
+
+def get_review_reasons(tool_calls: list[dict]) -> list[str]:
+    """Why the review-pause policy wants a human to look at these tool calls first."""
+    reasons = []
+    for tool_call in tool_calls:
+        name, args = tool_call.get("name"), tool_call.get("args", {}) or {}
+        if name in REVIEW_TOOLS:
+            reasons.append(f"{name} with {args}")
+        elif (REVIEW_OVERWRITE and name == "write_file" and args.get("mode", "w") == "w"
+              and Path(str(args.get("filepath", ""))).expanduser().is_file()):
+            reasons.append(f"write_file overwrites {args['filepath']}")
+    return reasons
+
+
+class HumanChannel:
+    """Human instructions that arrive while the graph keeps running: lines typed into the terminal
+    (read by a listener thread) and lines appended to the inbox file. A line starting with
+    `@<agent name>` is only given to that agent, any other line to the next agent that checks."""
+    _instance = None
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super().__new__(cls)
+            cls._instance.mode = HUMAN_CHANNEL_CONFIG.get("mode", "blocking")
+            cls._instance.inbox_file = INBOX_FILE
+            cls._instance.pending = []
+            cls._instance.lines = queue.Queue()
+            cls._instance.replies = queue.Queue() # lines typed while a review waits, never taken as instructions
+            cls._instance.reviewing = False
+            cls._instance.listener = None
+            cls._instance.stats = {"instructions": 0, "reviews": 0}
+            cls._instance._lock = threading.Lock()
+        return cls._instance
+
+    def __init__(self):
+        pass
+
+    def set_mode(self, mode: str):
+        if mode not in HUMAN_MODES:
+            raise ValueError(f"Unknown human mode {mode}, expected one of {HUMAN_MODES}")
+        self.mode = mode
+        logger.info(f"Human input mode: {mode}")
+
+    def set_inbox_file(self, inbox_file: Path):
+        """Read instructions from another file, e.g. one per task of a batch."""
+        self.inbox_file = Path(inbox_file)
+        logger.info(f"Human instructions are read from {self.inbox_file.absolute().as_posix()}")
+
+    def _listen(self):
+        for line in sys.stdin:
+            with self._lock:
+                (self.replies if self.reviewing else self.lines).put(line.strip())
+        self.replies.put("") # a review waiting right now goes on
+        logger.info("Terminal input closed, only the inbox file is read from now on")
+
+    def _start_listener(self):
+        # started on first use, so the task prompt is still read with input()
+        if self.listener is None and self.mode == "channel":
+            self.listener = threading.Thread(target=self._listen, name="human_channel", daemon=True)
+            self.listener.start()
+            logger.info(f"Type an instruction and press Enter at any time, or append it to {self.inbox_file.absolute().as_posix()}. "
+                        "Start it with @<agent name> to address one agent.")
+
+    def _collect(self):
+        while not self.lines.empty():
+            self.pending.append(self.lines.get())
+        # the inbox is moved aside before it is read, lines appended meanwhile go to a new inbox file
+        reading = self.inbox_file.with_name(self.inbox_file.name + ".reading")
+        if not reading.exists() and self.inbox_file.is_file() and self.inbox_file.stat().st_size > 0:
+            try:
+                os.replace(self.inbox_file, reading)
+            except FileNotFoundError:
+                pass
+        if reading.is_file(): # also one left over by an interrupted run
+            self.pending.extend(reading.read_text(encoding="utf-8").splitlines())
+            reading.unlink()
+        self.pending = [line for line in self.pending if line.strip()]
+
+    def take(self, agent_name: str) -> str:
+        """The first instruction for this agent, or an empty string."""
+        with self._lock:
+            self._start_listener()
+            self._collect()
+            for i, line in enumerate(self.pending):
+                target, _, text = line.partition(" ")
+                if not target.startswith("@"):
+                    self.pending.pop(i)
+                    self.stats["instructions"] += 1
+                    return line
+                if target[1:] == agent_name:
+                    self.pending.pop(i)
+                    self.stats["instructions"] += 1
+                    return text
+        return ""
+
+    def wait_for_reply(self, prompt: str) -> str:
+        if self.listener is None or not self.listener.is_alive():
+            logger.warning(f"No terminal input to wait for, continuing without review: {prompt}")
+            return ""
+        with self._lock:
+            self.stats["reviews"] += 1
+            self.reviewing = True
+        try:
+            print(prompt, end="", flush=True)
+            return self.replies.get()
+        finally:
+            with self._lock:
+                self.reviewing = False
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return dict(self.stats, mode=self.mode, pending=len(self.pending))
+
+register_metrics_source("human_channel", lambda: HumanChannel().get_stats())
+
+
+def ask_human(agent_name: str, prompt: str, review_reasons: list[str] | None = None, show_name: bool = False) -> str:
+    """Human input for a decision of `agent_name`, depending on the mode: ask and wait for it (blocking),
+    or take what already arrived, only waiting when the review-pause policy applies (channel)."""
+    channel = HumanChannel()
+    if channel.mode == "blocking":
+        with _human_input_lock:
+            return input(f"[{agent_name}] {prompt}" if show_name else prompt)
+    instruction = channel.take(agent_name)
+    if instruction:
+        logger.info(f"Human instruction for {agent_name} arrived: {instruction}")
+        return instruction
+    if review_reasons and channel.mode == "channel":
+        with _human_input_lock:
+            return channel.wait_for_reply(f"[{agent_name}] Review before continuing: {'; '.join(review_reasons)}\n{REVIEW_PROMPT}")
+    if review_reasons:
+        logger.info(f"Autonomous mode, not pausing for review: {review_reasons}")
+    return ""
+
+
+__all__ = ["HumanChannel", "ask_human", "get_review_reasons", "HUMAN_MODES", "INBOX_FILE", "REVIEW_BEFORE_END"]
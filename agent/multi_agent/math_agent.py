@@ -1,6 +1,5 @@
 from ..tools.files import write_file, read_file, get_file_tree
 from .member_agent import make_member_node
-from ..llms import MATH_AGENT_MODEL
 
 MATH_ROLE_PROMPT = """
 You will act as a math agent.
@@ -22,5 +21,5 @@ math_node = make_member_node(MATH_AGENT_NAME, MATH_ROLE_PROMPT,
                              [read_file, 
                               write_file,
                               get_file_tree], 
-                             llm=MATH_AGENT_MODEL)
+                             llm="math_agent_model")
 
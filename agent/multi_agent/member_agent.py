@@ -1,16 +1,30 @@
+import asyncio
+import time
 import traceback
 from typing import Literal
 from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
 from langgraph.types import Command
 from loguru import logger
 from langchain_core.tools import BaseTool
+from langchain_core.runnables import RunnableLambda
 from langgraph.graph import StateGraph
-from .supervisor_agent_name import SUPERVISOR_AGENT_NAME
-from ..llms import MEMBER_DEFAULT_MODEL
-from .get_relevant_memories import get_relevant_memories
+from .supervisor_agent_name import SUPERVISOR_AGENT_NAME, format_member_reports
+from ..llms import get_role_model
+from ..hedging import ModelChain
+from ..usage import track_usage
+from ..message_layout import get_system_message, append_to_tail
+from ..compaction import compact_messages, acompact_messages, COMPACTION_ENABLE
+from ..artifacts import spill_tool_result, SPILL_ENABLE
+from ..tools.tool_results import read_tool_result
+from ..async_runtime import arun_blocking, ainvoke_tool
+from .memory_prefetch import MemoryPrefetcher
 from ..tools.notify_supervisor import notify_supervisor
-from ..llm_calling import get_and_parse_json_response
+from ..llm_calling import (get_and_parse_json_response, aget_and_parse_json_response,
+                           stream_and_parse_json_response, astream_and_parse_json_response)
 from .memory_trigger_tools import is_trigger_memory_tool
+from .early_dispatch import EarlyToolDispatcher, make_early_dispatch_callback, STREAMING_ENABLE
+from .parallel_tools import run_tool_calls, arun_tool_calls, log_timings
+from .human_channel import ask_human, get_review_reasons
 from .state import State
 def make_tools_prompt(tools: dict[str, BaseTool]):
     return "Tools specified below:\n" + "\n\n\n".join(
@@ -74,18 +88,19 @@ Example 3:
 """
 
 
-def make_member_llm_node(agent_name: str, role_prompt: str, llm = MEMBER_DEFAULT_MODEL, tools: dict[str, BaseTool] = {}):
-    def llm_node(state: State) -> Command[Literal[agent_name, "tools"]]:  # type: ignore
-        logger.info(f"Entering {agent_name} llm_node.")
-
+def make_member_llm_node(agent_name: str, role_prompt: str, llm = "member_default_model", tools: dict[str, BaseTool] = {}):
+    """`llm` is either a chat model or a config.yaml `llms:` role key, which is resolved on first call.
+    The node has a sync and an async implementation, used by `graph.invoke` and `graph.ainvoke` respectively."""
+    def start(state: State) -> Command | None:
         # Initialize agent's message history if it's a new agent call
         if agent_name not in state["member_messages"]:
-            system_prompt = (
+            # built once per agent and reused byte for byte, so providers can cache the prompt prefix
+            system_message = get_system_message(agent_name, lambda: (
                 MEMBER_PROMPT_TEMPLATE
                 + f"\nYour role:\n{role_prompt}\n\n"
                 + make_tools_prompt(tools)
-            )
-            state["member_messages"][agent_name] = [SystemMessage(content=system_prompt)]
+            ))
+            state["member_messages"][agent_name] = [system_message]
             state["member_tool_calls"][agent_name] = []
             state["member_trigger_long_term_memory"][agent_name] = False
             state["member_retrieved_memory_ids"][agent_name] = []
@@ -98,23 +113,34 @@ def make_member_llm_node(agent_name: str, role_prompt: str, llm = MEMBER_DEFAULT
             state["member_trigger_long_term_memory"][agent_name] = True
             state["member_retrieved_memory_ids"][agent_name] = []
             state["next_agent_prompt"] = None
+            MemoryPrefetcher().start(agent_name, state["member_messages"][agent_name], [])
             return Command(update=state, goto=agent_name)
+        return None
 
-        agent_messages = state["member_messages"][agent_name]
-
+    def needs_memories(state: State) -> bool:
         if state["member_trigger_long_term_memory"].get(agent_name, False): # Use .get() to avoid KeyError if agent_name not in dict
             logger.info(f"{agent_name} retrieving memories")
-            retrieved_memory_ids = state["member_retrieved_memory_ids"].get(agent_name, []) # Use .get()
-            _, memory_ids, memory_formatted = get_relevant_memories(agent_messages, exclude_ids=retrieved_memory_ids)
-            retrieved_memory_ids.extend(memory_ids)
-            agent_messages[-1].content = agent_messages[-1].content + memory_formatted
-            state["member_retrieved_memory_ids"][agent_name].extend(retrieved_memory_ids)
-            state["member_trigger_long_term_memory"][agent_name] = False
-            return Command(update=state, goto=agent_name)
-        else:
-            logger.info(f"{agent_name} no memory trigger tool calls, skipping memory retrieval")
+            return True
+        logger.info(f"{agent_name} no memory trigger tool calls, skipping memory retrieval")
+        return False
+
+    def add_memories(state: State, memory_ids: list[str], memory_formatted: str):
+        """Memories go into this step's prompt, the retrieval was started when the tool results came in."""
+        retrieved_memory_ids = state["member_retrieved_memory_ids"].get(agent_name, []) # Use .get()
+        retrieved_memory_ids.extend(memory_ids)
+        append_to_tail(state["member_messages"][agent_name], memory_formatted)
+        state["member_retrieved_memory_ids"][agent_name].extend(retrieved_memory_ids)
+        state["member_trigger_long_term_memory"][agent_name] = False
 
-        response, parsed_response = get_and_parse_json_response(llm, agent_messages)
+    def get_model():
+        return get_role_model(llm) if isinstance(llm, str) else llm
+
+    def uses_streaming(model) -> bool:
+        # hedged requests stream concurrently, and the loser could start tools the winner never asked for
+        return STREAMING_ENABLE and not (isinstance(model, ModelChain) and model.is_hedged)
+
+    def handle_response(state: State, response: str, parsed_response: dict) -> Command:
+        agent_messages = state["member_messages"][agent_name]
         agent_messages.append(AIMessage(content=response))
         try:
             thoughts, tool_calls = parsed_response["thoughts"], parsed_response["tool_calls"]
@@ -142,24 +168,84 @@ def make_member_llm_node(agent_name: str, role_prompt: str, llm = MEMBER_DEFAULT
         state["member_tool_calls"][agent_name] = tool_calls
         state["member_trigger_long_term_memory"][agent_name] = False
         return Command(goto="member_human_node", update=state)
-    return llm_node
+
+    @track_usage(agent_name, "llm_node")
+    def llm_node(state: State) -> Command[Literal[agent_name, "tools"]]:  # type: ignore
+        logger.info(f"Entering {agent_name} llm_node.")
+        command = start(state)
+        if command is not None:
+            return command
+        agent_messages = state["member_messages"][agent_name]
+        if needs_memories(state):
+            _, memory_ids, memory_formatted = MemoryPrefetcher().join(
+                agent_name, agent_messages, exclude_ids=state["member_retrieved_memory_ids"].get(agent_name, []))
+            add_memories(state, memory_ids, memory_formatted)
+
+        compact_messages(agent_name, agent_messages)
+        model = get_model()
+        if uses_streaming(model):
+            EarlyToolDispatcher().discard(agent_name)
+            response, parsed_response = stream_and_parse_json_response(
+                model, agent_messages, make_early_dispatch_callback(agent_name, tools))
+        else:
+            response, parsed_response = get_and_parse_json_response(model, agent_messages)
+        return handle_response(state, response, parsed_response)
+
+    @track_usage(agent_name, "llm_node")
+    async def allm_node(state: State) -> Command[Literal[agent_name, "tools"]]:  # type: ignore
+        logger.info(f"Entering {agent_name} llm_node.")
+        command = start(state)
+        if command is not None:
+            return command
+        agent_messages = state["member_messages"][agent_name]
+        if needs_memories(state):
+            _, memory_ids, memory_formatted = await MemoryPrefetcher().ajoin(
+                agent_name, agent_messages, exclude_ids=state["member_retrieved_memory_ids"].get(agent_name, []))
+            add_memories(state, memory_ids, memory_formatted)
+
+        await acompact_messages(agent_name, agent_messages)
+        model = get_model()
+        if uses_streaming(model):
+            EarlyToolDispatcher().discard(agent_name)
+            response, parsed_response = await astream_and_parse_json_response(
+                model, agent_messages, make_early_dispatch_callback(agent_name, tools))
+        else:
+            response, parsed_response = await aget_and_parse_json_response(model, agent_messages)
+        return handle_response(state, response, parsed_response)
+
+    return RunnableLambda(llm_node, afunc=allm_node, name=agent_name)
+
+HUMAN_INPUT_PROMPT = "Input your instruction here. Leave blank if you don't have any:\nInstruction: "
 
 def make_member_human_node(agent_name: str):
-    def human_node(state: State) -> Command[Literal[agent_name, "tools"]]:  # type: ignore
-        value = input("Input your instruction here. Leave blank if you don't have any:\nInstruction: ").strip()
+    def get_input(state: State) -> str:
+        # agents running in parallel say who is asking
+        return ask_human(agent_name, HUMAN_INPUT_PROMPT, get_review_reasons(state["member_tool_calls"][agent_name]),
+                         show_name=bool(state.get("fan_out_id")))
+
+    def handle_input(state: State, value: str) -> Command:
+        value = value.strip()
         if value:
             logger.info(f"Human instruction: {value}")
             messages = state["member_messages"][agent_name] # TODO: use langchain breakpoint
             messages.append(HumanMessage(content=f'System: None of the tool calls are executed because human interrupted with instruction message: {value}'))
+            EarlyToolDispatcher().discard(agent_name)
             return Command(goto=agent_name, update=state)
         else:
             logger.info(f"No human instruction, going to tools_node")
             return Command(goto="tools")
-    return human_node
+
+    def human_node(state: State) -> Command[Literal[agent_name, "tools"]]:  # type: ignore
+        return handle_input(state, get_input(state))
+
+    async def ahuman_node(state: State) -> Command[Literal[agent_name, "tools"]]:  # type: ignore
+        return handle_input(state, await arun_blocking(get_input, state))
+
+    return RunnableLambda(human_node, afunc=ahuman_node, name="member_human_node")
 
 def make_member_tools_node(agent_name: str, tools: dict[str, BaseTool], return_to_supervisor: bool = True):
-    def tools_node(state: State) -> Command[Literal[agent_name]]:  # type: ignore
-        logger.info(f"Entering {agent_name} tools_node.")
+    def check_tool_calls(state: State) -> Command | dict | None:
+        """Handle everything that does not execute tools: missing or unknown tools and notify_supervisor."""
         tool_calls = state["member_tool_calls"][agent_name]
         messages = state["member_messages"][agent_name]
         
@@ -192,6 +278,10 @@ def make_member_tools_node(agent_name: str, tools: dict[str, BaseTool], return_t
             logger.info(f"{agent_name} notify supervisor with message: {notify_message}")
             if return_to_supervisor:
                 logger.info(f"{agent_name} returning control to supervisor")
+                if not state.get("fan_out_id") and state.get("supervisor_messages"): # a fan-out reports when all branches are done
+                    MemoryPrefetcher().start(SUPERVISOR_AGENT_NAME, state["supervisor_messages"] + [
+                        HumanMessage(content=format_member_reports({agent_name: notify_message}))],
+                        state.get("supervisor_retrieved_memory_ids", []))
                 state["member_finish_message"][agent_name] = notify_message
                 state["member_tool_calls"][agent_name] = []
                 state["member_trigger_long_term_memory"][agent_name] = False
@@ -210,33 +300,89 @@ def make_member_tools_node(agent_name: str, tools: dict[str, BaseTool], return_t
                 )
                 state["member_trigger_long_term_memory"][agent_name] = False
                 return Command(goto=agent_name, update=state)
+        return None
 
-        tool_call_results = []
-        for tool_call in tool_calls:
-            tool_name = tool_call["name"]
-            try:
-                tool_result = tools[tool_name].invoke(tool_call["args"])
-            except Exception as e:
-                tool_result = f"Error: {e}"
-                logger.warning(f"{agent_name} tool call: {tool_call} produced error: {e}. Traceback: {traceback.format_exc()}")
-            tool_call_results.append((tool_name, tool_result))
-            logger.info(f"{agent_name} tool call: {tool_call} produced result: {tool_result}")
-        
+    def tool_error(tool_call: dict, e: Exception) -> str:
+        logger.warning(f"{agent_name} tool call: {tool_call} produced error: {e}. Traceback: {traceback.format_exc()}")
+        return f"Error: {e}"
+
+    def finish_call(tool_call: dict, tool_result, started: float, early: bool) -> tuple[str, dict]:
+        tool_result = spill_tool_result(tool_call["name"], tool_result)
+        logger.info(f"{agent_name} tool call: {tool_call} produced result: {tool_result}")
+        return tool_result, {"name": tool_call["name"], "seconds": round(time.perf_counter() - started, 3), "early": early}
+
+    def execute(tool_call: dict) -> tuple[str, dict]:
+        started = time.perf_counter()
+        early_result = EarlyToolDispatcher().take(agent_name, tool_call)
+        try:
+            if early_result is not None:
+                tool_result = early_result.result()
+            else:
+                tool_result = tools[tool_call["name"]].invoke(tool_call["args"])
+        except Exception as e:
+            tool_result = tool_error(tool_call, e)
+        return finish_call(tool_call, tool_result, started, early_result is not None)
+
+    async def aexecute(tool_call: dict) -> tuple[str, dict]:
+        started = time.perf_counter()
+        early_result = EarlyToolDispatcher().take(agent_name, tool_call)
+        try:
+            if early_result is not None:
+                tool_result = await asyncio.wrap_future(early_result)
+            else:
+                # tools block (terminals, OCR, browser), so they run in the bounded tool pool
+                tool_result = await ainvoke_tool(tools[tool_call["name"]], tool_call["args"])
+        except Exception as e:
+            tool_result = tool_error(tool_call, e)
+        return finish_call(tool_call, tool_result, started, early_result is not None)
+
+    def handle_results(state: State, results: list[tuple[str, dict]], started: float) -> Command:
+        tool_calls = state["member_tool_calls"][agent_name]
+        timings = [timing for _, timing in results]
         results_message = "\n".join(
-            [f'Tool "{name}" result: {result}' for name, result in tool_call_results]
+            [f'Tool "{call["name"]}" result: {result}' for call, (result, _) in zip(tool_calls, results)]
         )
-        messages.append(HumanMessage(content=results_message))
-        logger.info(f"{agent_name} not finished, going back to llm_node")
+        state["member_messages"][agent_name].append(HumanMessage(content=results_message, additional_kwargs={"tool_timings": timings}))
         state["member_trigger_long_term_memory"][agent_name] = any(is_trigger_memory_tool(call["name"]) for call in tool_calls)
+        if state["member_trigger_long_term_memory"][agent_name]: # runs until the llm_node needs it for the prompt
+            MemoryPrefetcher().start(agent_name, state["member_messages"][agent_name],
+                                     state["member_retrieved_memory_ids"].get(agent_name, []))
+        EarlyToolDispatcher().discard(agent_name)
+        log_timings(agent_name, timings, time.perf_counter() - started)
+        logger.info(f"{agent_name} not finished, going back to llm_node")
         state["member_tool_calls"][agent_name] = []
         return Command(update=state, goto=agent_name)
-    return tools_node
+
+    @track_usage(agent_name, "tools_node")
+    def tools_node(state: State) -> Command[Literal[agent_name]]:  # type: ignore
+        logger.info(f"Entering {agent_name} tools_node.")
+        command = check_tool_calls(state)
+        if command is not None:
+            return command
+        # independent calls run concurrently, calls sharing a resource in the order they were given
+        started = time.perf_counter()
+        results = run_tool_calls(state["member_tool_calls"][agent_name], execute)
+        return handle_results(state, results, started)
+
+    @track_usage(agent_name, "tools_node")
+    async def atools_node(state: State) -> Command[Literal[agent_name]]:  # type: ignore
+        logger.info(f"Entering {agent_name} tools_node.")
+        command = check_tool_calls(state)
+        if command is not None:
+            return command
+        started = time.perf_counter()
+        results = await arun_tool_calls(state["member_tool_calls"][agent_name], aexecute)
+        return handle_results(state, results, started)
+
+    return RunnableLambda(tools_node, afunc=atools_node, name="tools")
 
 def make_member_node(agent_name: str, role_prompt: str, tools: list[BaseTool], 
-                     llm = MEMBER_DEFAULT_MODEL,
+                     llm = "member_default_model",
                      return_to_supervisor: bool = True):
     tools = {tool.name: tool for tool in tools}
     tools["notify_supervisor"] = notify_supervisor
+    if SPILL_ENABLE or COMPACTION_ENABLE: # both leave handles to results that are no longer in the prompt
+        tools["read_tool_result"] = read_tool_result
     subgraph = StateGraph(State)
     subgraph.add_node(agent_name, make_member_llm_node(agent_name, role_prompt, llm, tools))
     subgraph.add_node("member_human_node", make_member_human_node(agent_name))
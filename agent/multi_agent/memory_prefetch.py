@@ -0,0 +1,155 @@
+import asyncio
+import concurrent.futures
+import threading
+import time
+from langchain_core.messages import AnyMessage
+from loguru import logger
+from ..async_runtime import get_event_loop
+from ..config import MEMORY_PREFETCH_CONFIG
+from ..timestamp import get_current_run_timestamp
+from ..usage import register_metrics_source, usage_context
+from . import get_relevant_memories as retrieval
+
+PREFETCH_ENABLE = MEMORY_PREFETCH_CONFIG.get("enable", False)
+# seconds after a retrieval started, beyond which the agent's LLM call goes ahead without its memories
+PREFETCH_DEADLINE_SECONDS = MEMORY_PREFETCH_CONFIG.get("deadline_seconds", 5.0)
+
+logger.info(f"Memory prefetch is {'enabled' if PREFETCH_ENABLE else 'disabled'}")
+
+
+class _Prefetch:
+    def __init__(self, context: str, future: concurrent.futures.Future):
+        self.context = context
+        self.future = future
+        self.started = time.monotonic()
+
+
+class MemoryPrefetcher:
+    """Retrieves an agent's memories in the background, started as soon as the context of its next
+    retrieval is known (e.g. by the tools node, once the tool results are in), and joined when the
+    agent's next prompt is assembled. A prefetch whose query context turns out different is dropped.
+    Past the deadline the agent goes on without memories; what the retrieval finds after that is
+    handed to the agent's next join instead."""
+    _instance = None
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super().__new__(cls)
+            cls._instance.pending = {}
+            cls._instance.late = {}
+            cls._instance.stats = {"started": 0, "ready": 0, "waited": 0, "timed_out": 0, "mismatched": 0, "late_memories": 0}
+            cls._instance._lock = threading.Lock()
+        return cls._instance
+
+    def __init__(self):
+        pass
+
+    def start(self, agent: str, messages: list[AnyMessage], exclude_ids: list[str]):
+        if PREFETCH_ENABLE and retrieval.MEMORY_ENABLE_RETRIEVAL:
+            self._submit(agent, messages, exclude_ids)
+            logger.info(f"{agent} memory retrieval started in the background")
+
+    def _submit(self, agent: str, messages: list[AnyMessage], exclude_ids: list[str]):
+        messages, exclude_ids = list(messages), list(exclude_ids or []) # the caller goes on changing them
+        async def retrieve():
+            with usage_context(agent, "memory_prefetch"): # it runs outside of the node's context
+                return await retrieval.aget_relevant_memories(messages, exclude_ids=exclude_ids, agent=agent)
+        future = asyncio.run_coroutine_threadsafe(retrieve(), get_event_loop())
+        with self._lock:
+            previous = self.pending.pop(agent, None)
+            self.pending[agent] = _Prefetch(retrieval.memory_query_context(messages), future)
+            self.stats["started"] += 1
+        if previous is not None:
+            self._drop(agent, previous)
+
+    def _take(self, agent: str, messages: list[AnyMessage], exclude_ids: list[str]) -> _Prefetch:
+        """The agent's pending prefetch if it was started for this context, otherwise a new one."""
+        context = retrieval.memory_query_context(messages)
+        with self._lock:
+            prefetch = self.pending.pop(agent, None)
+            mismatched = prefetch is not None and prefetch.context != context
+            if mismatched:
+                self.stats["mismatched"] += 1
+        if mismatched:
+            logger.info(f"{agent} context changed since its memory retrieval started, retrieving again")
+            self._drop(agent, prefetch)
+        if prefetch is None or mismatched:
+            self._submit(agent, messages, exclude_ids)
+            with self._lock:
+                prefetch = self.pending.pop(agent)
+        return prefetch
+
+    def _on_time(self, agent: str, prefetch: _Prefetch, ready: bool) -> bool:
+        with self._lock:
+            if prefetch.future.done():
+                self.stats["ready" if ready else "waited"] += 1
+                return True
+            self.stats["timed_out"] += 1
+        logger.warning(f"{agent} memory retrieval missed its {PREFETCH_DEADLINE_SECONDS}s deadline, going on without it")
+        self._drop(agent, prefetch)
+        return False
+
+    def _drop(self, agent: str, prefetch: _Prefetch):
+        """The retrieval is left to finish, and the memories it finds are handed to the agent's next
+        join: the RetrievalCache counts them as given to the agent from then on."""
+        run_id = get_current_run_timestamp()
+        prefetch.future.add_done_callback(lambda future: self._keep_late(agent, run_id, future))
+
+    def _keep_late(self, agent: str, run_id: str, future: concurrent.futures.Future):
+        if future.cancelled() or future.exception() is not None:
+            logger.warning(f"{agent} late memory retrieval failed: {None if future.cancelled() else future.exception()}")
+            return
+        memories = future.result()[0]
+        with self._lock:
+            if self.late.get(agent, (None,))[0] != run_id: # memories of an earlier run are not handed over
+                self.late[agent] = (run_id, [])
+            self.late[agent][1].extend(memories)
+
+    def _result(self, agent: str, prefetch: _Prefetch | None, exclude_ids: list[str]) -> tuple[list[dict], list[str], str]:
+        memories = prefetch.future.result()[0] if prefetch is not None else []
+        with self._lock:
+            run_id, late = self.late.pop(agent, (None, []))
+        if run_id != get_current_run_timestamp():
+            late = []
+        exclude_ids = set(exclude_ids or [])
+        late = [memory for memory in late if memory.get("id") not in exclude_ids]
+        if late:
+            with self._lock:
+                self.stats["late_memories"] += len(late)
+        memories = list({memory.get("id"): memory for memory in late + memories}.values())
+        return memories, [memory.get("id") for memory in memories], retrieval.format_memories(memories)
+
+    def join(self, agent: str, messages: list[AnyMessage], exclude_ids: list[str]) -> tuple[list[dict], list[str], str]:
+        """Like get_relevant_memories, waiting for the prefetch at most until its deadline."""
+        if not PREFETCH_ENABLE or not retrieval.MEMORY_ENABLE_RETRIEVAL:
+            return retrieval.get_relevant_memories(messages, exclude_ids=exclude_ids, agent=agent)
+        prefetch = self._take(agent, messages, exclude_ids)
+        ready = prefetch.future.done()
+        remaining = prefetch.started + PREFETCH_DEADLINE_SECONDS - time.monotonic()
+        concurrent.futures.wait([prefetch.future], timeout=max(remaining, 0))
+        return self._result(agent, prefetch if self._on_time(agent, prefetch, ready) else None, exclude_ids)
+
+    async def ajoin(self, agent: str, messages: list[AnyMessage], exclude_ids: list[str]) -> tuple[list[dict], list[str], str]:
+        if not PREFETCH_ENABLE or not retrieval.MEMORY_ENABLE_RETRIEVAL:
+            return await retrieval.aget_relevant_memories(messages, exclude_ids=exclude_ids, agent=agent)
+        prefetch = self._take(agent, messages, exclude_ids)
+        ready = prefetch.future.done()
+        remaining = prefetch.started + PREFETCH_DEADLINE_SECONDS - time.monotonic()
+        # asyncio.wait, unlike wait_for, leaves the retrieval running past the deadline
+        await asyncio.wait([asyncio.wrap_future(prefetch.future)], timeout=max(remaining, 0))
+        return self._result(agent, prefetch if self._on_time(agent, prefetch, ready) else None, exclude_ids)
+
+    def discard(self, agent: str):
+        with self._lock:
+            prefetch = self.pending.pop(agent, None)
+        if prefetch is not None:
+            self._drop(agent, prefetch)
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return dict(self.stats)
+
+register_metrics_source("memory_prefetch", lambda: MemoryPrefetcher().get_stats())
+
+
+__all__ = ["MemoryPrefetcher", "PREFETCH_ENABLE"]
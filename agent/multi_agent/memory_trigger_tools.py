@@ -12,6 +12,7 @@ from ..tools.pdf2md import convert_pdf2md
 from ..tools.files import rename_file
 from ..tools.memory import search_memory, add_memory, delete_memory, update_memory
 from ..tools.notify_supervisor import notify_supervisor
+from ..tools.tool_results import read_tool_result
 # from ..tools.wechat import send_message, get_all_new_messages
 
 MEMORY_RETRIEVAL_TRIGGER_TOOLS = [
@@ -59,6 +60,7 @@ MEMORY_RETRIEVAL_NO_TRIGGER_TOOLS = [
     update_memory,
     
     notify_supervisor,
+    read_tool_result,
     send_email_to_user,
     send_email,
 ]
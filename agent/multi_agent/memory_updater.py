@@ -3,9 +3,8 @@ from .state import State
 from langgraph.types import Command
 from typing import Literal
 import os
-from agent.tools.memory import add_memory, delete_memory, update_memory
+from agent.tools.memory import add_memory, delete_memory, update_memory, get_memory_manager
 from .member_agent import make_member_node
-from ..llms import MEMORY_PROCESSOR_MODEL
 from agent.config import MEMORY_ENABLE_UPDATER
 
 logger.info(f"Memory updater agent is {'enabled' if MEMORY_ENABLE_UPDATER else 'disabled'}")
@@ -49,22 +48,34 @@ memory_updater_node = make_member_node(
     MEMORY_UPDATER_NAME,
     MEMORY_PROCESSOR_ROLE_PROMPT,
     [add_memory, delete_memory, update_memory],
-    llm=MEMORY_PROCESSOR_MODEL,
+    llm="memory_processor_model",
     return_to_supervisor=False
 )
 
 
-def update_memories(state: State) -> Command[Literal["__end__"]]:
-    if not MEMORY_ENABLE_UPDATER:
-        logger.info("Memory updater agent is disabled.")
-        return Command(goto="__end__")
-    logger.info("Entering update_memories.")
+def _make_memory_updater_prompt(state: State) -> str:
     conversation = "\n".join(
         [
             f"{'System' if msg.type == 'human' else 'Agent'}: {msg.content}"
             for msg in state["supervisor_messages"][1:]
         ]
     )
-    prompt = f"Please analyze this history and perform necessary memory operations:\n\n{conversation}"
-    memory_updater_node.invoke({"next_agent_prompt": prompt})
+    return f"Please analyze this history and perform necessary memory operations:\n\n{conversation}"
+
+def update_memories(state: State) -> Command[Literal["__end__"]]:
+    if not MEMORY_ENABLE_UPDATER:
+        logger.info("Memory updater agent is disabled.")
+        return Command(goto="__end__")
+    logger.info("Entering update_memories.")
+    with get_memory_manager().batched_writes(): # its tool calls are written as one upsert
+        memory_updater_node.invoke({"next_agent_prompt": _make_memory_updater_prompt(state)})
+    return Command(goto="__end__")
+
+async def aupdate_memories(state: State) -> Command[Literal["__end__"]]:
+    if not MEMORY_ENABLE_UPDATER:
+        logger.info("Memory updater agent is disabled.")
+        return Command(goto="__end__")
+    logger.info("Entering update_memories.")
+    with get_memory_manager().batched_writes(): # its tool calls are written as one upsert
+        await memory_updater_node.ainvoke({"next_agent_prompt": _make_memory_updater_prompt(state)})
     return Command(goto="__end__")
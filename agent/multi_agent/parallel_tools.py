@@ -0,0 +1,60 @@
+import asyncio
+import contextvars
+from concurrent.futures import FIRST_COMPLETED, wait
+from loguru import logger
+from ..async_runtime import get_tool_executor
+from ..config import PARALLEL_TOOLS_CONFIG
+from .tool_properties import tool_calls_conflict
+
+PARALLEL_TOOLS_ENABLE = PARALLEL_TOOLS_CONFIG.get("enable", False)
+
+def get_dependencies(tool_calls: list[dict]) -> list[list[int]]:
+    """For each call, the earlier calls of the same response it has to wait for."""
+    return [[j for j in range(i) if tool_calls_conflict(tool_calls[j], tool_calls[i])]
+            for i in range(len(tool_calls))]
+
+def run_tool_calls(tool_calls: list[dict], execute) -> list:
+    """Run `execute(tool_call)` for every call on the bounded tool pool, starting each call as soon as
+    the calls it conflicts with are done. Results are returned in the order of `tool_calls`."""
+    if not PARALLEL_TOOLS_ENABLE or len(tool_calls) < 2:
+        return [execute(tool_call) for tool_call in tool_calls]
+    dependencies = get_dependencies(tool_calls)
+    executor = get_tool_executor()
+    results = [None] * len(tool_calls)
+    pending = list(range(len(tool_calls)))
+    running = {}
+    finished = set()
+    while pending or running:
+        for i in [i for i in pending if all(j in finished for j in dependencies[i])]:
+            pending.remove(i)
+            running[executor.submit(contextvars.copy_context().run, execute, tool_calls[i])] = i
+        done, _ = wait(running, return_when=FIRST_COMPLETED)
+        for future in done:
+            i = running.pop(future)
+            results[i] = future.result()
+            finished.add(i)
+    return results
+
+async def arun_tool_calls(tool_calls: list[dict], aexecute) -> list:
+    """Async variant of `run_tool_calls`, `aexecute` is expected to run blocking work in the tool pool."""
+    if not PARALLEL_TOOLS_ENABLE or len(tool_calls) < 2:
+        return [await aexecute(tool_call) for tool_call in tool_calls]
+    dependencies = get_dependencies(tool_calls)
+    tasks = []
+
+    async def run(i: int):
+        if dependencies[i]:
+            await asyncio.gather(*(tasks[j] for j in dependencies[i]))
+        return await aexecute(tool_calls[i])
+
+    for i in range(len(tool_calls)):
+        tasks.append(asyncio.ensure_future(run(i)))
+    return list(await asyncio.gather(*tasks))
+
+def log_timings(agent_name: str, timings: list[dict], wall_time: float):
+    if len(timings) > 1:
+        logger.info(f"{agent_name} ran {len(timings)} tool calls in {wall_time:.2f}s "
+                    f"(sequentially {sum(timing['seconds'] for timing in timings):.2f}s)")
+
+
+__all__ = ["run_tool_calls", "arun_tool_calls", "get_dependencies", "log_timings", "PARALLEL_TOOLS_ENABLE"]
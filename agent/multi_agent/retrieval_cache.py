@@ -0,0 +1,105 @@
+import hashlib
+import threading
+import numpy as np
+from loguru import logger
+from ..config import MEMORY_RETRIEVAL_CACHE_CONFIG
+from ..timestamp import get_current_run_timestamp
+from ..tools.memory import get_memory_manager
+from ..usage import register_metrics_source
+
+RETRIEVAL_CACHE_ENABLE = MEMORY_RETRIEVAL_CACHE_CONFIG.get("enable", False)
+# a query whose embedding is within this cosine distance of the agent's last searched one reuses its results
+RETRIEVAL_CACHE_EPSILON = MEMORY_RETRIEVAL_CACHE_CONFIG.get("epsilon", 0.02)
+
+
+class RetrievalCache:
+    """Per-run memory of every agent's retrievals. The last search of an agent is reused when the new
+    query context is identical (same fingerprint) or its embedding is within `epsilon` of the searched
+    one, and the same memories are excluded, so the vector search is skipped. Memories an agent was given, and those already judged
+    irrelevant for the same context, are not checked for relevance again."""
+    _instance = None
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super().__new__(cls)
+            cls._instance.enabled = RETRIEVAL_CACHE_ENABLE
+            cls._instance.epsilon = RETRIEVAL_CACHE_EPSILON
+            cls._instance.stats = {"lookups": 0, "exact_hits": 0, "near_hits": 0, "searches": 0,
+                                   "memories_skipped": 0, "relevance_checks_skipped": 0}
+            cls._instance.run_id = None
+            cls._instance.agents = {}
+            cls._instance._lock = threading.Lock()
+        return cls._instance
+
+    def __init__(self):
+        pass
+
+    def _agent(self, agent: str) -> dict:
+        run_id = get_current_run_timestamp()
+        if run_id != self.run_id: # a new run (or a resumed one) starts empty
+            self.run_id, self.agents = run_id, {}
+        return self.agents.setdefault(agent, {"fingerprint": None, "embedding": None, "excluded": None, "results": None,
+                                              "pending": None, "judged": set(), "given": set()})
+
+    def lookup(self, agent: str, context: str, exclude_ids: list[str] = None) -> list[dict] | None:
+        """The results of the agent's last search if they still fit `context` and were searched excluding
+        the same `exclude_ids`, otherwise None and the caller searches and calls `store`. Blocks on the
+        query embedding (from the embedding cache when the search embeds the same text)."""
+        excluded = frozenset(exclude_ids or [])
+        fingerprint = hashlib.sha256("\n".join([context, *sorted(excluded)]).encode("utf-8")).hexdigest()
+        with self._lock:
+            self.stats["lookups"] += 1
+            entry = self._agent(agent)
+            if entry["results"] is not None and fingerprint == entry["fingerprint"]:
+                self.stats["exact_hits"] += 1
+                return entry["results"]
+            if entry["excluded"] != excluded: # a search excluding other memories may find others in their place
+                previous = None
+            else:
+                previous = entry["embedding"]
+        embedding = np.asarray(get_memory_manager().embed_query(context), dtype=np.float32)
+        with self._lock:
+            entry = self._agent(agent)
+            if previous is not None and entry["results"] is not None:
+                similarity = float(embedding @ previous / (np.linalg.norm(embedding) * np.linalg.norm(previous) or 1))
+                if similarity >= 1 - self.epsilon:
+                    self.stats["near_hits"] += 1
+                    logger.info(f"{agent} query context is within {1 - similarity:.4f} of its last search, reusing its results")
+                    return entry["results"]
+            entry["pending"] = (fingerprint, embedding, excluded)
+        return None
+
+    def store(self, agent: str, results: list[dict]):
+        with self._lock:
+            entry = self._agent(agent)
+            self.stats["searches"] += 1
+            if entry["pending"] is None:
+                return
+            (entry["fingerprint"], entry["embedding"], entry["excluded"]), entry["pending"] = entry["pending"], None
+            entry["results"] = list(results)
+            entry["judged"] = set() # a different context, rejected memories may be relevant now
+
+    def unseen(self, agent: str, memories: list[dict], exclude_ids: list[str] = None) -> list[dict]:
+        with self._lock:
+            entry = self._agent(agent)
+            seen = entry["given"] | entry["judged"] | set(exclude_ids or [])
+            unseen = [memory for memory in memories if memory.get("id") not in seen]
+            self.stats["memories_skipped"] += len(memories) - len(unseen)
+            if memories and not unseen:
+                self.stats["relevance_checks_skipped"] += 1
+        return unseen
+
+    def mark_judged(self, agent: str, memories: list[dict], relevant_memories: list[dict]):
+        with self._lock:
+            entry = self._agent(agent)
+            entry["judged"].update(memory.get("id") for memory in memories)
+            entry["given"].update(memory.get("id") for memory in relevant_memories)
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return dict(self.stats)
+
+register_metrics_source("retrieval_cache", lambda: RetrievalCache().get_stats())
+
+
+__all__ = ["RetrievalCache"]
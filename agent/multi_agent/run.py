@@ -1,9 +1,16 @@
 from langgraph.graph import StateGraph
 from langchain_core.messages import HumanMessage
+from langchain_core.runnables import RunnableLambda
 from loguru import logger
 
 from .state import State
-from .supervisor_agent import supervisor_node, SUPERVISOR_AGENT_NAME, supervisor_human_node, SUPERVISOR_HUMAN_NODE_NAME
+from .fan_out import make_branch_node
+from ..usage import UsageTracker
+from ..async_runtime import arun_blocking, run_sync
+from ..checkpoints import get_checkpointer
+from ..timestamp import get_current_run_timestamp
+from .supervisor_agent import (supervisor_node, asupervisor_node, SUPERVISOR_AGENT_NAME,
+                               supervisor_human_node, asupervisor_human_node, SUPERVISOR_HUMAN_NODE_NAME)
 from .coder_agent import coder_node, CODER_AGENT_NAME
 from .math_agent import math_node, MATH_AGENT_NAME
 from .communication_agent import communication_node, COMMUNICATION_AGENT_NAME
@@ -18,22 +25,48 @@ MEMBER_NODES = {
     DOCUMENT_AGENT_NAME: document_node,
 }
 
-def get_graph():
+def get_graph(checkpointer=None):
     builder = StateGraph(State) # TODO: input=InputState, output=OutputState
-    builder.add_node(SUPERVISOR_AGENT_NAME, supervisor_node)
-    builder.add_node(SUPERVISOR_HUMAN_NODE_NAME, supervisor_human_node) # TODO: wrap this node in supervisor_agent, or human_node?
+    # every node has a sync and an async implementation, picked by graph.stream / graph.astream
+    builder.add_node(SUPERVISOR_AGENT_NAME, RunnableLambda(supervisor_node, afunc=asupervisor_node, name=SUPERVISOR_AGENT_NAME))
+    builder.add_node(SUPERVISOR_HUMAN_NODE_NAME, RunnableLambda(supervisor_human_node, afunc=asupervisor_human_node,
+                                                                name=SUPERVISOR_HUMAN_NODE_NAME)) # TODO: wrap this node in supervisor_agent, or human_node?
     for name, node in MEMBER_NODES.items():
-        builder.add_node(name, node)
+        builder.add_node(name, make_branch_node(name, node))
     builder.set_entry_point(SUPERVISOR_AGENT_NAME)
-    graph = builder.compile()
+    graph = builder.compile(checkpointer=checkpointer) # the member subgraphs checkpoint into it too
     return graph
 
-def run_task(task_prompt: str = None):
-    if task_prompt is None:
-        task_prompt = input("Enter the task prompt: ")
-    logger.info(f"Running task: {task_prompt}")
-    graph = get_graph()
-    stream = graph.stream(input={"supervisor_messages": [HumanMessage(content=f"{task_prompt}")]},
-                          config={"recursion_limit": 100})
-    for event in stream:
-        pass
\ No newline at end of file
+async def arun_task(task_prompt: str = None, resume: str = None, prune: bool = True):
+    """Run a task, or with `resume` set to a run id, continue that run from its last checkpoint.
+    With `prune`, old runs are deleted from the checkpoint database first (batches prune once, up front)."""
+    checkpointer = get_checkpointer()
+    run_id = get_current_run_timestamp()
+    if resume is not None:
+        if checkpointer is None or not checkpointer.has_run(resume):
+            raise ValueError(f"No checkpoints of run {resume} to resume from")
+        logger.info(f"Resuming run {resume}")
+        graph_input = None
+    else:
+        if task_prompt is None:
+            task_prompt = await arun_blocking(input, "Enter the task prompt: ")
+        logger.info(f"Running task: {task_prompt}")
+        graph_input = {"supervisor_messages": [HumanMessage(content=f"{task_prompt}")]}
+    if checkpointer is not None:
+        if prune:
+            checkpointer.prune(keep_current=run_id)
+        logger.info(f"Run id: {run_id}, continue it after an interruption with `python main.py --resume {run_id}`")
+    graph = get_graph(checkpointer)
+    # checkpoints are written before the next step starts, as nodes update the message lists in place
+    stream = graph.astream(input=graph_input,
+                           config={"recursion_limit": 100, "configurable": {"thread_id": run_id}},
+                           durability="sync")
+    try:
+        async for event in stream:
+            pass
+    finally:
+        UsageTracker().write_summary()
+
+def run_task(task_prompt: str = None, resume: str = None, prune: bool = True):
+    """Sync entry point, runs `arun_task` on the shared event loop."""
+    return run_sync(arun_task(task_prompt, resume, prune))
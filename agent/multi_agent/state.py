@@ -5,6 +5,10 @@ from typing_extensions import Annotated
 def replace_reducer(old, new):
     return new
 
+def merge_reducer(old, new):
+    """Per-agent dicts: parallel branches each update only their own agent's entry."""
+    return {**(old or {}), **(new or {})}
+
 class State(TypedDict):
     supervisor_messages: Annotated[list[AnyMessage], replace_reducer] = []
     supervisor_retrieved_memory_ids: Annotated[list[str], replace_reducer] = []
@@ -12,10 +16,12 @@ class State(TypedDict):
     
     next_agent: Annotated[str, replace_reducer] = None # TODO: must use Annotated, cannot simply replace the state, because langgraph thinks there are concurrent updates to the same key
     next_agent_prompt: Annotated[str, replace_reducer] = None
+    assignments: Annotated[list[dict[str, str]], replace_reducer] = [] # {"agent", "prompt"} of agents running in parallel
+    fan_out_id: Annotated[Optional[str], replace_reducer] = None
 
-    member_messages: Annotated[dict[str, list[AnyMessage]], replace_reducer] = {}
-    member_tool_calls: Annotated[dict[str, list[dict[str, Any]]], replace_reducer] = {}
-    member_finish_message: Annotated[dict[str, str], replace_reducer] = {}
-    member_retrieved_memory_ids: Annotated[dict[str, list[str]], replace_reducer] = {}
-    member_trigger_long_term_memory: Annotated[dict[str, bool], replace_reducer] = {}
+    member_messages: Annotated[dict[str, list[AnyMessage]], merge_reducer] = {}
+    member_tool_calls: Annotated[dict[str, list[dict[str, Any]]], merge_reducer] = {}
+    member_finish_message: Annotated[dict[str, str], merge_reducer] = {}
+    member_retrieved_memory_ids: Annotated[dict[str, list[str]], merge_reducer] = {}
+    member_trigger_long_term_memory: Annotated[dict[str, bool], merge_reducer] = {}
 
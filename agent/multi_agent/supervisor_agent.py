@@ -7,13 +7,19 @@ from .coder_agent import CODER_AGENT_ABILITIES, CODER_AGENT_NAME
 from .communication_agent import COMMUNICATION_AGENT_ABILITIES, COMMUNICATION_AGENT_NAME
 from .document_agent import DOCUMENT_AGENT_ABILITIES, DOCUMENT_AGENT_NAME
 from .browser_agent import BROWSER_AGENT_ABILITIES, BROWSER_AGENT_NAME
-from .supervisor_agent_name import SUPERVISOR_AGENT_NAME
-from ..llms import SUPERVISOR_MODEL
+from .supervisor_agent_name import SUPERVISOR_AGENT_NAME, format_member_reports
+from ..llms import get_role_model
 from .state import State
-from .get_relevant_memories import get_relevant_memories
-from ..llm_calling import get_and_parse_json_response
+from .memory_prefetch import MemoryPrefetcher
+from ..llm_calling import get_and_parse_json_response, aget_and_parse_json_response
 from ..timestamp import get_current_timestamp
-from .memory_updater import update_memories
+from .memory_updater import update_memories, aupdate_memories
+from .member_agent import HUMAN_INPUT_PROMPT
+from ..async_runtime import arun_blocking
+from ..usage import UsageTracker, track_usage
+from ..message_layout import get_system_message, append_to_tail
+from .human_channel import ask_human, REVIEW_BEFORE_END
+from .fan_out import parse_assignments, make_branch_sends, FanOutStats, FAN_OUT_ENABLE
 
 SUPERVISOR_HUMAN_NODE_NAME = "supervisor_human_node"
 
@@ -73,8 +79,37 @@ Each step, the system will examine your long-term memories. If there are some he
 If you need more information or to make a decision, you can let the communication agent send a message to the user.
 """
 
-def supervisor_node(state: State) -> Command[Literal[SUPERVISOR_AGENT_NAME, *MEMBER_AGENT_NAMES, "__end__"]]: # type: ignore
+FAN_OUT_PROMPT = """
+When sub-tasks are independent of each other, you can give them to several agents at once with an optional "assignments" field,
+a list of {"agent": <agent name>, "prompt": <the prompt for that agent>}. The agents work in parallel, and you get all their messages
+together when every one of them has finished (or one of them failed). Use "next_agent" and "next_agent_prompt" when a sub-task
+depends on the result of another one. If "assignments" is given, "next_agent" and "next_agent_prompt" are ignored.
+
+Example 3:
+{
+    "thoughts": "Solving the problems and converting the lecture notes don't depend on each other, so both can start now.",
+    "next_agent": "",
+    "next_agent_prompt": "",
+    "assignments": [
+        {"agent": "math_agent", "prompt": "Read the file D:/math/questions.md and solve the math problems."},
+        {"agent": "document_agent", "prompt": "Convert D:/lectures/lecture3.pdf to markdown and save it as D:/lectures/lecture3_notes.md."}
+    ]
+}
+"""
+
+if FAN_OUT_ENABLE:
+    SUPERVISOR_PROMPT += FAN_OUT_PROMPT
+
+def _member_reports(state: State) -> dict[str, str]:
+    """Messages of the agents called in the last step, a single one or every branch of a fan-out."""
+    agents = [assignment["agent"] for assignment in state.get("assignments") or []] or [state.get("next_agent")]
+    finish_messages = state.get("member_finish_message") or {}
+    return {agent: finish_messages[agent] for agent in agents if finish_messages.get(agent)}
+
+def _prepare_supervisor_messages(state: State) -> list:
     logger.info("Entering supervisor node.")
+    spend = UsageTracker().get_totals()
+    logger.info(f"Spend so far: ${spend['cost']:.4f} over {spend['calls']} LLM calls")
     messages = state['supervisor_messages']
     if len(messages) == 1: # if just started, add system message
         if hasattr(messages[-1], "content"):
@@ -83,40 +118,85 @@ def supervisor_node(state: State) -> Command[Literal[SUPERVISOR_AGENT_NAME, *MEM
             content = messages[-1]['content']
         input_prompt = f'System message: \nCurrent time: {get_current_timestamp()}\nUser gave you a task: {content}'
         logger.info(f"Input prompt: {input_prompt}")
-        messages = [SystemMessage(content=SUPERVISOR_PROMPT), HumanMessage(content=input_prompt)]
-    if state.get("member_finish_message", None): # if a member agent finished, add a message
-        messages.append(HumanMessage(content=f'Agent {state["next_agent"]} sent a message: {state["member_finish_message"]}'))
+        messages = [get_system_message(SUPERVISOR_AGENT_NAME, lambda: SUPERVISOR_PROMPT), HumanMessage(content=input_prompt)]
+    reports = _member_reports(state)
+    if reports: # if member agents finished, add their messages
+        messages.append(HumanMessage(content=format_member_reports(reports)))
     if state.get("from_human_interrupt", False):
-        messages[-1].content = messages[-1].content + f'\n\nHuman instruction message: {state["human_instruction_message"]}'
-    _, memory_ids, memory_formatted = get_relevant_memories(messages, 
-                                                            exclude_ids=state.get("supervisor_retrieved_memory_ids", []))
-    messages[-1].content = messages[-1].content + memory_formatted
-    response, parsed_response = get_and_parse_json_response(SUPERVISOR_MODEL, messages)
+        append_to_tail(messages, f'\n\nHuman instruction message: {state["human_instruction_message"]}')
+    return messages
+
+def _supervisor_command(state: State, messages: list, memory_ids: list[str], response: str, parsed_response: dict) -> Command:
     messages.append(AIMessage(content=response, name=SUPERVISOR_AGENT_NAME))
-    next_agent = parsed_response["next_agent"]
+    next_agent = parsed_response.get("next_agent")
+    next_agent_prompt = parsed_response.get("next_agent_prompt")
+    assignments = parse_assignments(parsed_response, MEMBER_AGENT_NAMES)
+    if len(assignments) == 1:
+        next_agent, next_agent_prompt, assignments = assignments[0]["agent"], assignments[0]["prompt"], []
+    FanOutStats().finish(state.get("fan_out_id"))
     
     return Command(goto=SUPERVISOR_HUMAN_NODE_NAME, update={
                                     "supervisor_messages": messages,
                                     "supervisor_retrieved_memory_ids": state.get("supervisor_retrieved_memory_ids", []) + memory_ids,
                                     "next_agent": next_agent,
-                                    "next_agent_prompt": parsed_response["next_agent_prompt"]
+                                    "next_agent_prompt": next_agent_prompt,
+                                    "assignments": assignments,
+                                    "fan_out_id": None,
+                                    # reported, so a later step (e.g. after a human instruction) does not repeat them
+                                    "member_finish_message": {agent: None for agent in _member_reports(state)},
                                     })
 
+@track_usage(SUPERVISOR_AGENT_NAME, "supervisor_node")
+def supervisor_node(state: State) -> Command[Literal[SUPERVISOR_AGENT_NAME, *MEMBER_AGENT_NAMES, "__end__"]]: # type: ignore
+    messages = _prepare_supervisor_messages(state)
+    # started by the reporting member agent when it could tell the context, otherwise now
+    _, memory_ids, memory_formatted = MemoryPrefetcher().join(SUPERVISOR_AGENT_NAME, messages,
+                                                              exclude_ids=state.get("supervisor_retrieved_memory_ids", []))
+    append_to_tail(messages, memory_formatted)
+    response, parsed_response = get_and_parse_json_response(get_role_model("supervisor_model"), messages)
+    return _supervisor_command(state, messages, memory_ids, response, parsed_response)
 
+@track_usage(SUPERVISOR_AGENT_NAME, "supervisor_node")
+async def asupervisor_node(state: State) -> Command[Literal[SUPERVISOR_AGENT_NAME, *MEMBER_AGENT_NAMES, "__end__"]]: # type: ignore
+    messages = _prepare_supervisor_messages(state)
+    _, memory_ids, memory_formatted = await MemoryPrefetcher().ajoin(SUPERVISOR_AGENT_NAME, messages,
+                                                                     exclude_ids=state.get("supervisor_retrieved_memory_ids", []))
+    append_to_tail(messages, memory_formatted)
+    response, parsed_response = await aget_and_parse_json_response(get_role_model("supervisor_model"), messages)
+    return _supervisor_command(state, messages, memory_ids, response, parsed_response)
 
-def supervisor_human_node(state: State) -> Command[Literal[SUPERVISOR_AGENT_NAME, *MEMBER_AGENT_NAMES, "__end__"]]: # type: ignore
-    value = input("Input your instruction here. Leave blank if you don't have any:\nInstruction: ").strip()
+
+def _handle_supervisor_input(state: State, value: str) -> tuple[Command, bool]:
+    """Returns the command and whether the run ends, in which case memories are updated first."""
+    value = value.strip()
     if value:
         logger.info(f"Human instruction: {value}")
         messages = state['supervisor_messages']
         messages.append(HumanMessage(content=f'System: human interrupted with instruction message: {value}'))
         return Command(goto=SUPERVISOR_AGENT_NAME, update={
             "supervisor_messages": messages
-        })
+        }), False
     else:
+        if state.get("assignments"):
+            return Command(goto=make_branch_sends(state)), False
         logger.info(f"No human instruction, routing to {state['next_agent']}.")
         if state["next_agent"] == "__end__":
-            update_memories(state)
-            return Command(goto="__end__")
+            return Command(goto="__end__"), True
         else:
-            return Command(goto=state["next_agent"])
\ No newline at end of file
+            return Command(goto=state["next_agent"]), False
+
+def _get_supervisor_input(state: State) -> str:
+    review_reasons = ["the supervisor wants to end the run"] if REVIEW_BEFORE_END and state["next_agent"] == "__end__" else []
+    return ask_human(SUPERVISOR_AGENT_NAME, HUMAN_INPUT_PROMPT, review_reasons)
+
+def supervisor_human_node(state: State) -> Command[Literal[SUPERVISOR_AGENT_NAME, *MEMBER_AGENT_NAMES, "__end__"]]: # type: ignore
+    command, is_end = _handle_supervisor_input(state, _get_supervisor_input(state))
+    if is_end:
+        update_memories(state)
+    return command
+
+async def asupervisor_human_node(state: State) -> Command[Literal[SUPERVISOR_AGENT_NAME, *MEMBER_AGENT_NAMES, "__end__"]]: # type: ignore
+    command, is_end = _handle_supervisor_input(state, await arun_blocking(_get_supervisor_input, state))
+    if is_end:
+        await aupdate_memories(state)
+    return command
@@ -1 +1,6 @@
-SUPERVISOR_AGENT_NAME = "supervisor_agent"
\ No newline at end of file
+SUPERVISOR_AGENT_NAME = "supervisor_agent"
+
+def format_member_reports(reports: dict[str, str]) -> str:
+    """The supervisor's message with the reports of the agents it called, also used by member agents
+    to start the supervisor's memory retrieval before it runs."""
+    return "\n".join(f'Agent {agent} sent a message: {message}' for agent, message in reports.items())
@@ -0,0 +1,110 @@
+from ..tools.files import read_file, write_file, rename_file, get_file_tree
+from ..tools.tool_results import read_tool_result
+from ..tools.ocr import perform_ocr, locate_text
+from ..tools.vlm import get_image_description
+from ..tools.pdf2md import convert_pdf2md
+from pathlib import Path
+from ..tools.terminals import TerminalManager, open_terminal, command_terminal, get_terminal_output, close_terminal, rename_terminal, list_all_terminals
+from ..tools.browser import (
+    browser_new_tab, browser_click, browser_understand_page, browser_scroll,
+    browser_typewrite, browser_hotkey, check_browser_download_folder,
+    browser_switch_tab_to, browser_list_tabs
+)
+from ..tools.memory import search_memory, add_memory, delete_memory, update_memory
+from ..tools.communication import get_latest_email, send_email_to_user, send_email
+
+# Read-only tools that may start while the LLM is still streaming the rest of its response.
+EARLY_DISPATCH_TOOLS = [
+    read_file,
+    get_file_tree,
+    read_tool_result,
+]
+EARLY_DISPATCH_TOOL_NAMES = [tool.name for tool in EARLY_DISPATCH_TOOLS]
+
+# Tools that only read. Two of them never have to wait for each other.
+SIDE_EFFECT_FREE_TOOLS = [
+    read_file,
+    get_file_tree,
+    read_tool_result,
+    perform_ocr,
+    locate_text,
+    get_image_description,
+    search_memory,
+]
+SIDE_EFFECT_FREE_TOOL_NAMES = [tool.name for tool in SIDE_EFFECT_FREE_TOOLS]
+
+# The shared resource a tool uses. Calls on the same resource run in order, unless both are side
+# effect free. A tool with side effects that is in neither list runs alone, after everything before it.
+TOOL_RESOURCES = {
+    "files": [read_file, get_file_tree, write_file, rename_file, convert_pdf2md, perform_ocr, locate_text, get_image_description],
+    "terminal": [open_terminal, command_terminal, get_terminal_output, close_terminal, rename_terminal, list_all_terminals],
+    "browser": [browser_new_tab, browser_click, browser_understand_page, browser_scroll, browser_typewrite,
+                browser_hotkey, check_browser_download_folder, browser_switch_tab_to, browser_list_tabs],
+    "memory": [search_memory, add_memory, delete_memory, update_memory],
+    "email": [get_latest_email, send_email_to_user, send_email],
+}
+TOOL_RESOURCE_KEYS = {tool.name: resource for resource, tools in TOOL_RESOURCES.items() for tool in tools}
+
+# Arguments naming the files a call uses. Calls on different files (and not one inside a directory the
+# other lists) do not wait for each other.
+TOOL_PATH_ARGS = {
+    read_file.name: ("filepath",),
+    write_file.name: ("filepath",),
+    rename_file.name: ("filepath", "new_name"),
+    get_file_tree.name: ("root_path",),
+    convert_pdf2md.name: ("file_path", "save_path"),
+    perform_ocr.name: ("image_path",),
+    locate_text.name: ("image_path",),
+    get_image_description.name: ("filepath",),
+}
+# Calls of these on different terminals do not wait for each other. Renaming and listing use all terminals.
+SINGLE_TERMINAL_TOOL_NAMES = [open_terminal.name, command_terminal.name, get_terminal_output.name, close_terminal.name]
+
+def is_early_dispatch_tool(tool_name: str) -> bool:
+    return tool_name in EARLY_DISPATCH_TOOL_NAMES
+
+def is_side_effect_free(tool_name: str) -> bool:
+    return tool_name in SIDE_EFFECT_FREE_TOOL_NAMES
+
+def get_resource_key(tool_name: str) -> str | None:
+    return TOOL_RESOURCE_KEYS.get(tool_name)
+
+def _terminal_name(args: dict) -> str | None:
+    if args.get("name") is not None:
+        return str(args["name"])
+    if args.get("id") is not None: # a terminal opened earlier, an id opened in the same response is unknown yet
+        return TerminalManager().id_to_name.get(args["id"])
+    return None
+
+def get_resource_parts(tool_call: dict) -> list[str] | None:
+    """The files or the terminal of its resource that a call uses, or None when it may use all of it."""
+    name, args = tool_call["name"], tool_call.get("args", {}) or {}
+    if name in TOOL_PATH_ARGS:
+        paths = [args.get(arg) for arg in TOOL_PATH_ARGS[name]]
+        if not all(paths):
+            return None
+        return [Path(str(path)).expanduser().absolute().as_posix() for path in paths]
+    if name in SINGLE_TERMINAL_TOOL_NAMES:
+        terminal = _terminal_name(args)
+        return [terminal] if terminal is not None else None
+    return None
+
+def _parts_overlap(earlier: list[str] | None, later: list[str] | None) -> bool:
+    if earlier is None or later is None:
+        return True
+    return any(a == b or a.startswith(b.rstrip("/") + "/") or b.startswith(a.rstrip("/") + "/")
+               for a in earlier for b in later)
+
+def tool_calls_conflict(earlier: dict, later: dict) -> bool:
+    """Whether the `later` tool call has to wait for the `earlier` one of the same response."""
+    for name in (earlier["name"], later["name"]):
+        if not is_side_effect_free(name) and get_resource_key(name) is None:
+            return True
+    if is_side_effect_free(earlier["name"]) and is_side_effect_free(later["name"]):
+        return False
+    resource = get_resource_key(earlier["name"])
+    if resource is None or resource != get_resource_key(later["name"]):
+        return False
+    return _parts_overlap(get_resource_parts(earlier), get_resource_parts(later))
+
+__all__ = ['is_early_dispatch_tool', 'is_side_effect_free', 'get_resource_key', 'get_resource_parts', 'tool_calls_conflict']
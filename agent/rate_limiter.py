@@ -0,0 +1,248 @@
+import asyncio
+import random
+import re
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager, asynccontextmanager
+from email.utils import parsedate_to_datetime
+from loguru import logger
+from .config import RATE_LIMITS_CONFIG
+
+BACKOFF_MAX_SECONDS = 120
+BURST_SECONDS = 6 # a bucket holds this many seconds worth of its per-minute limits
+AIMD_DECREASE_FACTOR = 0.5
+AIMD_MIN_DECREASE_INTERVAL = 2.0 # seconds; rate limit errors of requests already in flight only count once
+AIMD_INCREASE_RPM = 1.0 # added to a lowered limit by every successful call
+PROVIDER_SLOT_POLL_SECONDS = 0.1
+
+def _parse_duration(value: str) -> float | None:
+    """Parse provider durations such as "20ms", "1s", "6m0s" or a plain number of seconds."""
+    value = str(value).strip()
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = re.findall(r"(\d+(?:\.\d+)?)(ms|s|m|h)", value)
+    if not parts:
+        return None
+    unit_seconds = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+    return sum(float(number) * unit_seconds[unit] for number, unit in parts)
+
+def parse_retry_after(headers) -> float | None:
+    if not headers:
+        return None
+    headers = {k.lower(): v for k, v in dict(headers).items()}
+    if "retry-after-ms" in headers:
+        duration = _parse_duration(headers["retry-after-ms"])
+        return duration / 1000 if duration is not None else None
+    if "retry-after" in headers:
+        duration = _parse_duration(headers["retry-after"])
+        if duration is not None:
+            return duration
+        try:
+            return max(0.0, parsedate_to_datetime(headers["retry-after"]).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+    return None
+
+def get_exception_headers(exception: Exception):
+    response = getattr(exception, "response", None)
+    return getattr(response, "headers", None)
+
+
+class TokenBucket:
+    """Request and token buckets of one (provider, model) pair.
+
+    Callers reserve capacity up front and sleep for the returned delay, so concurrent callers queue
+    behind each other instead of all firing once the limit resets. Limits start from config.yaml
+    (or unlimited), and are taken from rate limit response headers when the provider sends them.
+    Otherwise they follow AIMD: halved on a rate limit error, at most once per backoff window, and
+    raised by AIMD_INCREASE_RPM on every successful call until back at the configured or learned limit.
+    """
+    def __init__(self, key: str, rpm: float | None = None, tpm: float | None = None):
+        self.key = key
+        self.rpm = rpm
+        self.tpm = tpm
+        self.limit_rpm = rpm # configured or learned, what additive increase returns to
+        self._recovery_rpm = None # the rate before the first decrease, when no limit is known
+        self._decrease_window_end = 0.0
+        self._lock = threading.Lock()
+        self._request_tat = 0.0 # theoretical arrival time of the next request, as in GCRA
+        self._token_tat = 0.0
+        self._blocked_until = 0.0
+        self._recent_requests = deque()
+        self.stats = {"requests": 0, "throttled_requests": 0, "throttled_seconds": 0.0, "rate_limit_errors": 0,
+                      "rate_decreases": 0}
+
+    def reserve(self, estimated_tokens: int = 0) -> float:
+        """Reserve one request and `estimated_tokens` tokens. Returns how long the caller has to wait."""
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._blocked_until)
+            if self.rpm:
+                start = max(start, self._request_tat - BURST_SECONDS)
+                self._request_tat = max(self._request_tat, start) + 60.0 / self.rpm
+            if self.tpm and estimated_tokens:
+                start = max(start, self._token_tat - BURST_SECONDS)
+                self._token_tat = max(self._token_tat, start) + 60.0 * estimated_tokens / self.tpm
+            self._recent_requests.append(start)
+            while self._recent_requests and self._recent_requests[0] < now - 60:
+                self._recent_requests.popleft()
+            wait = start - now
+            self.stats["requests"] += 1
+            if wait > 0:
+                self.stats["throttled_requests"] += 1
+                self.stats["throttled_seconds"] += wait
+            return wait
+
+    def adjust_tokens(self, token_delta: int):
+        """Correct a reservation once the real token usage of a call is known."""
+        if not self.tpm or not token_delta:
+            return
+        with self._lock:
+            self._token_tat = max(time.monotonic(), self._token_tat + 60.0 * token_delta / self.tpm)
+
+    def block_for(self, seconds: float):
+        with self._lock:
+            self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+
+    def on_rate_limit_error(self, headers=None, backoff_seconds: float = 0.0):
+        """`backoff_seconds` is how long the failed call waits before its retry. Errors within that
+        window (at least AIMD_MIN_DECREASE_INTERVAL) come from requests sent before the decrease."""
+        with self._lock:
+            self.stats["rate_limit_errors"] += 1
+            if headers and self._learn_from_headers(headers):
+                return
+            now = time.monotonic()
+            if now < self._decrease_window_end:
+                return
+            self._decrease_window_end = now + max(backoff_seconds, AIMD_MIN_DECREASE_INTERVAL)
+            # no limit headers: multiplicative decrease from what we have been sending
+            observed_rpm = max(1, len(self._recent_requests))
+            if self.limit_rpm is None and self._recovery_rpm is None:
+                self._recovery_rpm = float(observed_rpm)
+            self.rpm = max(1.0, min(self.rpm or observed_rpm, observed_rpm) * AIMD_DECREASE_FACTOR)
+            self.stats["rate_decreases"] += 1
+            logger.info(f"Rate limiter {self.key}: lowering limit to {self.rpm:.1f} requests/min")
+
+    def on_success(self):
+        """Additive increase of a limit lowered by `on_rate_limit_error`."""
+        with self._lock:
+            target = self.limit_rpm or self._recovery_rpm
+            if self.rpm is None or target is None or self.rpm >= target:
+                return
+            self.rpm = min(target, self.rpm + AIMD_INCREASE_RPM)
+            if self.rpm >= target:
+                self.rpm, self._recovery_rpm = self.limit_rpm, None # None: unlimited again
+                logger.info(f"Rate limiter {self.key}: limit recovered to {self.rpm or 'unlimited'} requests/min")
+
+    def update_from_headers(self, headers):
+        with self._lock:
+            self._learn_from_headers(headers)
+
+    def _learn_from_headers(self, headers) -> bool:
+        headers = {k.lower(): v for k, v in dict(headers).items()}
+        learned = False
+        for prefix in ("x-ratelimit", "anthropic-ratelimit"):
+            rpm = headers.get(f"{prefix}-limit-requests") or headers.get(f"{prefix}-requests-limit")
+            tpm = headers.get(f"{prefix}-limit-tokens") or headers.get(f"{prefix}-tokens-limit")
+            if rpm and _parse_duration(rpm):
+                self.rpm = self.limit_rpm = _parse_duration(rpm)
+                self._recovery_rpm, learned = None, True
+            if tpm and _parse_duration(tpm):
+                self.tpm, learned = _parse_duration(tpm), True
+            remaining = headers.get(f"{prefix}-remaining-requests") or headers.get(f"{prefix}-requests-remaining")
+            reset = headers.get(f"{prefix}-reset-requests")
+            if remaining is not None and _parse_duration(remaining) == 0 and reset:
+                reset_seconds = _parse_duration(reset)
+                if reset_seconds:
+                    self._blocked_until = max(self._blocked_until, time.monotonic() + reset_seconds)
+        return learned
+
+
+class RateLimiter:
+    """Process-wide registry of token buckets, shared by threads and asyncio tasks."""
+    _instance = None
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super().__new__(cls)
+            cls._instance.buckets = {}
+            cls._instance.provider_slots = {}
+            cls._instance._lock = threading.Lock()
+        return cls._instance
+
+    def __init__(self):
+        pass
+
+    def get_bucket(self, provider: str, model_name: str) -> TokenBucket:
+        key = f"{provider}/{model_name}"
+        with self._lock:
+            if key not in self.buckets:
+                limits = RATE_LIMITS_CONFIG.get(model_name) or RATE_LIMITS_CONFIG.get(provider) or RATE_LIMITS_CONFIG.get("default") or {}
+                self.buckets[key] = TokenBucket(key, rpm=limits.get("rpm"), tpm=limits.get("tpm"))
+            return self.buckets[key]
+
+    def acquire(self, bucket: TokenBucket, estimated_tokens: int = 0):
+        wait = bucket.reserve(estimated_tokens)
+        if wait > 0:
+            logger.info(f"Rate limiter {bucket.key}: waiting {wait:.2f}s")
+            time.sleep(wait)
+
+    async def aacquire(self, bucket: TokenBucket, estimated_tokens: int = 0):
+        wait = bucket.reserve(estimated_tokens)
+        if wait > 0:
+            logger.info(f"Rate limiter {bucket.key}: waiting {wait:.2f}s")
+            await asyncio.sleep(wait)
+
+    def set_provider_slots(self, provider_slots: dict):
+        """Cap concurrent requests per provider with semaphores, which may be shared with other processes
+        (e.g. the workers of `main.py batch`)."""
+        self.provider_slots = provider_slots
+
+    @contextmanager
+    def provider_slot(self, bucket: TokenBucket):
+        """Hold one of the provider's slots for the duration of a request, if the provider is capped."""
+        slots = self.provider_slots.get(bucket.key.partition("/")[0])
+        if slots is None:
+            yield
+            return
+        if not slots.acquire(block=False):
+            logger.info(f"Provider cap {bucket.key}: waiting for a free slot")
+            slots.acquire()
+        try:
+            yield
+        finally:
+            slots.release()
+
+    @asynccontextmanager
+    async def aprovider_slot(self, bucket: TokenBucket):
+        slots = self.provider_slots.get(bucket.key.partition("/")[0])
+        if slots is None:
+            yield
+            return
+        if not slots.acquire(block=False):
+            logger.info(f"Provider cap {bucket.key}: waiting for a free slot")
+            while not slots.acquire(block=False): # a process-shared semaphore cannot be awaited
+                await asyncio.sleep(PROVIDER_SLOT_POLL_SECONDS)
+        try:
+            yield
+        finally:
+            slots.release()
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {key: {**bucket.stats, "rpm": bucket.rpm, "limit_rpm": bucket.limit_rpm, "tpm": bucket.tpm}
+                    for key, bucket in self.buckets.items()}
+
+
+def compute_backoff(attempt: int, base_seconds: float, retry_after: float | None = None) -> float:
+    """Jittered exponential backoff, or the provider's Retry-After plus jitter when it sent one."""
+    if retry_after is not None:
+        return min(BACKOFF_MAX_SECONDS, retry_after + random.uniform(0, base_seconds))
+    backoff = min(BACKOFF_MAX_SECONDS, base_seconds * 2 ** (attempt - 1))
+    return backoff / 2 + random.uniform(0, backoff / 2)
+
+
+__all__ = ["RateLimiter", "TokenBucket", "compute_backoff", "get_exception_headers", "parse_retry_after"]
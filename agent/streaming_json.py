@@ -0,0 +1,108 @@
+import json
+from loguru import logger
+
+class ToolCallStreamParser:
+    """Incrementally scans a streamed `{"thoughts": ..., "tool_calls": [...]}` response and returns
+    each tool call as soon as its JSON object closes, long before the whole response is parsed.
+
+    The scan only tracks strings, escapes and bracket nesting, so it is linear in the response
+    length. A `<think>...</think>` prefix or a ```json fence before the object is skipped. Anything
+    the scanner cannot make sense of is simply not reported early; the full response is still
+    parsed with `parse_json_response` afterwards.
+    """
+    def __init__(self, array_key: str = "tool_calls"):
+        self.array_key = array_key
+        self.buffer = ""
+        self._pos = 0
+        self._started = False
+        self._stack = []
+        self._in_string = False
+        self._escape = False
+        self._string_start = None
+        self._last_string = None
+        self._expecting_key = False
+        self._current_key = None
+        self._in_array = False
+        self._object_start = None
+        self.tool_call_count = 0
+
+    def feed(self, text: str) -> list[dict]:
+        self.buffer += text
+        if not self._started and not self._find_start():
+            return []
+        completed = []
+        buffer = self.buffer
+        for i in range(self._pos, len(buffer)):
+            char = buffer[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+                    if len(self._stack) == 1 and self._expecting_key:
+                        self._last_string = buffer[self._string_start + 1:i]
+                continue
+            if char == '"':
+                self._in_string = True
+                self._string_start = i
+            elif char in "{[":
+                if char == "[" and len(self._stack) == 1 and self._current_key == self.array_key:
+                    self._in_array = True
+                if char == "{" and self._in_array and len(self._stack) == 2:
+                    self._object_start = i
+                self._stack.append(char)
+                if len(self._stack) == 1:
+                    self._expecting_key = True
+            elif char in "}]":
+                if not self._stack:
+                    continue
+                self._stack.pop()
+                if char == "}" and self._in_array and len(self._stack) == 2 and self._object_start is not None:
+                    tool_call = self._decode(buffer[self._object_start:i + 1])
+                    if tool_call is not None:
+                        completed.append(tool_call)
+                    self._object_start = None
+                elif char == "]" and self._in_array and len(self._stack) == 1:
+                    self._in_array = False
+            elif len(self._stack) == 1:
+                if char == ":":
+                    self._expecting_key = False
+                    self._current_key = self._last_string
+                elif char == ",":
+                    self._expecting_key = True
+        self._pos = len(buffer)
+        self.tool_call_count += len(completed)
+        return completed
+
+    def _find_start(self) -> bool:
+        offset = 0
+        stripped = self.buffer.lstrip()
+        if stripped.startswith("<think>"):
+            think_end = self.buffer.find("</think>")
+            if think_end == -1:
+                return False
+            offset = think_end + len("</think>")
+        elif "<think>".startswith(stripped):
+            return False # not enough text yet to tell
+        start = self.buffer.find("{", offset)
+        if start == -1:
+            return False
+        self._pos = start
+        self._started = True
+        return True
+
+    @staticmethod
+    def _decode(text: str) -> dict | None:
+        try:
+            tool_call = json.loads(text)
+        except json.JSONDecodeError:
+            logger.debug(f"Could not decode streamed tool call early: {text}")
+            return None
+        if not isinstance(tool_call, dict) or "name" not in tool_call:
+            return None
+        return tool_call
+
+
+__all__ = ["ToolCallStreamParser"]
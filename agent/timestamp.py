@@ -17,4 +17,9 @@ def get_current_run_timestamp(include_milliseconds=False):
         _current_run_timestamp = get_current_timestamp(include_milliseconds)
     return _current_run_timestamp
 
-__all__ = ['get_current_run_timestamp', 'get_current_timestamp']
\ No newline at end of file
+def set_current_run_timestamp(run_timestamp: str):
+    """Continue an earlier run (e.g. when resuming it from a checkpoint), so its logs and artifacts stay together."""
+    global _current_run_timestamp
+    _current_run_timestamp = run_timestamp
+
+__all__ = ['get_current_run_timestamp', 'get_current_timestamp', 'set_current_run_timestamp']
\ No newline at end of file
@@ -0,0 +1,157 @@
+import inspect
+import json
+import os
+import threading
+from collections import OrderedDict
+from functools import wraps
+from pathlib import Path
+from loguru import logger
+from .config import TOOL_CACHE_CONFIG
+from .usage import register_metrics_source
+
+TOOL_CACHE_ENABLE = TOOL_CACHE_CONFIG.get("enable", False)
+MAX_ENTRIES = TOOL_CACHE_CONFIG.get("max_entries", 256)
+
+def normalize_path(path) -> str:
+    return Path(path).expanduser().absolute().as_posix()
+
+def file_identity(path: str) -> tuple | None:
+    """What has to stay the same for a cached result of `path` to be reused: size, mtime and inode."""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_size, stat.st_mtime_ns, stat.st_ino)
+
+def tree_identity(path: str, arguments: dict) -> tuple | None:
+    """Identity of a directory tree as `get_file_tree` lists it: the mtimes of all directories down to
+    one level below `max_depth` (-1 for all), whose contents or emptiness the tree shows. Sorted by
+    modification time, also the mtimes of the files listed."""
+    identity = file_identity(path)
+    if identity is None:
+        return None
+    max_depth, by_mtime = arguments.get("max_depth", 2), arguments.get("sort_by") == "modified"
+    mtimes = []
+    def scan(directory: str, depth: int):
+        try:
+            with os.scandir(directory) as entries:
+                entries = list(entries)
+        except OSError:
+            return
+        for entry in entries:
+            try:
+                is_dir = entry.is_dir()
+                if is_dir or by_mtime:
+                    mtimes.append((entry.path, entry.stat().st_mtime_ns))
+            except OSError:
+                continue
+            if is_dir and (max_depth == -1 or depth < max_depth):
+                scan(entry.path, depth + 1)
+    scan(path, 1)
+    return identity + (tuple(sorted(mtimes)),)
+
+def _is_within(path: str, parent: str) -> bool:
+    return path == parent or path.startswith(parent.rstrip("/") + "/")
+
+
+class ToolResultCache:
+    """In-memory LRU cache of read-only tool results, keyed by the tool, its normalized arguments and the
+    identity of the file or directory it reads. Writes through `write_file`, `rename_file` and
+    `convert_pdf2md` invalidate the entries of the paths they touch, terminal commands the directory trees."""
+    _instance = None
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super().__new__(cls)
+            cls._instance.entries = OrderedDict()
+            cls._instance.stats = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0, "invalidations": 0}
+            cls._instance._lock = threading.Lock()
+        return cls._instance
+
+    def __init__(self):
+        pass
+
+    @staticmethod
+    def make_key(tool_name: str, path: str, args: dict) -> str:
+        return json.dumps({"tool": tool_name, "path": path, "args": args}, sort_keys=True, ensure_ascii=False, default=str)
+
+    def get(self, key: str, identity: tuple | None):
+        """The cached result, or None on a miss. An entry whose file changed since it was stored is dropped."""
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[1] != identity:
+                if entry is not None:
+                    del self.entries[key]
+                self.stats["misses"] += 1
+                return None
+            self.entries.move_to_end(key)
+            self.stats["hits"] += 1
+            return entry[2]
+
+    def put(self, key: str, path: str, identity: tuple | None, result):
+        with self._lock:
+            self.entries[key] = (path, identity, result)
+            self.entries.move_to_end(key)
+            self.stats["stores"] += 1
+            while len(self.entries) > MAX_ENTRIES:
+                self.entries.popitem(last=False)
+                self.stats["evictions"] += 1
+
+    def invalidate(self, path):
+        """Drop the entries of `path`, of everything under it, and the trees of the directories containing it."""
+        path = normalize_path(path)
+        with self._lock:
+            stale = [key for key, (entry_path, _, _) in self.entries.items()
+                     if _is_within(entry_path, path) or _is_within(path, entry_path)]
+            for key in stale:
+                del self.entries[key]
+            self.stats["invalidations"] += len(stale)
+        if stale:
+            logger.info(f"Tool result cache invalidated {len(stale)} entries for {path}")
+
+    def invalidate_directories(self):
+        with self._lock:
+            stale = [key for key, (entry_path, _, _) in self.entries.items() if os.path.isdir(entry_path)]
+            for key in stale:
+                del self.entries[key]
+            self.stats["invalidations"] += len(stale)
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            lookups = self.stats["hits"] + self.stats["misses"]
+            return dict(self.stats, entries=len(self.entries), hit_rate=round(self.stats["hits"] / lookups, 3) if lookups else None)
+
+register_metrics_source("tool_cache", lambda: ToolResultCache().get_stats())
+
+
+def cached_tool(path_arg: str, identity_func=None):
+    """Memoize a read-only tool function on its arguments and the identity of the path in `path_arg`,
+    `file_identity` unless `identity_func(path, arguments)` is given.
+    Goes below `@tool`, so the tool keeps the function's signature and docstring."""
+    def decorator(func):
+        signature = inspect.signature(func)
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not TOOL_CACHE_ENABLE:
+                return func(*args, **kwargs)
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            arguments = dict(bound.arguments)
+            path = normalize_path(arguments.pop(path_arg))
+            key = ToolResultCache.make_key(func.__name__, path, arguments)
+            # taken before the call, so a file that changes while it is read is not cached as the new version
+            identity = identity_func(path, arguments) if identity_func else file_identity(path)
+            cache = ToolResultCache()
+            result = cache.get(key, identity)
+            if result is not None:
+                logger.info(f"{func.__name__} result for {path} taken from the tool result cache")
+                return result
+            result = func(*args, **kwargs)
+            cache.put(key, path, identity, result)
+            return result
+        return wrapper
+    return decorator
+
+
+__all__ = ["ToolResultCache", "cached_tool", "file_identity", "tree_identity", "normalize_path", "TOOL_CACHE_ENABLE"]
@@ -8,6 +8,7 @@ from . import ocr
 from . import terminals
 from . import notify_supervisor
 from . import pdf2md
+from . import tool_results
 
 __all__ = ['files', 
            'browser', 
@@ -22,6 +23,7 @@ __all__ = ['files',
            'time',
            'ocr',
            'terminals',
-           'pdf2md'
+           'pdf2md',
+           'tool_results'
            ]
 
@@ -0,0 +1,184 @@
+import hashlib
+import sqlite3
+import threading
+import time
+from pathlib import Path
+import numpy as np
+from loguru import logger
+from ..config import MEMORY_EMBEDDINGS_CONFIG
+from ..usage import register_metrics_source
+
+EMBEDDING_CACHE_ENABLE = MEMORY_EMBEDDINGS_CONFIG.get("cache", True)
+EMBEDDING_CACHE_PATH = Path(MEMORY_EMBEDDINGS_CONFIG.get("cache_path", "data/cache/embeddings.sqlite"))
+EMBEDDING_CACHE_MAX_ENTRIES = MEMORY_EMBEDDINGS_CONFIG.get("cache_max_entries", 100000)
+# how long the first of concurrent embed requests waits for others to join its batch
+EMBEDDING_BATCH_WAIT_SECONDS = MEMORY_EMBEDDINGS_CONFIG.get("batch_wait_ms", 5) / 1000
+
+def embedding_key(model: str, input_type: str, text: str) -> str:
+    return hashlib.sha256(f"{model}\0{input_type}\0{text}".encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """Persistent cache of embeddings, keyed by (model, input type, text hash) and stored as float32
+    bytes in SQLite. The least recently used entries are evicted beyond `cache_max_entries`."""
+    _instance = None
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super().__new__(cls)
+            cls._instance.enabled = EMBEDDING_CACHE_ENABLE
+            cls._instance.path = EMBEDDING_CACHE_PATH
+            cls._instance.max_entries = EMBEDDING_CACHE_MAX_ENTRIES
+            cls._instance.stats = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+            cls._instance._conn = None
+            cls._instance._lock = threading.Lock()
+        return cls._instance
+
+    def __init__(self):
+        pass
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30) # shared by batch workers
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, model TEXT, vector BLOB, accessed_at REAL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS embeddings_accessed_at ON embeddings (accessed_at)")
+            self._conn.commit()
+            logger.info(f"Embedding cache opened at {self.path.absolute().as_posix()}")
+        return self._conn
+
+    def get_many(self, model: str, input_type: str, texts: list[str]) -> list[np.ndarray | None]:
+        if not self.enabled or not texts:
+            return [None] * len(texts)
+        keys = [embedding_key(model, input_type, text) for text in texts]
+        placeholders = ", ".join("?" * len(set(keys)))
+        with self._lock:
+            conn = self._connection()
+            found = dict(conn.execute(f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})",
+                                      list(set(keys))).fetchall())
+            if found:
+                conn.executemany("UPDATE embeddings SET accessed_at = ? WHERE key = ?",
+                                 [(time.time(), key) for key in found])
+                conn.commit()
+            hits = sum(key in found for key in keys)
+            self.stats["hits"] += hits
+            self.stats["misses"] += len(keys) - hits
+        return [np.frombuffer(found[key], dtype=np.float32) if key in found else None for key in keys]
+
+    def put_many(self, model: str, input_type: str, texts: list[str], vectors: list):
+        if not self.enabled or not texts:
+            return
+        now = time.time()
+        rows = [(embedding_key(model, input_type, text), model, np.asarray(vector, dtype=np.float32).tobytes(), now)
+                for text, vector in zip(texts, vectors)]
+        with self._lock:
+            conn = self._connection()
+            conn.executemany("INSERT OR REPLACE INTO embeddings (key, model, vector, accessed_at) VALUES (?, ?, ?, ?)", rows)
+            self.stats["stores"] += len(rows)
+            excess = conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0] - self.max_entries
+            if excess > 0:
+                conn.execute("DELETE FROM embeddings WHERE key IN "
+                             "(SELECT key FROM embeddings ORDER BY accessed_at ASC LIMIT ?)", (excess,))
+                self.stats["evictions"] += excess
+            conn.commit()
+
+    def get_stats(self) -> dict:
+        return dict(self.stats)
+
+    def clear(self):
+        with self._lock:
+            conn = self._connection()
+            conn.execute("DELETE FROM embeddings")
+            conn.commit()
+
+
+class _EmbedRequest:
+    def __init__(self, texts: list[str], input_type: str):
+        self.texts = texts
+        self.input_type = input_type
+        self.vectors = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class EmbeddingBatcher:
+    """Embeds texts of one model through the embedding cache, and combines the requests of concurrent
+    callers (e.g. the retrievals of fanned-out agents) into one call of `embed_batch(texts, input_type)`.
+    The first caller waits `batch_wait_ms` for others to join, then embeds for all of them; batches
+    are split at `max_batch_size` texts, the provider's limit per request."""
+
+    def __init__(self, model: str, embed_batch, max_batch_size: int = 96):
+        self.model = model
+        self.embed_batch = embed_batch
+        self.max_batch_size = max_batch_size
+        self.cache = EmbeddingCache()
+        self.stats = {"texts": 0, "cached": 0, "requests": 0, "calls": 0, "embedded": 0}
+        self._pending = []
+        self._leading = False
+        self._lock = threading.Lock()
+        _batchers.append(self)
+
+    def embed(self, texts: list[str], input_type: str = "passage") -> list[np.ndarray]:
+        vectors = self.cache.get_many(self.model, input_type, texts)
+        missing = list(dict.fromkeys(text for text, vector in zip(texts, vectors) if vector is None))
+        with self._lock:
+            self.stats["texts"] += len(texts)
+            self.stats["cached"] += sum(vector is not None for vector in vectors)
+        if missing:
+            request = _EmbedRequest(missing, input_type)
+            with self._lock:
+                self.stats["requests"] += 1
+                self._pending.append(request)
+                lead, self._leading = not self._leading, True
+            if lead:
+                time.sleep(EMBEDDING_BATCH_WAIT_SECONDS)
+                with self._lock:
+                    batch, self._pending, self._leading = self._pending, [], False
+                self._run(batch)
+            request.done.wait()
+            if request.error is not None:
+                raise request.error
+            embedded = dict(zip(missing, request.vectors))
+            vectors = [embedded[text] if vector is None else vector for text, vector in zip(texts, vectors)]
+        return vectors
+
+    def _run(self, batch: list[_EmbedRequest]):
+        for input_type in dict.fromkeys(request.input_type for request in batch):
+            requests = [request for request in batch if request.input_type == input_type]
+            try:
+                texts = list(dict.fromkeys(text for request in requests for text in request.texts))
+                vectors = []
+                for start in range(0, len(texts), self.max_batch_size):
+                    chunk = texts[start:start + self.max_batch_size]
+                    vectors.extend(np.asarray(vector, dtype=np.float32) for vector in self.embed_batch(chunk, input_type))
+                    with self._lock:
+                        self.stats["calls"] += 1
+                        self.stats["embedded"] += len(chunk)
+                self.cache.put_many(self.model, input_type, texts, vectors)
+                embedded = dict(zip(texts, vectors))
+                for request in requests:
+                    request.vectors = [embedded[text] for text in request.texts]
+            except Exception as e:
+                for request in requests:
+                    request.error = e
+            finally:
+                for request in requests:
+                    request.done.set()
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {"model": self.model, **self.stats}
+
+
+_batchers: list[EmbeddingBatcher] = []
+
+def get_embedding_stats() -> dict:
+    return {"cache": EmbeddingCache().get_stats(), "batchers": [batcher.get_stats() for batcher in _batchers]}
+
+register_metrics_source("embeddings", get_embedding_stats)
+
+
+__all__ = ["EmbeddingCache", "EmbeddingBatcher", "embedding_key"]
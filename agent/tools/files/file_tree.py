@@ -3,8 +3,10 @@ import os
 from typing import Literal
 from langchain_core.tools import tool
 from loguru import logger
+from ...tool_cache import cached_tool, tree_identity
 
 @tool
+@cached_tool("root_path", tree_identity)
 def get_file_tree(root_path: str, 
                   max_depth: int = 2, 
                   max_file_each_folder: int = 20, 
@@ -4,8 +4,10 @@ from typing import Literal, Optional
 from langchain_core.tools import tool
 from loguru import logger
 import mimetypes
+from ...tool_cache import ToolResultCache, cached_tool
 
 @tool
+@cached_tool("filepath")
 def read_file(filepath: str, 
               line_number: bool = True,
               ) -> str:
@@ -36,7 +38,7 @@ def read_file(filepath: str,
             content = ''.join([f'{idx+1:{num_digits}d}: {line}' for idx, line in enumerate(lines)])
         else:
             content = ''.join(lines)
-    logger.info(f'File read successfully: "{path.as_posix()}", content: {content}')
+    logger.info(f'File read successfully: "{path.as_posix()}", {len(lines)} lines, {len(content)} characters')
     return content
 
 @tool
@@ -70,6 +72,7 @@ def write_file(filepath: str,
         overwritten = False
     with open(filepath, mode, encoding="utf-8") as file:
         file.write(content)
+    ToolResultCache().invalidate(filepath)
     logger.info(f'File written (overwritten: {overwritten}) successfully: "{filepath}" with content: {content}')
     if overwritten:
         return f'File overwritten successfully: "{filepath}"'
@@ -109,6 +112,8 @@ def rename_file(filepath: str, new_name: str):
     filepath = Path(filepath).expanduser().absolute().as_posix()
     logger.info(f"Trying to rename file: {filepath} to {new_name}")
     os.rename(filepath, new_name)
+    ToolResultCache().invalidate(filepath)
+    ToolResultCache().invalidate(new_name)
     logger.info(f"File renamed successfully: {filepath} to {new_name}")
     return f"File renamed successfully: {filepath} to {new_name}"
 
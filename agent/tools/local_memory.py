@@ -0,0 +1,273 @@
+import hashlib
+import re
+import sqlite3
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+import numpy as np
+from loguru import logger
+from ..config import MEMORY_LOCAL_CONFIG, MEMORY_ENABLE_PINECONE_UPDATE
+from ..timestamp import get_current_timestamp
+from .memory_backend import MemoryBackend
+from .embeddings import EmbeddingBatcher
+
+LOCAL_MEMORY_DIR = Path(MEMORY_LOCAL_CONFIG.get("path", "data/memory"))
+# a sentence-transformers model, or "hashing" for the dependency-free hashed bag of words
+EMBEDDING_MODEL = MEMORY_LOCAL_CONFIG.get("embedding_model", "intfloat/multilingual-e5-small")
+HASHING_DIMENSION = MEMORY_LOCAL_CONFIG.get("hashing_dimension", 1024)
+SCORE_THRESHOLD = MEMORY_LOCAL_CONFIG.get("score_threshold", None) # defaults to the embedder's
+INITIAL_CAPACITY = 1024 # rows of the vector file, doubled whenever it is full
+REEMBED_BATCH_SIZE = 64
+
+SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS memories (id TEXT PRIMARY KEY, row INTEGER NOT NULL UNIQUE, content TEXT NOT NULL, updated TEXT)",
+    "CREATE TABLE IF NOT EXISTS free_rows (row INTEGER PRIMARY KEY)",
+    "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value)",
+]
+
+
+class HashingEmbedder:
+    """Embeddings without a model: signed counts of words and character trigrams, hashed into a fixed
+    number of dimensions. Only catches lexical overlap, but runs anywhere and is deterministic."""
+    default_score_threshold = 0.3
+
+    def __init__(self, dimension: int = HASHING_DIMENSION):
+        self.dimension = dimension
+        self.name = f"hashing-{dimension}"
+
+    def _features(self, text: str) -> list[str]:
+        words = re.findall(r"\w+", text.lower())
+        return words + [f"#{word[i:i + 3]}" for word in words for i in range(max(1, len(word) - 2))]
+
+    def embed(self, texts: list[str], input_type: str = "passage") -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dimension), dtype=np.float32)
+        for i, text in enumerate(texts):
+            for feature in self._features(text):
+                digest = int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "little")
+                vectors[i, digest % self.dimension] += 1.0 if digest >> 63 else -1.0
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.where(norms == 0, 1, norms)
+
+
+class SentenceTransformerEmbedder:
+    """A local sentence-transformers model (pip install sentence-transformers), downloaded on first use."""
+    default_score_threshold = 0.8 # as for the e5 embeddings of the Pinecone backend
+
+    def __init__(self, model_name: str):
+        from sentence_transformers import SentenceTransformer
+        self.model = SentenceTransformer(model_name)
+        self.name = model_name
+        self.dimension = self.model.get_sentence_embedding_dimension()
+        self.prefix_input_type = "e5" in model_name.lower() # e5 models expect "query: " and "passage: "
+
+    def embed(self, texts: list[str], input_type: str = "passage") -> np.ndarray:
+        if self.prefix_input_type:
+            texts = [f"{input_type}: {text}" for text in texts]
+        return self.model.encode(texts, normalize_embeddings=True, convert_to_numpy=True).astype(np.float32)
+
+def get_embedder():
+    if EMBEDDING_MODEL == "hashing":
+        return HashingEmbedder()
+    try:
+        return SentenceTransformerEmbedder(EMBEDDING_MODEL)
+    except ImportError:
+        logger.warning(f"sentence-transformers is not installed, local memories are embedded by hashing instead of {EMBEDDING_MODEL}")
+        return HashingEmbedder()
+
+
+class LocalMemoryManager(MemoryBackend):
+    """Long-term memory on disk: unit-length embeddings in a memory-mapped float32 matrix (`vectors.f32`,
+    one row per memory) and ids, contents and row numbers in SQLite (`memories.sqlite`). A search is
+    one matrix-vector product over the stored rows. Writes hold a SQLite write lock, and every process
+    reloads the row table when the version counter changed, so batch workers can share the directory.
+    Memories are embedded again when the embedding model changes."""
+    _instance = None
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super().__new__(cls)
+            cls._instance.embedder = get_embedder()
+            cls._instance.embeddings = EmbeddingBatcher(cls._instance.embedder.name, cls._instance.embedder.embed, REEMBED_BATCH_SIZE)
+            cls._instance.score_threshold = SCORE_THRESHOLD if SCORE_THRESHOLD is not None else cls._instance.embedder.default_score_threshold
+            cls._instance._lock = threading.RLock()
+            cls._instance._open()
+        return cls._instance
+
+    def __init__(self):
+        pass
+
+    def _open(self):
+        LOCAL_MEMORY_DIR.mkdir(parents=True, exist_ok=True)
+        self.vectors_path = LOCAL_MEMORY_DIR / "vectors.f32"
+        self.conn = sqlite3.connect(LOCAL_MEMORY_DIR / "memories.sqlite", check_same_thread=False, timeout=30,
+                                    isolation_level=None) # transactions are explicit
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        for statement in SCHEMA:
+            self.conn.execute(statement)
+        self.version = None
+        self.vectors = None
+        with self._transaction():
+            if self._get_meta("embedder") != self.embedder.name:
+                self._reembed_all()
+        logger.info(f"Local memory: {len(self.row_ids)} memories in {LOCAL_MEMORY_DIR.absolute().as_posix()}, "
+                    f"embedded with {self.embedder.name}")
+
+    def _get_meta(self, key: str, default=None):
+        row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return default if row is None else row[0]
+
+    def _set_meta(self, key: str, value):
+        self.conn.execute("INSERT INTO meta (key, value) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value = excluded.value", (key, value))
+
+    def _open_vectors(self):
+        rows = self.vectors_path.stat().st_size // (4 * self.embedder.dimension) if self.vectors_path.exists() else 0
+        self.vectors = np.memmap(self.vectors_path, dtype=np.float32, mode="r+", shape=(rows, self.embedder.dimension)) if rows else None
+
+    def _refresh(self):
+        """Reload the row table and the vector file if another process (or a write here) changed them."""
+        version = self._get_meta("version", 0)
+        if version == self.version:
+            return
+        entries = self.conn.execute("SELECT id, row FROM memories ORDER BY row").fetchall()
+        self.row_ids = [memory_id for memory_id, _ in entries]
+        self.rows = np.array([row for _, row in entries], dtype=np.int64)
+        self._open_vectors()
+        self.version = version
+
+    @contextmanager
+    def _transaction(self):
+        with self._lock:
+            self.conn.execute("BEGIN IMMEDIATE") # also keeps out writers in other processes
+            try:
+                self._refresh()
+                yield
+                if self.vectors is not None:
+                    self.vectors.flush()
+                self._set_meta("version", self._get_meta("version", 0) + 1)
+                self.conn.execute("COMMIT")
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+            finally:
+                self.version = None # reload after every write, the rows changed
+            self._refresh()
+
+    def _ensure_capacity(self, row: int):
+        capacity = 0 if self.vectors is None else self.vectors.shape[0]
+        if row < capacity:
+            return
+        capacity = max(INITIAL_CAPACITY, 2 * capacity, row + 1)
+        if self.vectors is not None:
+            self.vectors.flush()
+            self.vectors = None # unmapped first, Windows does not resize mapped files
+        with open(self.vectors_path, "ab") as f: # rows are appended, existing ones stay where they are
+            f.truncate(capacity * 4 * self.embedder.dimension)
+        self._open_vectors()
+
+    def _allocate_row(self) -> int:
+        row = self.conn.execute("SELECT MIN(row) FROM free_rows").fetchone()[0]
+        if row is not None:
+            self.conn.execute("DELETE FROM free_rows WHERE row = ?", (row,))
+            return row
+        row = self._get_meta("next_row", 0)
+        self._set_meta("next_row", row + 1)
+        return row
+
+    def _store(self, id: str, content: str, vector: np.ndarray):
+        existing = self.conn.execute("SELECT row FROM memories WHERE id = ?", (id,)).fetchone()
+        row = existing[0] if existing else self._allocate_row()
+        self._ensure_capacity(row)
+        self.vectors[row] = vector
+        self.conn.execute("INSERT INTO memories (id, row, content, updated) VALUES (?, ?, ?, ?) "
+                          "ON CONFLICT(id) DO UPDATE SET content = excluded.content, updated = excluded.updated",
+                          (id, row, content, get_current_timestamp()))
+
+    def _reembed_all(self):
+        entries = self.conn.execute("SELECT id, content FROM memories ORDER BY row").fetchall()
+        if entries:
+            logger.info(f"Embedding {len(entries)} local memories with {self.embedder.name}")
+        self.vectors = None
+        self.vectors_path.unlink(missing_ok=True) # the dimension may have changed
+        self.conn.execute("DELETE FROM free_rows")
+        self.conn.execute("UPDATE memories SET row = -row - 1") # free the row numbers for the renumbering below
+        self._ensure_capacity(max(len(entries) - 1, 0))
+        for start in range(0, len(entries), REEMBED_BATCH_SIZE):
+            batch = entries[start:start + REEMBED_BATCH_SIZE]
+            self.vectors[start:start + len(batch)] = np.stack(self.embeddings.embed([content for _, content in batch]))
+            self.conn.executemany("UPDATE memories SET row = ? WHERE id = ?",
+                                  [(start + i, memory_id) for i, (memory_id, _) in enumerate(batch)])
+        self.vectors.flush()
+        self._set_meta("next_row", len(entries))
+        self._set_meta("embedder", self.embedder.name)
+
+    def add_memory(self, memory: str, id: str = None):
+        logger.info(f"Adding memory: {memory}")
+        if not MEMORY_ENABLE_PINECONE_UPDATE:
+            logger.info("Memory update is disabled.")
+            return
+        id = id or get_current_timestamp(include_milliseconds=True)
+        if not self._defer_write(id, memory):
+            self.upsert_memories([{"id": id, "content": memory}])
+
+    def update_memory(self, id: str, content: str):
+        logger.info(f"Updating memory id: {id}, content: {content}")
+        if not MEMORY_ENABLE_PINECONE_UPDATE:
+            logger.info("Memory update is disabled.")
+            return
+        if not self._defer_write(id, content):
+            self.upsert_memories([{"id": id, "content": content}])
+
+    def upsert_memories(self, memories: list[dict]):
+        if not MEMORY_ENABLE_PINECONE_UPDATE:
+            logger.info("Memory update is disabled.")
+            return
+        vectors = self.embeddings.embed([memory["content"] for memory in memories])
+        with self._transaction():
+            for memory, vector in zip(memories, vectors):
+                self._store(memory["id"], memory["content"], vector)
+
+    def query_memory(self, query: str, top_k: int = 3, exclude_ids: set[str] = set()) -> list[dict]:
+        exclude_ids = set(exclude_ids or [])
+        query_vector = self.embeddings.embed([query], input_type="query")[0]
+        with self._lock:
+            self._refresh()
+            keep = [i for i, memory_id in enumerate(self.row_ids) if memory_id not in exclude_ids]
+            if not keep or top_k <= 0:
+                return []
+            rows, ids = self.rows[keep], [self.row_ids[i] for i in keep]
+            scores = self.vectors[rows] @ query_vector # cosine similarity, the rows have unit length
+        k = min(top_k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        matches = [(ids[i], float(scores[i])) for i in top if scores[i] >= self.score_threshold]
+        logger.info(f"Local memory query: \"{query}\"\n\n\nQuery results: {matches}")
+        if not matches:
+            return []
+        placeholders = ", ".join("?" * len(matches))
+        with self._lock:
+            contents = dict(self.conn.execute(f"SELECT id, content FROM memories WHERE id IN ({placeholders})",
+                                              [memory_id for memory_id, _ in matches]).fetchall())
+        return [{"id": memory_id, "content": contents[memory_id], "score": score} for memory_id, score in matches if memory_id in contents]
+
+    def delete_memory(self, id: str):
+        logger.info(f"Deleting memory id: {id}")
+        if not MEMORY_ENABLE_PINECONE_UPDATE:
+            logger.info("Memory update is disabled.")
+            return
+        self._drop_deferred(id)
+        with self._transaction():
+            existing = self.conn.execute("SELECT row FROM memories WHERE id = ?", (id,)).fetchone()
+            if existing is None:
+                return f"Memory not found. ID: {id}"
+            self.conn.execute("DELETE FROM memories WHERE id = ?", (id,))
+            self.conn.execute("INSERT INTO free_rows (row) VALUES (?)", existing)
+            self.vectors[existing[0]] = 0
+        return f"Memory deleted successfully. ID: {id}"
+
+    def fetch_all_memories(self) -> list[dict]:
+        with self._lock:
+            entries = self.conn.execute("SELECT id, content FROM memories ORDER BY row").fetchall()
+        return [{"id": memory_id, "content": content} for memory_id, content in entries]
+
+
+__all__ = ["LocalMemoryManager", "HashingEmbedder", "SentenceTransformerEmbedder"]
@@ -2,22 +2,36 @@ from langchain_core.tools import tool
 from loguru import logger
 from ..timestamp import get_current_timestamp
 import os
-from pinecone import Pinecone
 from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception_type
-from pinecone.core.openapi.shared.exceptions import ServiceException
-from agent.config import MEMORY_ENABLE_PINECONE_UPDATE
+from agent.config import MEMORY_ENABLE_PINECONE_UPDATE, MEMORY_BACKEND
+from .memory_backend import MemoryBackend
+from .embeddings import EmbeddingBatcher
+
+try:
+    from pinecone import Pinecone
+    from pinecone.core.openapi.shared.exceptions import ServiceException
+except ImportError: # only the pinecone backend needs it (pip install pinecone)
+    Pinecone = None
+    class ServiceException(Exception):
+        pass
 
 MEMORY_SCORE_THRESHOLD = 0.8
-logger.info(f"Pinecone memory update is {'enabled' if MEMORY_ENABLE_PINECONE_UPDATE else 'disabled'}")
+EMBEDDING_MODEL = "multilingual-e5-large"
+EMBED_BATCH_SIZE = 96 # inputs per inference.embed request of multilingual-e5-large
+UPSERT_BATCH_SIZE = 100 # vectors per upsert request, as recommended by Pinecone
+logger.info(f"Memory backend: {MEMORY_BACKEND}, memory update is {'enabled' if MEMORY_ENABLE_PINECONE_UPDATE else 'disabled'}")
 
-class PineconeMemoryManager:
+class PineconeMemoryManager(MemoryBackend):
     _instance = None
 
     def __new__(cls):
         if cls._instance is None:
+            if Pinecone is None:
+                raise ImportError("The pinecone memory backend needs the pinecone package, or set memory.backend to local in config.yaml")
             cls._instance = super().__new__(cls)
             cls._instance.pc = Pinecone(api_key=os.environ['PINECONE_API_KEY'])
             cls._instance.index = cls._instance.pc.Index("agent-long-term-memory")
+            cls._instance.embeddings = EmbeddingBatcher(EMBEDDING_MODEL, cls._instance._embed_batch, EMBED_BATCH_SIZE)
         return cls._instance
 
     def __init__(self):
@@ -28,34 +42,42 @@ class PineconeMemoryManager:
         wait=wait_exponential(multiplier=1, min=4, max=10),
         retry=retry_if_exception_type(ServiceException)
     )
-    def _embed_text(self, text, input_type="passage"):
-        """Helper method to embed text with retry logic"""
-        return self.pc.inference.embed(
-            model="multilingual-e5-large",
-            inputs=[text],
+    def _embed_batch(self, texts: list[str], input_type: str = "passage") -> list[list[float]]:
+        """One embedding request for up to EMBED_BATCH_SIZE texts, with retry logic"""
+        embeddings = self.pc.inference.embed(
+            model=EMBEDDING_MODEL,
+            inputs=texts,
             parameters={"input_type": input_type, "truncate": "END"}
         )
+        return [embedding['values'] for embedding in embeddings]
 
     def add_memory(self, memory:str, id:str=None):
-        logger.info(f"Embedding memory: {memory}")
-        embeddings = self._embed_text(memory)
-        logger.info(f"Upserting memory...")
+        logger.info(f"Adding memory: {memory}")
         if not MEMORY_ENABLE_PINECONE_UPDATE:
             logger.info("Memory update is disabled.")
             return
-        self.index.upsert(
-            vectors=[{"id": id or get_current_timestamp(include_milliseconds=True), "values": embeddings[0]['values'], "metadata": {"text": memory}}]
-        )
+        id = id or get_current_timestamp(include_milliseconds=True)
+        if not self._defer_write(id, memory):
+            self.upsert_memories([{"id": id, "content": memory}])
 
     def update_memory(self, id:str, content:str):
         logger.info(f"Updating memory id: {id}, content: {content}")
         if not MEMORY_ENABLE_PINECONE_UPDATE:
             logger.info("Memory update is disabled.")
             return
-        embeddings = self._embed_text(content)
-        self.index.upsert(
-            vectors=[{"id": id, "values": embeddings[0]['values'], "metadata": {"text": content}}]
-        )
+        if not self._defer_write(id, content):
+            self.upsert_memories([{"id": id, "content": content}])
+
+    def upsert_memories(self, memories: list[dict]):
+        if not MEMORY_ENABLE_PINECONE_UPDATE:
+            logger.info("Memory update is disabled.")
+            return
+        vectors = self.embeddings.embed([memory["content"] for memory in memories])
+        logger.info(f"Upserting {len(memories)} memories...")
+        records = [{"id": memory["id"], "values": vector.tolist(), "metadata": {"text": memory["content"]}}
+                   for memory, vector in zip(memories, vectors)]
+        for start in range(0, len(records), UPSERT_BATCH_SIZE):
+            self.index.upsert(vectors=records[start:start + UPSERT_BATCH_SIZE])
 
     def query_memory(self, query:str, top_k:int=3, exclude_ids:set[str]=set()):
         if exclude_ids is None:
@@ -63,14 +85,14 @@ class PineconeMemoryManager:
         else:
             exclude_ids = set(exclude_ids)
 
-        query_embedding = self._embed_text(query, input_type="query")
+        query_embedding = self.embeddings.embed([query], input_type="query")[0]
 
         current_top_k = top_k
         if exclude_ids:
             current_top_k = top_k + len(exclude_ids)
 
         query_results = self.index.query(
-            vector=query_embedding[0].values,
+            vector=query_embedding.tolist(),
             top_k=current_top_k,
             include_metadata=True,
             include_values=False
@@ -86,7 +108,8 @@ class PineconeMemoryManager:
             if memory_id not in exclude_ids:
                 results.append({
                     "id": memory_id,
-                    "content": result['metadata']['text']
+                    "content": result['metadata']['text'],
+                    "score": result['score']
                 })
 
         return results
@@ -96,6 +119,7 @@ class PineconeMemoryManager:
         if not MEMORY_ENABLE_PINECONE_UPDATE:
             logger.info("Memory update is disabled.")
             return
+        self._drop_deferred(id)
         self.index.delete(ids=[id])
         return f"Memory deleted successfully. ID: {id}"
 
@@ -104,6 +128,15 @@ class PineconeMemoryManager:
         memories = self.index.fetch(ids=ids)
         return memories
 
+def get_memory_manager() -> MemoryBackend:
+    """The backend configured with `memory.backend` in config.yaml."""
+    if MEMORY_BACKEND == "local":
+        from .local_memory import LocalMemoryManager # numpy and the embedding model are only loaded when used
+        return LocalMemoryManager()
+    if MEMORY_BACKEND != "pinecone":
+        raise ValueError(f"Unknown memory backend {MEMORY_BACKEND}, expected pinecone or local")
+    return PineconeMemoryManager()
+
 MEMORIES_DIR_NAME = 'memories'
 DELETED_MEMORIES_DIR_NAME = 'deleted_memories'
 
@@ -116,8 +149,8 @@ def delete_memory(memory_id:str) -> str:
     Args:
         memory_id: The id of the memory to delete.
     '''
-    pinecone_memory_manager = PineconeMemoryManager()
-    pinecone_memory_manager.delete_memory(memory_id)
+    memory_manager = get_memory_manager()
+    memory_manager.delete_memory(memory_id)
     return f"Memory deleted successfully. ID: {memory_id}"
 
 @tool
@@ -131,8 +164,8 @@ def update_memory(memory_id:str, content:str) -> str:
         content: str
             The new content of the memory.
     '''
-    pinecone_memory_manager = PineconeMemoryManager()
-    pinecone_memory_manager.update_memory(memory_id, content)
+    memory_manager = get_memory_manager()
+    memory_manager.update_memory(memory_id, content)
     return f"Memory updated successfully."
 
 @tool
@@ -146,21 +179,21 @@ def add_memory(memory:str) -> str:
     '''
 
     timestamp = get_current_timestamp(include_milliseconds=True)
-    pinecone_memory_manager = PineconeMemoryManager()
-    pinecone_memory_manager.add_memory(memory, id=timestamp)
+    memory_manager = get_memory_manager()
+    memory_manager.add_memory(memory, id=timestamp)
     return f"Memory added successfully." 
 
 @tool
 def search_memory(query:str, top_k:int=3, exclude_ids:set[str]=set()) -> str:
     '''
     Search for a piece of memory in long term memory.
-    This is supported by Pinecone's vector search.
+    This is supported by a vector search.
 
     Args:
         query: The query to search for.
     '''
-    pinecone_memory_manager = PineconeMemoryManager()
-    results = pinecone_memory_manager.query_memory(query, top_k=top_k, exclude_ids=exclude_ids)
+    memory_manager = get_memory_manager()
+    results = memory_manager.query_memory(query, top_k=top_k, exclude_ids=exclude_ids)
     return results
 
 
@@ -0,0 +1,63 @@
+from contextlib import contextmanager
+from loguru import logger
+
+
+class MemoryBackend:
+    """Storage of the long-term memory behind the memory tools. Configured with `memory.backend`
+    in config.yaml: `pinecone` (hosted index and embeddings) or `local` (on disk, offline)."""
+    _pending_writes = None # {id: content} while in batched_writes
+
+    def add_memory(self, memory: str, id: str = None):
+        raise NotImplementedError
+
+    def update_memory(self, id: str, content: str):
+        raise NotImplementedError
+
+    def upsert_memories(self, memories: list[dict]):
+        """Write several {"id", "content"} memories with one embedding call and one upsert."""
+        raise NotImplementedError
+
+    def query_memory(self, query: str, top_k: int = 3, exclude_ids: set[str] = set()) -> list[dict]:
+        """The `top_k` most similar memories above the backend's score threshold, as {"id", "content", "score"}."""
+        raise NotImplementedError
+
+    def delete_memory(self, id: str):
+        raise NotImplementedError
+
+    def embed_query(self, query: str):
+        """The query embedding `query_memory` searches with, from the embedding cache if it was embedded before."""
+        return self.embeddings.embed([query], input_type="query")[0]
+
+    @contextmanager
+    def batched_writes(self):
+        """Adds and updates inside the block are collected (the last content per id wins) and written
+        at its end by one `upsert_memories`, as for the burst of tool calls of the memory updater.
+        A failed write is logged with the memories instead of raised, the run's work is done by then."""
+        if self._pending_writes is not None: # nested, the outer block writes
+            yield
+            return
+        self._pending_writes = {}
+        try:
+            yield
+        finally:
+            memories = [{"id": id, "content": content} for id, content in self._pending_writes.items()]
+            self._pending_writes = None
+            if memories:
+                logger.info(f"Writing {len(memories)} memories in one upsert")
+                try:
+                    self.upsert_memories(memories)
+                except Exception:
+                    logger.exception(f"Failed to write memories: {memories}")
+
+    def _defer_write(self, id: str, content: str) -> bool:
+        if self._pending_writes is None:
+            return False
+        self._pending_writes[id] = content
+        return True
+
+    def _drop_deferred(self, id: str):
+        if self._pending_writes is not None:
+            self._pending_writes.pop(id, None)
+
+
+__all__ = ["MemoryBackend"]
@@ -4,8 +4,9 @@ from langchain_core.tools import tool
 from pathlib import Path
 from loguru import logger
 import warnings
-import asyncio
 import tempfile
+from ..async_runtime import run_sync
+from ..tool_cache import ToolResultCache, file_identity, TOOL_CACHE_ENABLE
 async def pdf_to_markdown(file_path: str, select_pages: int | list[int] | None = None, output_dir: str | None = None) -> str:
     with warnings.catch_warnings():
         warnings.filterwarnings(
@@ -39,6 +40,18 @@ async def pdf_to_markdown(file_path: str, select_pages: int | list[int] | None =
         )
     return result
 
+def convert_pdf_content(file_path: Path, pages: int | list[int] | None) -> str:
+    # Create temporary directory for intermediate output
+    with tempfile.TemporaryDirectory() as temp_dir:
+        result = run_sync(pdf_to_markdown(file_path.as_posix(), pages, temp_dir))
+        temp_file = Path(temp_dir) / (result.file_name + '.md')
+        try:
+            with open(temp_file, 'r', encoding='utf-8') as f:
+                return f.read()
+        except UnicodeDecodeError:
+            with open(temp_file, 'r', encoding='latin-1') as f:
+                return f.read()
+
 @tool
 def convert_pdf2md(file_path: str, save_path: str, pages: int | list[int] | None = None) -> str:
     '''
@@ -63,19 +76,21 @@ def convert_pdf2md(file_path: str, save_path: str, pages: int | list[int] | None
         save_path.parent.mkdir(parents=True, exist_ok=True)
     if save_path.exists():
         return f"File already exists: {save_path.as_posix()}"
-    # Create temporary directory for intermediate output
-    with tempfile.TemporaryDirectory() as temp_dir:
-
-        result = asyncio.run(pdf_to_markdown(file_path.as_posix(), pages, temp_dir))
-        temp_file = Path(temp_dir) / (result.file_name + '.md')
-        try:
-            with open(temp_file, 'r', encoding='utf-8') as f:
-                content = f.read()
-        except UnicodeDecodeError:
-            with open(temp_file, 'r', encoding='latin-1') as f:
-                content = f.read()
-        with open(save_path, 'w', encoding='utf-8') as f:
-            f.write(content)
+    # The conversion calls a vision model for every page, so converting the same unchanged PDF again
+    # (e.g. to another save path) reuses the markdown of the first conversion.
+    cache = ToolResultCache()
+    cache_key = cache.make_key("convert_pdf2md", file_path.as_posix(), {"pages": pages})
+    identity = file_identity(file_path.as_posix())
+    content = cache.get(cache_key, identity) if TOOL_CACHE_ENABLE else None
+    if content is None:
+        content = convert_pdf_content(file_path, pages)
+        if TOOL_CACHE_ENABLE:
+            cache.put(cache_key, file_path.as_posix(), identity, content)
+    else:
+        logger.info(f"Reusing the markdown of an earlier conversion of {file_path.as_posix()}")
+    with open(save_path, 'w', encoding='utf-8') as f:
+        f.write(content)
+    cache.invalidate(save_path)
     end_time = time.time()
     logger.info(f"Conversion complete. Saved to {save_path.as_posix()}. Time taken: {end_time - start_time:.2f} seconds")
     return f"Converted file: {file_path.as_posix()}, saved to {save_path.as_posix()}"
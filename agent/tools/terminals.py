@@ -7,6 +7,7 @@ import signal
 import threading
 from loguru import logger
 from typing import Dict, Optional
+from ..tool_cache import ToolResultCache
 
 class TerminalManager:
     _instance = None
@@ -229,6 +230,8 @@ def command_terminal(command: str, id: int = None, name: str = None, wait_for_ou
             If no new output appears during the wait period, returns a message indicating no new output.
     '''
     terminal_manager = TerminalManager()
+    # commands may create, move or delete files anywhere, so cached directory trees cannot be trusted
+    ToolResultCache().invalidate_directories()
     return terminal_manager.send(id=id, name=name, command=command, wait_for_output_seconds=wait_for_output_seconds)
 
 @tool
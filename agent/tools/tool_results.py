@@ -0,0 +1,54 @@
+import re
+from typing import Optional
+from langchain_core.tools import tool
+from loguru import logger
+from ..artifacts import load_artifact
+
+MAX_LINES = 500
+MAX_MATCHES = 200
+
+@tool
+def read_tool_result(handle: str,
+                     start_line: int = 1,
+                     num_lines: int = 200,
+                     pattern: Optional[str] = None,
+                     ) -> str:
+    """
+    Read a tool result that was too large for the conversation and was stored under a handle.
+    Either returns a slice of its lines, or, with a pattern, the lines matching it.
+
+    Args:
+        handle: str
+            The handle given in place of the full result.
+        start_line: int
+            The first line to return, starting from 1. Default is 1.
+        num_lines: int
+            How many lines to return, at most 500. Default is 200.
+        pattern: Optional[str]
+            A regular expression. If given, returns the matching lines (with their line numbers) instead of a slice.
+    """
+    content = load_artifact(handle)
+    if content is None:
+        return f"No stored tool result with handle: {handle}"
+    lines = content.splitlines()
+    num_digits = len(str(len(lines)))
+    if pattern:
+        try:
+            regex = re.compile(pattern)
+        except re.error as e:
+            return f"Invalid pattern {pattern!r}: {e}"
+        matches = [f"{idx + 1:{num_digits}d}: {line}" for idx, line in enumerate(lines) if regex.search(line)]
+        logger.info(f"Searched tool result {handle} for {pattern!r}: {len(matches)} matching lines")
+        shown = "\n".join(matches[:MAX_MATCHES])
+        more = f"\n... {len(matches) - MAX_MATCHES} more matching lines, use a narrower pattern" if len(matches) > MAX_MATCHES else ""
+        return f"{len(matches)} of {len(lines)} lines match {pattern!r}:\n{shown}{more}"
+    start = max(1, start_line)
+    end = min(len(lines), start + min(num_lines, MAX_LINES) - 1)
+    logger.info(f"Reading lines {start}-{end} of tool result {handle}")
+    if start > len(lines):
+        return f"The result has only {len(lines)} lines."
+    shown = "\n".join(f"{idx:{num_digits}d}: {lines[idx - 1]}" for idx in range(start, end + 1))
+    return f"Lines {start}-{end} of {len(lines)}:\n{shown}"
+
+
+__all__ = ['read_tool_result']
@@ -4,7 +4,8 @@ from PIL import Image
 from .images import get_image_url
 from langchain_core.messages import HumanMessage
 from loguru import logger
-from ..llms import IMAGE_DESCRIPTION_MODEL
+from ..llms import get_role_model
+from ..llm_calling import invoke_llm
 
 @tool
 def get_image_description(
@@ -23,7 +24,8 @@ def get_image_description(
     image = Image.open(filepath)
     text_prompt = f"Describe the image in detail. {additional_prompt}"
 
-    result = IMAGE_DESCRIPTION_MODEL.invoke(
+    result, _ = invoke_llm(
+        get_role_model("image_description_model"),
         [
             HumanMessage(
                 content=[
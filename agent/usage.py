@@ -0,0 +1,212 @@
+import contextvars
+import inspect
+import json
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+from pathlib import Path
+from loguru import logger
+from .config import USAGE_CONFIG
+from .timestamp import get_current_run_timestamp, get_current_timestamp
+
+# USD per million tokens: (input, output, cached input). Override or extend with `usage: prices:` in config.yaml.
+DEFAULT_PRICES = {
+    "gpt-4o": (2.5, 10.0, 1.25),
+    "gpt-4o-json": (2.5, 10.0, 1.25),
+    "gpt-4o-mini": (0.15, 0.6, 0.075),
+    "gpt-4o-mini-json": (0.15, 0.6, 0.075),
+    "o1": (15.0, 60.0, 7.5),
+    "o3-mini": (1.1, 4.4, 0.55),
+    "claude-3-5-sonnet": (3.0, 15.0, 0.3),
+    "deepseek-chat": (0.27, 1.1, 0.07),
+    "deepseek-reasoner": (0.55, 2.19, 0.14),
+    "grok-2": (2.0, 10.0, 2.0),
+    "gemini-2.0-flash": (0.1, 0.4, 0.025),
+    "gemini-2.0-flash-thinking-exp": (0.0, 0.0, 0.0),
+    "deepseek-reasoner-openrouter": (0.0, 0.0, 0.0),
+}
+
+_current_agent = contextvars.ContextVar("usage_agent", default=None)
+_current_node = contextvars.ContextVar("usage_node", default=None)
+_metrics_sources = {}
+
+@contextmanager
+def usage_context(agent: str, node: str):
+    """Tag every LLM call made inside the block with the agent and graph node making it."""
+    agent_token, node_token = _current_agent.set(agent), _current_node.set(node)
+    try:
+        yield
+    finally:
+        _current_agent.reset(agent_token)
+        _current_node.reset(node_token)
+
+def track_usage(agent: str, node: str):
+    """Decorator form of `usage_context` for graph node functions."""
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            @wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with usage_context(agent, node):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with usage_context(agent, node):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def register_metrics_source(name: str, get_stats):
+    """Include `get_stats()` of another component (cache, rate limiter, ...) in the usage summary."""
+    _metrics_sources[name] = get_stats
+
+def get_price(model_name: str) -> tuple[float, float, float] | None:
+    prices = USAGE_CONFIG.get("prices", {}) or {}
+    if model_name in prices:
+        price = prices[model_name]
+        return (price.get("input", 0.0), price.get("output", 0.0), price.get("cache_read", price.get("input", 0.0)))
+    return DEFAULT_PRICES.get(model_name)
+
+def get_token_usage(response) -> dict:
+    """Token counts of a chat model response, from LangChain's `usage_metadata` when the provider reports it."""
+    usage = getattr(response, "usage_metadata", None) or {}
+    input_details = usage.get("input_token_details", {}) or {}
+    output_details = usage.get("output_token_details", {}) or {}
+    return {
+        "prompt_tokens": usage.get("input_tokens", 0),
+        "completion_tokens": usage.get("output_tokens", 0),
+        "reasoning_tokens": output_details.get("reasoning", 0) or 0,
+        "cache_read_tokens": input_details.get("cache_read", 0) or 0,
+    }
+
+
+class UsageTracker:
+    """Per-call token, latency and cost accounting for the current run."""
+    _instance = None
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super().__new__(cls)
+            cls._instance.calls = []
+            cls._instance._lock = threading.Lock()
+        return cls._instance
+
+    def __init__(self):
+        pass
+
+    def record(self, model_name: str, response, wall_time: float, time_to_first_token: float | None = None,
+               from_cache: bool = False):
+        tokens = get_token_usage(response)
+        price = get_price(model_name)
+        if from_cache:
+            cost = 0.0
+        elif price is None:
+            cost = None
+        else:
+            input_price, output_price, cache_price = price
+            uncached = tokens["prompt_tokens"] - tokens["cache_read_tokens"]
+            cost = (uncached * input_price + tokens["cache_read_tokens"] * cache_price
+                    + tokens["completion_tokens"] * output_price) / 1_000_000
+        call = {
+            "run": get_current_run_timestamp(),
+            "time": get_current_timestamp(include_milliseconds=True),
+            "agent": _current_agent.get(),
+            "node": _current_node.get(),
+            "model": model_name,
+            **tokens,
+            "cached_ratio": tokens["cache_read_tokens"] / tokens["prompt_tokens"] if tokens["prompt_tokens"] else None,
+            "time_to_first_token": time_to_first_token,
+            "wall_time": wall_time,
+            "cost": cost,
+            "from_cache": from_cache,
+        }
+        with self._lock:
+            self.calls.append(call)
+        logger.debug(f"LLM usage: {call}")
+        if call["cached_ratio"] is not None and not from_cache:
+            logger.info(f"{model_name}: {tokens['cache_read_tokens']} / {tokens['prompt_tokens']} prompt tokens "
+                        f"read from the provider's prompt cache ({call['cached_ratio']:.0%})")
+
+    def get_totals(self, agent: str | None = None, model: str | None = None) -> dict:
+        """Spend so far, optionally restricted to one agent or model."""
+        with self._lock:
+            calls = [call for call in self.calls
+                     if (agent is None or call["agent"] == agent) and (model is None or call["model"] == model)]
+        return self._aggregate(calls)
+
+    def get_spend(self) -> float:
+        return self.get_totals()["cost"]
+
+    def get_summary(self) -> dict:
+        with self._lock:
+            calls = list(self.calls)
+        by_agent, by_model = {}, {}
+        for call in calls:
+            by_agent.setdefault(call["agent"] or "unknown", []).append(call)
+            by_model.setdefault(call["model"], []).append(call)
+        summary = {
+            "run": get_current_run_timestamp(),
+            "total": self._aggregate(calls),
+            "by_agent": {name: self._aggregate(group) for name, group in by_agent.items()},
+            "by_model": {name: self._aggregate(group) for name, group in by_model.items()},
+            "calls": calls,
+        }
+        for name, get_stats in _metrics_sources.items():
+            try:
+                summary[name] = get_stats()
+            except Exception as e:
+                logger.warning(f"Could not collect {name} stats for the usage summary: {e}")
+        return summary
+
+    def write_summary(self, log_dir: Path | None = None) -> Path:
+        """Write the summary next to the run's log file, as data/logs/<date>/<run timestamp>_usage.json."""
+        run_timestamp = get_current_run_timestamp()
+        log_dir = (log_dir or Path("data") / "logs") / run_timestamp.split("_")[0]
+        log_dir.mkdir(parents=True, exist_ok=True)
+        path = log_dir / f"{run_timestamp}_usage.json"
+        summary = self.get_summary()
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=4, default=str)
+        total = summary["total"]
+        logger.info(f"LLM usage: {total['calls']} calls, {total['prompt_tokens']} prompt + {total['completion_tokens']} "
+                    f"completion tokens, ${total['cost']:.4f}. Summary written to {path.absolute().as_posix()}")
+        return path
+
+    @staticmethod
+    def _aggregate(calls: list[dict]) -> dict:
+        live = [call for call in calls if not call["from_cache"]]
+        first_token_times = [call["time_to_first_token"] for call in live if call["time_to_first_token"] is not None]
+        prompt_tokens = sum(call["prompt_tokens"] for call in live)
+        cache_read_tokens = sum(call["cache_read_tokens"] for call in live)
+        return {
+            "calls": len(calls),
+            "cached_calls": len(calls) - len(live),
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": sum(call["completion_tokens"] for call in live),
+            "reasoning_tokens": sum(call["reasoning_tokens"] for call in live),
+            "cache_read_tokens": cache_read_tokens,
+            "cached_token_ratio": cache_read_tokens / prompt_tokens if prompt_tokens else None,
+            "wall_time": sum(call["wall_time"] for call in live),
+            "mean_time_to_first_token": sum(first_token_times) / len(first_token_times) if first_token_times else None,
+            "cost": sum(call["cost"] or 0.0 for call in live),
+            "unpriced_calls": sum(call["cost"] is None for call in live),
+        }
+
+
+class CallTimer:
+    """Measures wall time and time to first token of one LLM call."""
+    def __init__(self):
+        self.start = time.monotonic()
+        self.first_token = None
+
+    def mark_first_token(self):
+        if self.first_token is None:
+            self.first_token = time.monotonic() - self.start
+
+    @property
+    def elapsed(self) -> float:
+        return time.monotonic() - self.start
+
+
+__all__ = ["UsageTracker", "usage_context", "track_usage", "register_metrics_source", "get_token_usage", "CallTimer"]
@@ -0,0 +1,99 @@
+"""
+Benchmark for the shared HTTP connection pool in agent/http_pool.py.
+
+Runs a local mock of the OpenAI chat completions endpoint that sleeps `--connect-delay` ms whenever
+a new connection is accepted, standing in for the TCP + TLS handshake round trips to a real API.
+Then compares, through the OpenAI SDK:
+    fresh:  a new HTTP client per call (every call pays the handshake)
+    pooled: the process-wide keep-alive client from get_http_client (handshake paid once per connection)
+both for sequential calls and for a concurrent burst like the relevance checks in get_relevant_memories.
+
+Usage (from the repository root, with config.yaml in place):
+    python -m benchmarks.http_pool_benchmark --calls 50 --burst 8 --connect-delay 50
+"""
+import argparse
+import json
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import httpx
+from openai import OpenAI
+from agent.http_pool import get_http_client, get_pool_stats
+
+COMPLETION = {
+    "id": "chatcmpl-benchmark", "object": "chat.completion", "created": 0, "model": "mock",
+    "choices": [{"index": 0, "message": {"role": "assistant", "content": "{\"decision\": \"YES\"}"}, "finish_reason": "stop"}],
+    "usage": {"prompt_tokens": 10, "completion_tokens": 5, "total_tokens": 15},
+}
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1" # keep-alive
+    disable_nagle_algorithm = True # headers and body are separate writes, avoid delayed ACK stalls
+    connect_delay = 0.0
+    connections = 0
+    connections_lock = threading.Lock()
+
+    def setup(self):
+        super().setup()
+        with MockHandler.connections_lock:
+            MockHandler.connections += 1
+        time.sleep(self.connect_delay)
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        body = json.dumps(COMPLETION).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def call(http_client: httpx.Client, base_url: str) -> float:
+    client = OpenAI(base_url=base_url, api_key="benchmark", http_client=http_client, max_retries=0)
+    start = time.perf_counter()
+    client.chat.completions.create(model="mock", messages=[{"role": "user", "content": "hi"}])
+    return time.perf_counter() - start
+
+def fresh_call(base_url: str) -> float:
+    with httpx.Client() as http_client:
+        return call(http_client, base_url)
+
+def pooled_call(base_url: str) -> float:
+    return call(get_http_client(base_url), base_url)
+
+def run(scenario, base_url: str, calls: int, burst: int) -> tuple[list[float], int]:
+    connections_before = MockHandler.connections
+    if burst > 1:
+        with ThreadPoolExecutor(max_workers=burst) as executor:
+            timings = list(executor.map(lambda _: scenario(base_url), range(calls)))
+    else:
+        timings = [scenario(base_url) for _ in range(calls)]
+    return timings, MockHandler.connections - connections_before
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark pooled vs per-call HTTP clients against a local mock server")
+    parser.add_argument("--calls", type=int, default=50)
+    parser.add_argument("--burst", type=int, default=8, help="concurrency of the burst scenario")
+    parser.add_argument("--connect-delay", type=float, default=50, help="simulated handshake cost per new connection, ms")
+    args = parser.parse_args()
+
+    MockHandler.connect_delay = args.connect_delay / 1000
+    server = ThreadingHTTPServer(("127.0.0.1", 0), MockHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+    for burst in (1, args.burst):
+        label = "sequential" if burst == 1 else f"burst x{burst}"
+        for name, scenario in (("fresh", fresh_call), ("pooled", pooled_call)):
+            start = time.perf_counter()
+            timings, connections = run(scenario, base_url, args.calls, burst)
+            total = time.perf_counter() - start
+            print(f"{label:>12} {name:>6}: median {statistics.median(timings) * 1000:7.1f} ms/call, "
+                  f"total {total:6.2f} s, {connections:3d} connections for {args.calls} calls")
+    print(f"pool stats: {get_pool_stats()}")
+    server.shutdown()
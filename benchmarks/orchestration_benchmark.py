@@ -0,0 +1,336 @@
+"""
+Orchestration benchmark for the multi-agent graph in agent/multi_agent/run.py.
+
+Builds the real graph, with scripted chat models standing in for every LLM role and in-memory stubs
+for the file tools and the long-term memory search, so nothing leaves the process. Then measures:
+    nodes:   mean time per graph node, the framework's own overhead around LLM and tool calls
+    history: time per member agent step as its message history grows, without and with the SQLite checkpointer
+    memory:  time per step with memory retrieval off vs on (stubbed search, scripted relevance checks)
+    relevance: latency, LLM calls and tokens per retrieval of the per_memory, listwise and embedding relevance modes
+    e2e:     steps per second of whole runs, sync (graph.stream) and async (graph.astream)
+
+Results are written as JSON (commit, settings, features from config.yaml, flat metrics). `--compare`
+prints the change of every metric against an earlier result file, and flags the regressions.
+
+Usage (from the repository root, with config.yaml in place):
+    python -m benchmarks.orchestration_benchmark --rounds 5 --repeat 3
+    python -m benchmarks.orchestration_benchmark --compare data/benchmarks/orchestration_<commit>.json
+"""
+import argparse
+import asyncio
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from datetime import datetime
+from pathlib import Path
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from langchain_core.tools import tool
+from loguru import logger
+
+REPO_ROOT = Path(__file__).parent.parent
+OUTPUT_DIR = REPO_ROOT / "data" / "benchmarks"
+TASK = "Solve the problems in bench/questions.md and write the solutions to bench/solutions.md."
+
+
+class ScriptedChatModel(BaseChatModel):
+    """Answers with the next response of its script, instantly or after `latency` seconds."""
+    responses: list[str]
+    latency: float = 0.0
+    model_name: str = "scripted"
+    calls: int = 0
+    tokens: int = 0
+
+    @property
+    def _llm_type(self) -> str:
+        return "scripted"
+
+    def _next_message(self, messages) -> AIMessage:
+        text = self.responses[self.calls % len(self.responses)]
+        self.calls += 1
+        prompt_tokens = sum(len(str(message.content)) for message in messages) // 4
+        completion_tokens = len(text) // 4
+        self.tokens += prompt_tokens + completion_tokens
+        return AIMessage(content=text, usage_metadata={"input_tokens": prompt_tokens, "output_tokens": completion_tokens,
+                                                       "total_tokens": prompt_tokens + completion_tokens})
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        if self.latency:
+            time.sleep(self.latency)
+        return ChatResult(generations=[ChatGeneration(message=self._next_message(messages))])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return ChatResult(generations=[ChatGeneration(message=self._next_message(messages))])
+
+
+def supervisor_script(rounds: int) -> list[str]:
+    delegate = json.dumps({"thoughts": "The math agent should work on the next problem.", "next_agent": "math_agent",
+                           "next_agent_prompt": "Solve the next problem in bench/questions.md and append it to bench/solutions.md."})
+    end = json.dumps({"thoughts": "All problems are solved.", "next_agent": "__end__", "next_agent_prompt": ""})
+    return [delegate] * rounds + [end]
+
+def member_script(rounds: int, tool_calls: int) -> list[str]:
+    read = json.dumps({"thoughts": "I need the problem first.",
+                       "tool_calls": [{"name": "read_file", "args": {"filepath": "bench/questions.md"}}]})
+    write = json.dumps({"thoughts": "Saving the solution.",
+                        "tool_calls": [{"name": "write_file", "args": {"filepath": "bench/solutions.md", "content": "$x = 1$\n", "mode": "a"}}]})
+    notify = json.dumps({"thoughts": "Done.", "tool_calls": [{"name": "notify_supervisor", "args": {"summary": "Solved, see bench/solutions.md."}}]})
+    return ([[read, write][i % 2] for i in range(tool_calls)] + [notify]) * rounds
+
+RELEVANCE_RESPONSES = [json.dumps({"thoughts": "It is about the same problems.", "decision": "YES"}),
+                       json.dumps({"thoughts": "Unrelated.", "decision": "NO"})]
+LISTWISE_RELEVANCE_RESPONSES = [json.dumps({"thoughts": "Memories 1, 3 and 5 are about the same problems, the others are unrelated.",
+                                            "decisions": {str(i): "YES" if i % 2 else "NO" for i in range(1, 6)}})]
+RELEVANCE_MODES = ("per_memory", "listwise", "embedding")
+
+
+FILES = {"bench/questions.md": "1. Solve $x + 1 = 2$.\n" * 20}
+
+def read_file_stub(filepath: str, line_number: bool = True) -> str:
+    content = FILES.get(filepath)
+    if content is None:
+        return f"Error: {filepath} does not exist"
+    if line_number:
+        return "\n".join(f"{i}: {line}" for i, line in enumerate(content.splitlines(), start=1))
+    return content
+
+def write_file_stub(filepath: str, content: str, mode: str = "w") -> str:
+    FILES[filepath] = (FILES.get(filepath, "") if mode == "a" else "") + content
+    return f"Content written to {filepath}"
+
+def get_file_tree_stub(root_path: str, **kwargs) -> str:
+    return "\n".join(path for path in FILES if path.startswith(root_path.rstrip("/")))
+
+@tool
+def search_memory_stub(query: str, top_k: int = 3, exclude_ids: list[str] | None = None) -> list[dict]:
+    """In-memory stand-in for the Pinecone memory search."""
+    memories = [{"id": f"memory-{i}", "content": f"The user prefers solutions in LaTeX, note {i}.", "score": 0.95 - 0.02 * i}
+                for i in range(10)]
+    return [memory for memory in memories if memory["id"] not in (exclude_ids or [])][:top_k]
+
+
+class Harness:
+    """Patches the roles, tools and memory search of the real graph, and builds it."""
+    def __init__(self, llm_latency: float):
+        from agent.llm_cache import LLMResponseCache
+        from agent.tools.files import read_file, write_file, get_file_tree
+        from agent.multi_agent import supervisor_agent, member_agent, get_relevant_memories, memory_updater
+        from agent.multi_agent.human_channel import HumanChannel
+        from agent.multi_agent.retrieval_cache import RetrievalCache
+        self.llm_latency = llm_latency
+        self.models = {}
+        for module in (supervisor_agent, member_agent, get_relevant_memories):
+            module.get_role_model = self.get_role_model
+        for stub_tool, stub in ((read_file, read_file_stub), (write_file, write_file_stub), (get_file_tree, get_file_tree_stub)):
+            stub_tool.func = stub
+            stub_tool.coroutine = None
+        get_relevant_memories.search_memory = search_memory_stub
+        self.retrieval = get_relevant_memories
+        self.relevance_mode = get_relevant_memories.MEMORY_RELEVANCE_MODE
+        memory_updater.MEMORY_ENABLE_UPDATER = False # it would run another scripted agent after every run
+        LLMResponseCache().enabled = False # scripted responses repeat, cache hits would skip the LLM path
+        LLMResponseCache().model_flags = {}
+        RetrievalCache().enabled = False # it embeds queries with the real memory backend, the search here is a stub
+        HumanChannel().set_mode("autonomous")
+
+    def get_role_model(self, role: str) -> ScriptedChatModel:
+        role = "member" if role not in ("supervisor_model", "memory_relevance_model") else role
+        return self.models[role]
+
+    def script(self, rounds: int, tool_calls: int, memory_retrieval: bool, relevance_mode: str = None):
+        relevance_mode = relevance_mode or self.relevance_mode
+        self.models = {
+            "supervisor_model": ScriptedChatModel(responses=supervisor_script(rounds), latency=self.llm_latency),
+            "member": ScriptedChatModel(responses=member_script(rounds, tool_calls), latency=self.llm_latency),
+            "memory_relevance_model": ScriptedChatModel(latency=self.llm_latency, responses=
+                LISTWISE_RELEVANCE_RESPONSES if relevance_mode == "listwise" else RELEVANCE_RESPONSES),
+        }
+        self.retrieval.MEMORY_ENABLE_RETRIEVAL = memory_retrieval
+        self.retrieval.MEMORY_RELEVANCE_MODE = relevance_mode
+
+    def get_graph(self, checkpointer=None):
+        from agent.multi_agent.run import get_graph
+        return get_graph(checkpointer)
+
+
+def graph_input(history: int) -> dict:
+    state = {"supervisor_messages": [HumanMessage(content=TASK)]}
+    if history:
+        messages = [SystemMessage(content="You will act as a math agent.")]
+        for i in range(history // 2):
+            messages.append(HumanMessage(content=f'Tool "read_file" result: {FILES["bench/questions.md"][:400]} ({i})'))
+            messages.append(AIMessage(content=member_script(1, 1)[0]))
+        state.update({"member_messages": {"math_agent": messages}, "member_tool_calls": {"math_agent": []},
+                      "member_trigger_long_term_memory": {"math_agent": False}, "member_retrieved_memory_ids": {"math_agent": []}})
+    return state
+
+def node_name(namespace: tuple, name: str) -> str:
+    return ".".join([part.split(":")[0] for part in namespace] + [name])
+
+def collect(events, started: dict, node_times: dict):
+    namespace, event = events
+    if event["type"] not in ("task", "task_result"):
+        return
+    timestamp = datetime.fromisoformat(event["timestamp"]).timestamp()
+    payload = event["payload"]
+    if event["type"] == "task":
+        started[payload["id"]] = timestamp
+    elif payload["id"] in started:
+        node_times[node_name(namespace, payload["name"])].append(timestamp - started.pop(payload["id"]))
+
+def run_once(harness: Harness, rounds: int, tool_calls: int, history: int = 0, memory_retrieval: bool = False,
+             checkpointer=None, use_async: bool = False) -> dict:
+    """One run of the graph. Returns its wall time, number of node executions and time per node."""
+    harness.script(rounds, tool_calls, memory_retrieval)
+    graph = harness.get_graph(checkpointer)
+    config = {"recursion_limit": 10_000, "configurable": {"thread_id": f"benchmark-{time.perf_counter_ns()}"}}
+    started, node_times = {}, defaultdict(list)
+    kwargs = {"stream_mode": "debug", "subgraphs": True}
+    start = time.perf_counter()
+    if use_async:
+        async def consume():
+            async for events in graph.astream(graph_input(history), config, **kwargs):
+                collect(events, started, node_times)
+        from agent.async_runtime import run_sync
+        run_sync(consume())
+    else:
+        for events in graph.stream(graph_input(history), config, **kwargs):
+            collect(events, started, node_times)
+    wall = time.perf_counter() - start
+    return {"wall": wall, "steps": sum(len(times) for times in node_times.values()), "node_times": dict(node_times)}
+
+def median_run(repeat: int, **kwargs) -> tuple[dict, list[dict]]:
+    """The run with the median wall time, and all runs."""
+    runs = [run_once(**kwargs) for _ in range(repeat)]
+    return sorted(runs, key=lambda run: run["wall"])[len(runs) // 2], runs
+
+def relevance_run(harness: Harness, mode: str, retrievals: int) -> dict:
+    """`retrievals` memory retrievals of the supervisor's first step in one relevance mode."""
+    harness.script(0, 0, memory_retrieval=True, relevance_mode=mode)
+    model = harness.models["memory_relevance_model"]
+    messages = [HumanMessage(content=TASK)]
+    kept = 0
+    start = time.perf_counter()
+    for _ in range(retrievals):
+        relevant_memories, _, _ = harness.retrieval.get_relevant_memories(messages)
+        kept += len(relevant_memories)
+    wall = time.perf_counter() - start
+    return {"ms": wall / retrievals * 1000, "calls": model.calls / retrievals, "tokens": model.tokens / retrievals,
+            "kept": kept / retrievals}
+
+def ms_per_step(run: dict) -> float:
+    return run["wall"] / run["steps"] * 1000
+
+
+def benchmark(args) -> dict:
+    harness = Harness(args.llm_latency / 1000)
+    run = dict(harness=harness, rounds=args.rounds, tool_calls=args.tool_calls)
+    run_once(**run) # warm-up: imports, system prompts, lazily built clients
+    metrics = {}
+
+    _, runs = median_run(args.repeat, **run)
+    node_times = defaultdict(list)
+    for result in runs:
+        for name, times in result["node_times"].items():
+            node_times[name].extend(times)
+    for name, times in sorted(node_times.items()):
+        metrics[f"nodes.{name}.ms"] = statistics.mean(times) * 1000
+    print("Per node (mean ms per execution):")
+    for name, times in sorted(node_times.items()):
+        print(f"  {name:>40}: {statistics.mean(times) * 1000:8.3f} ms x {len(times) // args.repeat}")
+
+    from agent.checkpoints import SQLiteCheckpointSaver
+    with tempfile.TemporaryDirectory() as checkpoint_dir:
+        saver = SQLiteCheckpointSaver()
+        saver.path = Path(checkpoint_dir) / "benchmark.sqlite"
+        print("Member steps as the history grows (ms per step):")
+        for history in args.history:
+            for label, checkpointer in (("memory", None), ("sqlite", saver)):
+                result, _ = median_run(args.repeat, **dict(run, rounds=1), history=history, checkpointer=checkpointer)
+                metrics[f"history.{history}.{label}.ms_per_step"] = ms_per_step(result)
+                print(f"  {history:>6} messages, {label:>6} checkpointer: {ms_per_step(result):8.3f}")
+        if saver._conn is not None:
+            saver._conn.close()
+
+    print("Memory retrieval (ms per step):")
+    for label, enabled in (("off", False), ("on", True)):
+        result, _ = median_run(args.repeat, **run, memory_retrieval=enabled)
+        metrics[f"memory.{label}.ms_per_step"] = ms_per_step(result)
+        print(f"  {label:>4}: {ms_per_step(result):8.3f}")
+
+    print("Memory relevance modes (per retrieval of 5 memories):")
+    for mode in RELEVANCE_MODES:
+        result = sorted((relevance_run(harness, mode, args.retrievals) for _ in range(args.repeat)), key=lambda run: run["ms"])[args.repeat // 2]
+        metrics[f"relevance.{mode}.ms_per_retrieval"] = result["ms"]
+        metrics[f"relevance.{mode}.calls_per_retrieval"] = result["calls"]
+        metrics[f"relevance.{mode}.tokens_per_retrieval"] = result["tokens"]
+        print(f"  {mode:>10}: {result['ms']:8.3f} ms, {result['calls']:4.1f} LLM calls, {result['tokens']:7.1f} tokens, "
+              f"{result['kept']:3.1f} memories kept")
+
+    print("End to end:")
+    for label, use_async in (("sync", False), ("async", True)):
+        result, _ = median_run(args.repeat, **run, use_async=use_async)
+        metrics[f"e2e.{label}.steps_per_sec"] = result["steps"] / result["wall"]
+        metrics[f"e2e.{label}.run_ms"] = result["wall"] * 1000
+        print(f"  {label:>5}: {result['steps'] / result['wall']:8.1f} steps/s, {result['wall'] * 1000:8.1f} ms per run of {result['steps']} steps")
+    return metrics
+
+
+def git_commit() -> tuple[str, bool]:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, capture_output=True, text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=REPO_ROOT,
+                                    capture_output=True, text=True).stdout.strip())
+        return commit, dirty
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown", False
+
+def compare(previous: dict, current: dict, threshold: float):
+    print(f"Compared to {previous['commit']} ({previous['timestamp']}):")
+    regressions = 0
+    for name, value in current["metrics"].items():
+        old = previous["metrics"].get(name)
+        if not old:
+            continue
+        change = (value - old) / old
+        worse = -change if name.endswith("per_sec") else change # higher is better only for throughput
+        flag = "  REGRESSION" if worse > threshold else ""
+        regressions += bool(flag)
+        print(f"  {name:>50}: {old:10.3f} -> {value:10.3f} ({change:+7.1%}){flag}")
+    print(f"{regressions} metrics regressed by more than {threshold:.0%}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the orchestration overhead of the multi-agent graph with scripted models")
+    parser.add_argument("--rounds", type=int, default=5, help="supervisor delegations per run")
+    parser.add_argument("--tool-calls", type=int, default=2, help="tool calling turns of the member agent per delegation")
+    parser.add_argument("--history", type=int, nargs="+", default=[0, 200, 1000], help="messages already in the member's history")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--retrievals", type=int, default=20, help="memory retrievals per relevance mode and repeat")
+    parser.add_argument("--llm-latency", type=float, default=0, help="simulated latency of every LLM call, ms")
+    parser.add_argument("--output", type=str, default=None, help="defaults to data/benchmarks/orchestration_<commit>.json")
+    parser.add_argument("--compare", type=str, default=None, help="an earlier result file to compare against")
+    parser.add_argument("--threshold", type=float, default=0.1, help="relative change flagged as a regression")
+    parser.add_argument("--log", action="store_true", help="keep the agents' logging, which is otherwise silenced")
+    args = parser.parse_args()
+    if not args.log:
+        logger.remove()
+
+    from agent.config import CONFIG
+    commit, dirty = git_commit()
+    result = {"commit": commit, "dirty": dirty, "timestamp": datetime.now().isoformat(timespec="seconds"),
+              "python": platform.python_version(), "platform": sys.platform, "settings": vars(args),
+              "features": CONFIG["features"], "metrics": benchmark(args)}
+    output = Path(args.output) if args.output else OUTPUT_DIR / f"orchestration_{commit}{'-dirty' if dirty else ''}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(result, indent=4, default=str), encoding="utf-8")
+    print(f"Results written to {output.absolute().as_posix()}")
+    if args.compare:
+        compare(json.loads(Path(args.compare).read_text(encoding="utf-8")), result, args.threshold)
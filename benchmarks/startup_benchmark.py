@@ -0,0 +1,60 @@
+"""
+Startup benchmark for the lazy model registry in agent/llms.py.
+
+Compares, in fresh interpreters:
+    lazy:       `import agent.llms` (what every startup pays now)
+    configured: import + build the models named in config.yaml `llms:`
+    eager:      import + build every model in MODEL_FACTORIES (what every startup paid before)
+
+Usage (from the repository root, with config.yaml in place):
+    python -m benchmarks.startup_benchmark --repeat 5
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).parent.parent
+
+SCENARIOS = {
+    "lazy": "import agent.llms",
+    "configured": "import agent.llms as m\nfor key in m.ROLE_CONFIG_KEYS.values():\n    for name in m.get_role_model_names(key): m.get_model(name)",
+    "eager": "import agent.llms as m\nfor name in m.MODEL_FACTORIES: m.get_model(name)",
+}
+
+DUMMY_KEYS = ["OPENAI_API_KEY", "ANTHROPIC_API_KEY", "DEEPSEEK_API_KEY", "XAI_API_KEY", "GEMINI_API_KEY",
+              "GOOGLE_API_KEY", "SILICON_FLOW_API_KEY", "BCE_API_KEY", "OPENROUTER_API_KEY"]
+
+TIMER = """
+import time
+_start = time.perf_counter()
+{code}
+print(time.perf_counter() - _start)
+"""
+
+def time_scenario(code: str, repeat: int) -> list[float]:
+    env = os.environ.copy()
+    for key in DUMMY_KEYS:
+        env.setdefault(key, "benchmark")
+    timings = []
+    for _ in range(repeat):
+        result = subprocess.run([sys.executable, "-c", TIMER.format(code=code)],
+                                cwd=REPO_ROOT, env=env, capture_output=True, text=True)
+        if result.returncode != 0:
+            raise RuntimeError(f"Scenario failed:\n{result.stderr}")
+        timings.append(float(result.stdout.strip().splitlines()[-1]))
+    return timings
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark agent.llms import time")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    baseline = None
+    for name, code in SCENARIOS.items():
+        timings = time_scenario(code, args.repeat)
+        median = statistics.median(timings)
+        baseline = baseline or median
+        print(f"{name:>10}: median {median * 1000:8.1f} ms, min {min(timings) * 1000:8.1f} ms "
+              f"({median / baseline:.1f}x lazy)")
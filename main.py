@@ -1,16 +1,43 @@
 from dotenv import load_dotenv
 load_dotenv(override=True)
-from agent.logger import configure_default_logger
-configure_default_logger()
 import argparse
-from agent.multi_agent.run import run_task
+from agent.timestamp import set_current_run_timestamp
+
+parser = argparse.ArgumentParser(description='Run a multi-agent task, or a batch of them')
+parser.add_argument('mode', nargs='?', choices=['run', 'batch'], default='run',
+                    help='run: a single task (default), batch: every task of a JSONL file on a pool of worker processes')
+parser.add_argument('tasks_file', nargs='?', help='The JSONL file of tasks for batch mode', default=None)
+parser.add_argument('--task', type=str, help='The task prompt to execute', default=None, required=False)
+parser.add_argument('--resume', type=str, help='Run id (its timestamp) of an interrupted run to continue from its last checkpoint',
+                    default=None, required=False)
+parser.add_argument('--autonomous', action='store_true', help='Run unattended, never wait for human input')
+parser.add_argument('--workers', type=int, help='Worker processes of a batch (defaults to batch.workers in config.yaml)', default=None)
+parser.add_argument('--retries', type=int, help='Retries of a failed batch task (defaults to batch.retries in config.yaml)', default=None)
+parser.add_argument('--results', type=str, help='The results JSONL of a batch (defaults to data/batches/<run timestamp>_results.jsonl)',
+                    default=None)
 
 
 if __name__ == "__main__":
-    parser = argparse.ArgumentParser(description='Run a multi-agent task')
-    parser.add_argument('--task', type=str, help='The task prompt to execute', default=None, required=False)
+    # parsed here, as batch workers are spawned processes that import this module again
     args = parser.parse_args()
-    run_task(args.task)
+    if args.mode == 'batch' and not args.tasks_file:
+        parser.error("batch needs a JSONL file of tasks, e.g. `python main.py batch tasks.jsonl`")
+    if args.autonomous and not args.task and not args.resume:
+        parser.error("--autonomous needs a --task, as there is nobody to type one")
+    if args.resume:
+        set_current_run_timestamp(args.resume) # before the logger, so the resumed run keeps logging to its own file
+
+    from agent.logger import configure_default_logger
+    configure_default_logger()
+    if args.mode == 'batch':
+        from agent.multi_agent.batch import run_batch
+        run_batch(args.tasks_file, results_file=args.results, workers=args.workers, retries=args.retries)
+    else:
+        from agent.multi_agent.run import run_task
+        from agent.multi_agent.human_channel import HumanChannel
+        if args.autonomous:
+            HumanChannel().set_mode("autonomous")
+        run_task(args.task, resume=args.resume)
 
 # Go straight to finish.
 # send an email to me saying hello world
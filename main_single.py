@@ -2,6 +2,7 @@ from agent.tools.files import read_file, write_file
 from agent.tools.terminals import open_terminal, command_terminal, get_terminal_output, close_terminal
 from agent.multi_agent.member_agent import make_member_node
 from agent.logger import configure_default_logger
+from agent.usage import UsageTracker
 from dotenv import load_dotenv
 configure_default_logger()
 load_dotenv()
@@ -28,4 +29,5 @@ if __name__ == "__main__":
                                 return_to_supervisor=False)
     coder_node.invoke(
         {"next_agent_prompt": r"use python to calculate the 33th term of the Fibonacci sequence"}
-    )
\ No newline at end of file
+    )
+    UsageTracker().write_summary()
\ No newline at end of file
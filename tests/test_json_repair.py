@@ -0,0 +1,69 @@
+from agent.json_repair import repair_json, has_latex_escapes
+
+def test_valid_json_is_parsed_as_is():
+    assert repair_json('{"thoughts": "done", "tool_calls": []}') == ({"thoughts": "done", "tool_calls": []}, [])
+
+def test_latex_in_valid_json_keeps_its_backslashes():
+    text = '{"answer": "use \\frac{a}{b} and \\theta"}'
+    assert has_latex_escapes(text)
+    parsed, repairs = repair_json(text)
+    assert parsed == {"answer": "use \\frac{a}{b} and \\theta"}
+    assert "latex_backslash" in repairs
+
+def test_real_escapes_are_not_latex():
+    assert not has_latex_escapes('{"text": "line one\\nline two\\ttabbed"}')
+    assert not has_latex_escapes('{"answer": "\\\\frac{a}{b}"}') # already escaped
+    assert repair_json('{"text": "a\\nb"}') == ({"text": "a\nb"}, [])
+
+def test_invalid_latex_escape():
+    parsed, repairs = repair_json('{"answer": "\\alpha + \\beta"}')
+    assert parsed == {"answer": "\\alpha + \\beta"}
+    assert "invalid_escape" in repairs and "latex_backslash" in repairs
+
+def test_code_fence_and_surrounding_text():
+    parsed, repairs = repair_json('Here you go:\n```json\n{"a": 1}\n```\nDone.')
+    assert parsed == {"a": 1}
+    assert "code_fence" in repairs
+
+def test_trailing_comma_single_quotes_and_python_literals():
+    parsed, repairs = repair_json("{'a': True, 'b': None, 'c': [1, 2,],}")
+    assert parsed == {"a": True, "b": None, "c": [1, 2]}
+    assert {"single_quotes", "python_literal", "trailing_comma"} <= set(repairs)
+
+def test_unescaped_inner_quotes_and_newlines():
+    parsed, repairs = repair_json('{"text": "he said "hi"\nthen left"}')
+    assert parsed == {"text": 'he said "hi"\nthen left'}
+    assert {"inner_quote", "control_character"} <= set(repairs)
+
+def test_truncated_reply_is_closed():
+    parsed, repairs = repair_json('{"thoughts": "working", "tool_calls": [{"name": "read_file"')
+    assert parsed == {"thoughts": "working", "tool_calls": [{"name": "read_file"}]}
+    assert "truncated" in repairs
+
+def test_value_cut_off_is_not_completed():
+    parsed, repairs = repair_json('{"thoughts": "write it", "tool_calls": [{"name": "write_file", "args": '
+                                  '{"path": "solution.py", "content": "def f(x):\n    return x *')
+    assert parsed is None
+    assert "truncated" in repairs
+    assert repair_json('{"thoughts": "working", "tool_calls": [{"name": ')[0] is None
+
+def test_unclosed_think_recovers_only_the_object():
+    parsed, repairs = repair_json('<think>maybe {"a": 2} first... {"answer": "\\theta"}')
+    assert parsed == {"answer": "\\theta"}
+    assert "unclosed_think" in repairs
+
+def test_no_object():
+    assert repair_json("I cannot answer that")[0] is None
+
+if __name__ == "__main__":
+    test_valid_json_is_parsed_as_is()
+    test_latex_in_valid_json_keeps_its_backslashes()
+    test_real_escapes_are_not_latex()
+    test_invalid_latex_escape()
+    test_code_fence_and_surrounding_text()
+    test_trailing_comma_single_quotes_and_python_literals()
+    test_unescaped_inner_quotes_and_newlines()
+    test_truncated_reply_is_closed()
+    test_value_cut_off_is_not_completed()
+    test_unclosed_think_recovers_only_the_object()
+    test_no_object()
@@ -0,0 +1,83 @@
+import asyncio
+import time
+from contextlib import contextmanager
+from unittest import mock
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+from agent.multi_agent import memory_prefetch, get_relevant_memories
+from agent.multi_agent.memory_prefetch import MemoryPrefetcher
+
+@contextmanager
+def prefetching(delays: dict = None, run: dict = None):
+    """Retrievals return one memory named after the query context, after the delay set for that context."""
+    calls, delays, run = [], delays or {}, run or {"id": "run_1"}
+    async def aget_relevant_memories(messages, exclude_ids=None, agent=None):
+        context = get_relevant_memories.memory_query_context(messages)
+        calls.append(context)
+        await asyncio.sleep(delays.get(context, 0))
+        memories = [{"id": context, "content": f"about {context}"}]
+        return memories, [context], get_relevant_memories.format_memories(memories)
+    with mock.patch.multiple(get_relevant_memories, aget_relevant_memories=aget_relevant_memories, MEMORY_ENABLE_RETRIEVAL=True), \
+         mock.patch.multiple(memory_prefetch, PREFETCH_ENABLE=True, PREFETCH_DEADLINE_SECONDS=0.2,
+                             get_current_run_timestamp=lambda: run["id"]), \
+         mock.patch.object(MemoryPrefetcher, "_instance", None):
+        yield MemoryPrefetcher(), calls
+
+def messages(text: str) -> list:
+    return [SystemMessage(content="system"), AIMessage(content="call"), HumanMessage(content=text)]
+
+def context(text: str) -> str:
+    return get_relevant_memories.memory_query_context(messages(text))
+
+def test_prefetch_is_joined():
+    with prefetching() as (prefetcher, calls):
+        prefetcher.start("coder_agent", messages("a"), [])
+        memories, ids, _ = prefetcher.join("coder_agent", messages("a"), [])
+        assert ids == [context("a")]
+        assert calls == [context("a")]
+        assert prefetcher.get_stats()["mismatched"] == 0
+
+def test_changed_context_retrieves_again():
+    with prefetching() as (prefetcher, calls):
+        prefetcher.start("coder_agent", messages("a"), [])
+        memories, ids, _ = prefetcher.join("coder_agent", messages("b"), [])
+        assert context("b") in ids
+        assert calls[-1] == context("b")
+        assert prefetcher.get_stats()["mismatched"] == 1
+
+def test_missed_deadline_hands_late_memories_to_the_next_join():
+    with prefetching(delays={context("slow"): 0.5}) as (prefetcher, calls):
+        prefetcher.start("coder_agent", messages("slow"), [])
+        started = time.monotonic()
+        memories, ids, _ = prefetcher.join("coder_agent", messages("slow"), [])
+        assert memories == [] and time.monotonic() - started < 0.45
+        assert prefetcher.get_stats()["timed_out"] == 1
+        time.sleep(0.5)
+        memories, ids, _ = asyncio.run(prefetcher.ajoin("coder_agent", messages("next"), []))
+        assert set(ids) == {context("slow"), context("next")}
+        assert prefetcher.get_stats()["late_memories"] == 1
+
+def test_late_memories_of_an_earlier_run_are_dropped():
+    run = {"id": "run_1"}
+    with prefetching(delays={context("slow"): 0.5}, run=run) as (prefetcher, calls):
+        prefetcher.start("coder_agent", messages("slow"), [])
+        prefetcher.join("coder_agent", messages("slow"), [])
+        time.sleep(0.5)
+        run["id"] = "run_2"
+        memories, ids, _ = prefetcher.join("coder_agent", messages("next"), [])
+        assert ids == [context("next")]
+        assert prefetcher.get_stats()["late_memories"] == 0
+
+def test_late_memories_already_given_are_not_repeated():
+    with prefetching(delays={context("slow"): 0.5}) as (prefetcher, calls):
+        prefetcher.start("coder_agent", messages("slow"), [])
+        prefetcher.join("coder_agent", messages("slow"), [])
+        time.sleep(0.5)
+        memories, ids, _ = prefetcher.join("coder_agent", messages("next"), [context("slow")])
+        assert ids == [context("next")]
+
+if __name__ == "__main__":
+    test_prefetch_is_joined()
+    test_changed_context_retrieves_again()
+    test_missed_deadline_hands_late_memories_to_the_next_join()
+    test_late_memories_of_an_earlier_run_are_dropped()
+    test_late_memories_already_given_are_not_repeated()
@@ -0,0 +1,63 @@
+from agent.rate_limiter import TokenBucket, AIMD_DECREASE_FACTOR
+
+def test_concurrent_rate_limit_errors_decrease_once():
+    bucket = TokenBucket("test")
+    for _ in range(30):
+        bucket.reserve()
+    for _ in range(6): # the 429s of requests that were in flight together
+        bucket.on_rate_limit_error(backoff_seconds=5)
+    assert bucket.rpm == 30 * AIMD_DECREASE_FACTOR
+    assert bucket.stats["rate_limit_errors"] == 6
+    assert bucket.stats["rate_decreases"] == 1
+    waits = [bucket.reserve() for _ in range(10)]
+    assert max(waits) < 60
+
+def test_additive_increase_recovers_unlimited():
+    bucket = TokenBucket("test")
+    for _ in range(30):
+        bucket.reserve()
+    bucket.on_rate_limit_error()
+    assert bucket.rpm == 15
+    bucket.on_success()
+    assert bucket.rpm == 16
+    for _ in range(20):
+        bucket.on_success()
+    assert bucket.rpm is None
+
+def test_additive_increase_stops_at_configured_limit():
+    bucket = TokenBucket("test", rpm=10)
+    for _ in range(10):
+        bucket.reserve()
+    bucket.on_rate_limit_error()
+    assert bucket.rpm == 5
+    for _ in range(20):
+        bucket.on_success()
+    assert bucket.rpm == 10
+
+def test_next_backoff_window_decreases_again():
+    bucket = TokenBucket("test", rpm=40)
+    for _ in range(40):
+        bucket.reserve()
+    bucket.on_rate_limit_error()
+    bucket._decrease_window_end = 0.0 # the backoff window has passed
+    bucket.on_rate_limit_error()
+    assert bucket.rpm == 10
+    assert bucket.stats["rate_decreases"] == 2
+
+def test_learned_limit_is_the_increase_target():
+    bucket = TokenBucket("test")
+    bucket.update_from_headers({"x-ratelimit-limit-requests": "20"})
+    assert bucket.rpm == bucket.limit_rpm == 20
+    for _ in range(20):
+        bucket.reserve()
+    bucket.on_rate_limit_error()
+    for _ in range(20):
+        bucket.on_success()
+    assert bucket.rpm == 20
+
+if __name__ == "__main__":
+    test_concurrent_rate_limit_errors_decrease_once()
+    test_additive_increase_recovers_unlimited()
+    test_additive_increase_stops_at_configured_limit()
+    test_next_backoff_window_decreases_again()
+    test_learned_limit_is_the_increase_target()